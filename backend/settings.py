@@ -16,6 +16,7 @@ from pathlib import Path
 from django.utils.translation import gettext_lazy as _
 from dotenv import load_dotenv
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 
 
@@ -208,6 +209,34 @@ if DEBUG:
         print("🔍 Using local SQLite database")
 
 
+# Cache
+# Deployed workers share a file-based cache so versioned responses (e.g. the
+# sales dashboards) see each other's invalidations; local runs stay in memory.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem' if ENVIRONMENT == 'local' else 'file')
+if CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/dararab-cache'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a cached dashboard response lives (0 = until the next sales write)
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', '3600')) or None
+# Seconds a prebuilt bootstrap bundle lives (0 = until one of its source tables changes)
+BOOTSTRAP_CACHE_TIMEOUT = int(os.getenv('BOOTSTRAP_CACHE_TIMEOUT', '86400')) or None
+# Seconds a stored response is replayed to retries with the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', '86400'))
+# Seconds a stock snapshot must lie in the past: longer than any transaction writing stock movements
+STOCK_SNAPSHOT_MARGIN = int(os.getenv('STOCK_SNAPSHOT_MARGIN', '900'))
+
+
 
 
 
@@ -296,6 +325,8 @@ if CORS_ALLOWED_ORIGINS_ENV:
 
 
 CORS_ALLOW_CREDENTIALS = True
+# Retried POSTs carry an Idempotency-Key (see common.idempotency)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 
 
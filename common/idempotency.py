@@ -0,0 +1,112 @@
+"""
+Idempotency-Key support for create endpoints.
+
+A POST sent with an ``Idempotency-Key`` header runs once per (user, key).
+The key is claimed by inserting its IdempotencyKey row in the same
+transaction as the write, so a concurrent retry waits on the unique index
+until the first request commits and then gets its stored response; if the
+request fails (an exception or a 5xx) the claim is rolled back with the
+write and the key can be used again. Retries are answered from the stored
+status and body, with an ``Idempotent-Replayed: true`` header, without
+running the view. Reusing a key for a different request is refused with
+422. Keys live for settings.IDEMPOTENCY_KEY_TTL seconds;
+purge_idempotency_keys deletes the expired rows.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+def request_hash(request):
+    """Fingerprint of what a request asks for: method, path and body."""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _replay(record):
+    return Response(record.response_body, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def _claim(request, key, digest):
+    """The new IdempotencyKey row for this request, or the Response to send instead."""
+    now = timezone.now()
+    # A second pass follows an expired (or just purged) row making way
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=request.user, key=key, request_hash=digest,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                )
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if record is None:
+            continue
+        if record.expires_at <= now:
+            record.delete()
+            continue
+        if record.request_hash != digest:
+            return Response(
+                {"detail": f"This {HEADER} was already used for a different request."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        return _replay(record)
+    return Response(
+        {"detail": f"Could not claim this {HEADER}; retry the request."}, status=status.HTTP_409_CONFLICT,
+    )
+
+
+def run_once(request, handler):
+    """Run ``handler()`` (returning a Response) at most once per the request's Idempotency-Key."""
+    key = request.headers.get(HEADER)
+    if not key:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {"detail": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    with transaction.atomic():
+        claimed = _claim(request, key, request_hash(request))
+        if isinstance(claimed, Response):
+            return claimed
+        response = handler()
+        if response.status_code >= 500:
+            # Nothing to replay: drop the claim so the client can retry
+            transaction.set_rollback(True)
+            return response
+        claimed.status_code = response.status_code
+        claimed.response_body = response.data
+        claimed.save(update_fields=['status_code', 'response_body'])
+    return response
+
+
+def idempotent(post):
+    """Decorator for an APIView's ``post``: run it at most once per Idempotency-Key (see run_once)."""
+    @functools.wraps(post)
+    def wrapper(self, request, *args, **kwargs):
+        return run_once(request, lambda: post(self, request, *args, **kwargs))
+    return wrapper
+
+
+class IdempotentCreateMixin:
+    """The same for generic create views that inherit their ``post``."""
+
+    def post(self, request, *args, **kwargs):
+        return run_once(request, lambda: super(IdempotentCreateMixin, self).post(request, *args, **kwargs))
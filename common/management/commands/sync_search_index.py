@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from common.search import INDEXES
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the normalized search index (SearchToken) from the indexed models, "
+        "or report objects whose tokens are out of date with --check."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report objects whose indexed tokens are stale; exit with an error if any are found.",
+        )
+        parser.add_argument('--index', action='append', dest='labels', choices=sorted(INDEXES),
+                            help="Limit to the given index (repeatable).")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Objects reindexed per transaction.")
+
+    def handle(self, *args, **options):
+        indexes = [INDEXES[label] for label in options['labels'] or sorted(INDEXES)]
+
+        if options['check']:
+            stale = 0
+            for index in indexes:
+                drift = index.find_drift(options['chunk_size'])
+                stale += len(drift)
+                if drift:
+                    self.stdout.write(f"{index.label}: " + ", ".join(str(pk) for pk in drift[:50]))
+            if stale:
+                raise CommandError(f"{stale} object(s) have a stale search index")
+            self.stdout.write(self.style.SUCCESS("Search index is up to date."))
+            return
+
+        for index in indexes:
+            tokens = index.rebuild(options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {index.label} search index: {tokens} token(s)."))
@@ -1,5 +1,10 @@
-from django.db import models
+import threading
+from contextlib import contextmanager
+
+from django.db import IntegrityError, connections, models, transaction
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
 
 class ListType(models.Model):
     name_en = models.CharField(max_length=100)
@@ -40,3 +45,178 @@ class ListItem(models.Model):
         name_ar = self.display_name_ar or "No Arabic Name"
         name_en = self.display_name_en or "No English Name"
         return f"{name_ar} / {name_en}"
+
+
+class SearchToken(models.Model):
+    """
+    One normalized character n-gram (or whole word) of an indexed object's
+    text, with the weight of the field it came from. Maintained by
+    common.search.SearchIndex.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, related_name='+')
+    object_id = models.PositiveBigIntegerField()
+    token = models.CharField(max_length=64)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            # Matching: token IN (...) grouped by object
+            models.Index(fields=['content_type', 'token', 'object_id'], name='search_token_lookup_idx'),
+            # Reindexing, and per-object rank sums read from the index alone
+            models.Index(fields=['content_type', 'object_id', 'token', 'weight'], name='search_token_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type_id}:{self.object_id} {self.token}"
+
+
+_counter_connections = threading.local()
+
+
+def _counter_connection(alias):
+    """
+    This thread's second connection to ``alias``, for taking counter values
+    outside the caller's transaction. None where there is no transaction to
+    stay out of, and on SQLite, which has one writer at a time anyway.
+    """
+    caller = connections[alias]
+    if not caller.in_atomic_block or caller.vendor == 'sqlite':
+        return None
+    connection = getattr(_counter_connections, alias, None)
+    if connection is None:
+        connection = connections.create_connection(alias)
+        setattr(_counter_connections, alias, connection)
+    else:
+        connection.close_if_unusable_or_obsolete()
+    return connection
+
+
+def close_counter_connections():
+    """
+    Close this thread's counter connections. Django's own request cleanup
+    only knows the connections in ``connections``, so common.signals calls
+    this when a request finishes; a worker thread never holds more than one
+    connection per database between requests.
+    """
+    for connection in vars(_counter_connections).values():
+        connection.close()
+    vars(_counter_connections).clear()
+
+
+class Sequence(models.Model):
+    """
+    A named counter handing out ids before the INSERT, so a row can be
+    written once with values derived from its own id (see Invoice).
+    """
+    name = models.CharField(max_length=64, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
+
+    @classmethod
+    def allocate(cls, name, count=1, floor=None):
+        """
+        Reserve ``count`` consecutive values and return them as a range. A
+        counter that does not exist yet starts after ``floor()`` (e.g. the
+        table's current MAX(id)). Inside a transaction the values are taken
+        and committed on a connection of their own, so the counter row is
+        locked only for that short transaction, not the caller's; values
+        taken by a transaction that rolls back are skipped (ids have gaps).
+        """
+        connection = _counter_connection(cls.objects.db)
+        if connection is not None:
+            return cls._allocate_apart(connection, name, count, floor)
+        with transaction.atomic():
+            counter = cls.objects.filter(name=name)
+            if not counter.update(last_value=models.F('last_value') + count):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(name=name, last_value=(floor() if floor else 0) + count)
+                except IntegrityError:
+                    # Another request created it first
+                    counter.update(last_value=models.F('last_value') + count)
+            last = counter.values_list('last_value', flat=True).get()
+        return range(last - count + 1, last + 1)
+
+    @classmethod
+    def advance(cls, name, value):
+        """
+        Move counter ``name`` up to at least ``value``, for rows written with
+        an id of their own, so allocate() never hands that id out again. A
+        counter that does not exist yet is left alone: it starts after
+        ``floor()`` when first used. Like allocate(), runs on the counter
+        connection inside a transaction.
+        """
+        connection = _counter_connection(cls.objects.db)
+        if connection is None:
+            cls.objects.filter(name=name, last_value__lt=value).update(last_value=value)
+            return
+        quote = connection.ops.quote_name
+        table, column, key = quote(cls._meta.db_table), quote('last_value'), quote(cls._meta.pk.column)
+        with _apart(connection) as cursor:
+            cursor.execute(f"UPDATE {table} SET {column} = %s WHERE {key} = %s AND {column} < %s", [value, name, value])
+
+    @classmethod
+    def _allocate_apart(cls, connection, name, count=1, floor=None):
+        """allocate() in a transaction of its own on ``connection``."""
+        quote = connection.ops.quote_name
+        table, value = quote(cls._meta.db_table), quote('last_value')
+        key = quote(cls._meta.pk.column)
+        update = f"UPDATE {table} SET {value} = {value} + %s WHERE {key} = %s"
+        with _apart(connection) as cursor:
+            cursor.execute(update, [count, name])
+            if not cursor.rowcount:
+                # The floor is read on the caller's connection
+                start = floor() if floor else 0
+                savepoint = connection.savepoint()
+                try:
+                    cursor.execute(f"INSERT INTO {table} ({key}, {value}) VALUES (%s, %s)", [name, start + count])
+                except IntegrityError:
+                    # Another request created it first
+                    connection.savepoint_rollback(savepoint)
+                    cursor.execute(update, [count, name])
+            cursor.execute(f"SELECT {value} FROM {table} WHERE {key} = %s", [name])
+            last = cursor.fetchone()[0]
+        return range(last - count + 1, last + 1)
+
+
+@contextmanager
+def _apart(connection):
+    """A cursor in a transaction of its own on ``connection``, committed on success."""
+    connection.set_autocommit(False)
+    try:
+        with connection.cursor() as cursor:
+            yield cursor
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        connection.set_autocommit(True)
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a create request sent with an ``Idempotency-Key`` header,
+    replayed to retries of it until ``expires_at``. Maintained by
+    common.idempotency; purge_idempotency_keys deletes expired rows.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_key_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key}"
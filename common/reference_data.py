@@ -0,0 +1,120 @@
+"""
+Process-local registry of ListType/ListItem reference data.
+
+The lookup lists are small and rarely edited, so each process loads every
+row once and answers lookups by code, (code, value) and id from memory.
+ListType/ListItem writes bump a version stamp in the shared cache (see
+common.signals); every worker compares it on access and reloads when it
+has moved, so an edit made through one worker reaches the others.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ListItem
+
+VERSION_KEY = 'common:reference_data:version'
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so an evicted stamp never repeats an old value
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+class ReferenceData:
+    """
+    One snapshot of the list tables. Instances are shared between requests
+    and must be treated as read-only.
+    """
+
+    def __init__(self, items):
+        self.by_id = {}
+        self.by_code = {}
+        self.by_value = {}
+        for item in items:
+            code = item.list_type.code
+            self.by_id[item.pk] = item
+            if item.is_active:
+                self.by_code.setdefault(code, []).append(item)
+            # Lowest id wins, as filter(value__iexact=...).first() did
+            self.by_value.setdefault((code, item.value.casefold()), item)
+
+    def items(self, code, order_by='id'):
+        """
+        Active items of a list type, sorted by the given ListItem attribute;
+        text case-insensitively, as ORDER BY under MySQL's collation did.
+        """
+        def key(item):
+            value = getattr(item, order_by)
+            if value is None or isinstance(value, str):
+                return (value or '').casefold()
+            return value
+        return sorted(self.by_code.get(code, ()), key=key)
+
+    def get(self, code, value):
+        """The item of a list type whose value matches case-insensitively, or None."""
+        return self.by_value.get((code, value.casefold()))
+
+    def get_by_id(self, pk):
+        return self.by_id.get(pk)
+
+
+_lock = threading.Lock()
+_registry = None
+_registry_version = None
+
+
+def get_registry():
+    """Return the current snapshot, reloading it if another process changed the lists."""
+    global _registry, _registry_version
+    version = get_version()
+    registry = _registry
+    if registry is not None and _registry_version == version:
+        return registry
+    with _lock:
+        if _registry is None or _registry_version != version:
+            # Inactive items are kept for id/value lookups; FKs may still point at them
+            items = ListItem.objects.select_related('list_type').order_by('id')
+            _registry, _registry_version = ReferenceData(items), version
+        return _registry
+
+
+def reset():
+    """Drop this process's snapshot so the next access reloads it."""
+    global _registry
+    with _lock:
+        _registry = None
+
+
+def invalidate():
+    """
+    Reload locally on next access, and bump the shared version once the
+    current transaction commits so the other workers follow.
+    """
+    reset()
+    transaction.on_commit(bump_version)
+
+
+def items(code, order_by='id'):
+    return get_registry().items(code, order_by)
+
+
+def get(code, value):
+    return get_registry().get(code, value)
+
+
+def get_by_id(pk):
+    return get_registry().get_by_id(pk)
@@ -0,0 +1,21 @@
+from django.core.signals import request_finished
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import reference_data
+from .models import ListItem, ListType, close_counter_connections
+
+
+# ======== Reference data registry ========
+@receiver(post_save, sender=ListType)
+@receiver(post_delete, sender=ListType)
+@receiver(post_save, sender=ListItem)
+@receiver(post_delete, sender=ListItem)
+def reference_data_changed(sender, **kwargs):
+    reference_data.invalidate()
+
+
+# ======== Sequence counter connections ========
+@receiver(request_finished)
+def request_done(sender, **kwargs):
+    close_counter_connections()
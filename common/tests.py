@@ -1,3 +1,161 @@
-from django.test import TestCase
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+
+from . import reference_data
+from .models import ListItem, ListType, Sequence, _counter_connection, _counter_connections
+from .search import document_tokens, normalize, query_tokens
+
+User = get_user_model()
+
+
+class ReferenceDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        cls.statuses = ListType.objects.create(name_en='Contract Status', name_ar='حالة العقد', code='contract_status')
+        cls.closed = ListItem.objects.create(
+            list_type=cls.statuses, value='Closed', display_name_en='Closed', display_name_ar='مغلق'
+        )
+        cls.active = ListItem.objects.create(
+            list_type=cls.statuses, value='active', display_name_en='Active', display_name_ar='نشط'
+        )
+        cls.retired = ListItem.objects.create(
+            list_type=cls.statuses, value='retired', display_name_en='Retired', display_name_ar='متقاعد',
+            is_active=False,
+        )
+
+    def setUp(self):
+        cache.clear()
+        reference_data.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_lookups_are_served_from_one_load(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(reference_data.get('contract_status', 'closed'), self.closed)
+            self.assertEqual(reference_data.get('contract_status', 'CLOSED'), self.closed)
+            self.assertIsNone(reference_data.get('contract_status', 'missing'))
+            self.assertEqual(reference_data.get_by_id(self.retired.pk), self.retired)
+            self.assertEqual(reference_data.items('contract_status'), [self.closed, self.active])
+            self.assertEqual(
+                reference_data.items('contract_status', order_by='value'), [self.active, self.closed]
+            )
+            self.assertEqual(reference_data.items('unknown'), [])
+
+    def test_writes_reload_this_process(self):
+        reference_data.get_registry()
+        self.retired.is_active = True
+        self.retired.save()
+        self.assertIn(self.retired, reference_data.items('contract_status'))
+
+        self.active.delete()
+        self.assertIsNone(reference_data.get('contract_status', 'active'))
+
+    def test_version_bump_reloads_other_processes(self):
+        reference_data.get_registry()
+        # Another worker's write: rows change and the shared stamp moves on commit
+        ListItem.objects.filter(pk=self.active.pk).update(display_name_en='Open')
+        with self.assertNumQueries(0):
+            self.assertEqual(reference_data.get_by_id(self.active.pk).display_name_en, 'Active')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ListType.objects.filter(pk=self.statuses.pk).first().save()
+        reference_data.get_registry()  # this process reloads on the local reset
+        ListItem.objects.filter(pk=self.active.pk).update(display_name_en='Renamed')
+        reference_data.bump_version()
+        self.assertEqual(reference_data.get_by_id(self.active.pk).display_name_en, 'Renamed')
+
+    def test_list_items_by_type(self):
+        reference_data.get_registry()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/common/list-items/contract_status/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['value'] for row in response.data['results']], ['active', 'Closed'])
+
+    def test_text_ordering_ignores_case(self):
+        ListItem.objects.create(
+            list_type=self.statuses, value='Blocked', display_name_en='blocked', display_name_ar='محظور'
+        )
+        for order_by in ('value', 'display_name_en'):
+            self.assertEqual(
+                [item.value for item in reference_data.items('contract_status', order_by=order_by)],
+                ['active', 'Blocked', 'Closed'], order_by,
+            )
+        self.assertEqual(
+            [item.value for item in reference_data.items('contract_status')], ['Closed', 'active', 'Blocked'],
+        )
+
+
+class SearchNormalizationTests(SimpleTestCase):
+    def test_arabic_variants_fold_together(self):
+        self.assertEqual(normalize('أَلْفُ لَيْلَةٍ وَلَيْلَة'), normalize('الف ليله وليله'))
+        self.assertEqual(normalize('إسلام آمنة'), 'اسلام امنه')
+        self.assertEqual(normalize('مؤسسة شاطئ مستشفى'), 'موسسه شاطي مستشفي')
+        self.assertEqual(normalize('كتـــاب'), 'كتاب')
+
+    def test_digits_and_isbn(self):
+        self.assertEqual(normalize('ISBN ٩٧٨-٩٩٤٨-٠٠'), 'isbn 978994800')
+        self.assertEqual(normalize('978 9948 00'), '978994800')
+        self.assertEqual(normalize('The Book (2nd ed.)'), 'the book 2nd ed')
+
+    def test_query_tokens_match_document_tokens(self):
+        document = document_tokens('Harry Potter')
+        for query in ('harry', 'pott', 'ha', 'p', 'POTTER harry'):
+            required, ranking = query_tokens(query)
+            self.assertTrue(required <= document, query)
+        self.assertFalse(query_tokens('tt')[0] <= document)
+        self.assertIn('=potter', document)
+
+
+class SequenceTests(TransactionTestCase):
+    def test_values_are_taken_outside_the_callers_transaction(self):
+        apart = connections.create_connection('default')
+        self.addCleanup(apart.close)
+        with transaction.atomic():
+            ids = Sequence._allocate_apart(apart, 'test', 3, floor=lambda: 10)
+            transaction.set_rollback(True)
+        self.assertEqual(list(ids), [11, 12, 13])
+        # Committed on their own: the caller's rollback does not hand them out again
+        self.assertEqual(Sequence.objects.get(name='test').last_value, 13)
+        self.assertEqual(list(Sequence._allocate_apart(apart, 'test', 2)), [14, 15])
+        self.assertEqual(list(Sequence.allocate('test')), [16])
+
+    def test_a_counter_created_meanwhile_is_advanced(self):
+        apart = connections.create_connection('default')
+        self.addCleanup(apart.close)
+
+        def create_first(execute, sql, params, many, context):
+            if sql.startswith('INSERT'):
+                # Another request creates the counter between the UPDATE and the INSERT
+                execute(sql, ['test', 20], many, context)
+            return execute(sql, params, many, context)
+
+        with apart.execute_wrapper(create_first):
+            ids = Sequence._allocate_apart(apart, 'test', 2, floor=lambda: 10)
+        self.assertEqual(list(ids), [21, 22])
+        self.assertEqual(Sequence.objects.get(name='test').last_value, 22)
+
+    def test_allocate_uses_one_counter_connection_per_thread_until_the_request_ends(self):
+        # SQLite gets no counter connection; take the MySQL branch
+        wrapper = type(connections['default'])
+        with patch.object(wrapper, 'vendor', 'mysql'):
+            with transaction.atomic():
+                first = Sequence.allocate('test', 2, floor=lambda: 4)
+                apart = _counter_connection('default')
+                second = Sequence.allocate('test')
+                self.assertIs(_counter_connection('default'), apart)
+                transaction.set_rollback(True)
+            self.assertIsNone(_counter_connection('default'))
+        self.assertEqual((list(first), list(second)), ([5, 6], [7]))
+        self.assertEqual(Sequence.objects.get(name='test').last_value, 7)
+
+        with patch.object(apart, 'close', wraps=apart.close) as close:
+            request_finished.send(sender=self.__class__)
+        close.assert_called_once_with()
+        self.assertFalse(vars(_counter_connections))
@@ -3,6 +3,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.db.models import ProtectedError
 
+from . import reference_data
 from .models import ListType, ListItem
 from .serializers import ListTypeSerializer, ListItemSerializer
 
@@ -58,4 +59,4 @@ class ListItemByTypeView(generics.ListAPIView):
 
     def get_queryset(self):
         type_code = self.kwargs.get("code")
-        return ListItem.objects.filter(list_type__code=type_code, is_active=True).order_by('value')
+        return reference_data.items(type_code, order_by='value')
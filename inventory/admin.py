@@ -4,7 +4,7 @@ from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 from .models import (
     Author, PrintRun, PrintTask, Stakeholder, Translator, RightsOwner, Reviewer,
-    Project, Contract, Product, Warehouse, Inventory, Transfer
+    Project, Contract, Product, Warehouse, Inventory, StockMovement, Transfer
 )
 from common.models import ListItem
 
@@ -135,6 +135,20 @@ class TransferAdmin(admin.ModelAdmin):
     list_display = ('id', 'product', 'from_warehouse', 'to_warehouse', 'quantity', 'transfer_date')
     list_filter = ('from_warehouse', 'to_warehouse')
 
+# ========== Stock ledger ==========
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('id', 'ts', 'product', 'warehouse', 'kind', 'quantity', 'reference_id')
+    list_filter = ('kind', 'warehouse')
+    raw_id_fields = ('product',)
+
+    # Append-only: corrections are new movements
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 # ========== People ==========
 @admin.register(Author)
 class AuthorAdmin(admin.ModelAdmin):
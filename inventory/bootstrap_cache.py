@@ -0,0 +1,106 @@
+"""
+Prebuilt payloads for the bootstrap endpoints.
+
+Each bundle (inventory, projects, contracts) is rendered once to JSON bytes,
+gzip-compressed and stored in the cache together with a strong ETag. The key
+includes a version stamp per source table the bundle reads, so a write to any
+of them (see inventory.signals, and common.signals for the list tables) makes
+the next request rebuild it, while untouched bundles keep being served as is.
+"""
+import gzip
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+from common import reference_data
+
+SOURCE_KEY = 'inventory:bootstrap:source:%s'
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def _version_key(source):
+    # The list tables already carry the reference-data registry's stamp
+    if source == 'list_items':
+        return reference_data.VERSION_KEY
+    return SOURCE_KEY % source
+
+
+def get_versions(sources):
+    keys = [_version_key(source) for source in sources]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Seed from the clock so an evicted stamp never repeats an old value
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(source):
+    key = _version_key(source)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidate(source):
+    """Bump the source's version once the current transaction commits."""
+    transaction.on_commit(lambda: bump_version(source))
+
+
+def build_entry(data):
+    body = JSONRenderer().render(data)
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    return {
+        'etag': f'"{digest}"',
+        'gzip_etag': f'"{digest}-gz"',
+        'body': body,
+        # mtime=0 keeps the compressed bytes stable across rebuilds
+        'gzip': gzip.compress(body, mtime=0),
+    }
+
+
+def _etag_matches(request, etags):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = {tag.removeprefix('W/') for tag in parse_etags(header)}
+    return '*' in candidates or not candidates.isdisjoint(etags)
+
+
+def cached_bundle(request, bundle, sources, build):
+    """
+    Serve the JSON of ``build()`` (a dict that must not depend on the request)
+    from the cache, gzip-encoded when the client accepts it. A matching
+    If-None-Match yields a 304.
+    """
+    versions = get_versions(sources)
+    key = f'inventory:bootstrap:{bundle}:' + ':'.join(str(version) for version in versions)
+
+    entry = cache.get(key)
+    if entry is None:
+        entry = build_entry(build())
+        cache.set(key, entry, timeout=getattr(settings, 'BOOTSTRAP_CACHE_TIMEOUT', None))
+
+    use_gzip = bool(ACCEPTS_GZIP.search(request.headers.get('Accept-Encoding', '')))
+    etag = entry['gzip_etag'] if use_gzip else entry['etag']
+    if _etag_matches(request, (entry['etag'], entry['gzip_etag'])):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entry['gzip'] if use_gzip else entry['body'], content_type='application/json')
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+        response['Content-Length'] = str(len(response.content))
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Cache-Control'] = 'private, no-cache'
+    return response
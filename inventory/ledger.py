@@ -0,0 +1,197 @@
+"""
+Append-only stock ledger.
+
+Every change of a (product, warehouse) balance is a signed StockMovement:
+print run receipts, sales (InvoiceItem), returns, transfers and manual
+adjustments. Inventory.quantity is the materialized running total and is
+written in the same transaction as the movements:
+
+- record() appends movements and adds their net deltas to Inventory with
+  F() updates; transfers, sales, returns and receipts go through it.
+- log() only appends, for writes that set Inventory.quantity themselves
+  (the inventory views and the stocktake upsert); the movement is the
+  difference they made.
+
+StockSnapshot rows hold every non-zero balance at a point in time, so
+balances_as_of() reads the latest snapshot plus the movements since instead
+of the whole ledger. A movement's ts is set when it is built, not when it
+commits, so snapshots are only taken at least settings.STOCK_SNAPSHOT_MARGIN
+in the past: a movement still committing then is stamped after the snapshot
+and read on top of it. snapshot_stock takes one; sync_stock_ledger reports or
+repairs drift between Inventory.quantity and the ledger.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Max, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import Inventory, StockMovement, StockSnapshot
+
+BATCH_SIZE = 1000
+
+
+def net_deltas(movements):
+    deltas = defaultdict(int)
+    for movement in movements:
+        deltas[movement.product_id, movement.warehouse_id] += movement.quantity
+    return {pair: delta for pair, delta in deltas.items() if delta}
+
+
+def change(kind, before, after, reference_id=None, user_id=None):
+    """
+    Movements that take a source row's stock effect from ``before`` to
+    ``after``. Each is a (product_id, warehouse_id, quantity) effect, or None
+    when the row did not exist / no longer exists.
+    """
+    deltas = defaultdict(int)
+    if before:
+        deltas[before[0], before[1]] -= before[2]
+    if after:
+        deltas[after[0], after[1]] += after[2]
+    return [
+        StockMovement(product_id=product_id, warehouse_id=warehouse_id, quantity=quantity, kind=kind,
+                      reference_id=reference_id, created_by_id=user_id)
+        for (product_id, warehouse_id), quantity in deltas.items()
+        if quantity and product_id and warehouse_id
+    ]
+
+
+def apply_deltas(deltas, user_id=None, existing=None):
+    """
+    Add {(product_id, warehouse_id): delta} to Inventory.quantity in one
+    UPDATE, creating the rows that do not exist yet. ``existing`` is the set of
+    pairs the caller already knows to have a row.
+    """
+    deltas = {pair: delta for pair, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    pairs = sorted(deltas)
+    missing = pairs if existing is None else [pair for pair in pairs if pair not in existing]
+    if missing:
+        # Created at zero and then updated like the rest, so a row another
+        # request creates first is not overwritten
+        Inventory.objects.bulk_create(
+            [
+                Inventory(product_id=product_id, warehouse_id=warehouse_id, quantity=0,
+                          created_by_id=user_id, updated_by_id=user_id)
+                for product_id, warehouse_id in missing
+            ],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+    Inventory.objects.filter(
+        reduce(or_, (Q(product_id=product_id, warehouse_id=warehouse_id) for product_id, warehouse_id in pairs))
+    ).update(
+        quantity=F('quantity') + Case(
+            *(
+                When(product_id=product_id, warehouse_id=warehouse_id, then=Value(deltas[product_id, warehouse_id]))
+                for product_id, warehouse_id in pairs
+            ),
+            default=Value(0),
+        ),
+        updated_by_id=user_id,
+        updated_at=timezone.now(),
+    )
+
+
+def log(movements):
+    """Append movements whose effect is already in Inventory.quantity."""
+    movements = [
+        movement for movement in movements
+        if movement.quantity and movement.product_id and movement.warehouse_id
+    ]
+    if movements:
+        StockMovement.objects.bulk_create(movements, batch_size=BATCH_SIZE)
+    return movements
+
+
+def record(movements, user_id=None, existing=None):
+    """Append movements and apply them to Inventory.quantity, atomically."""
+    with transaction.atomic():
+        movements = log(movements)
+        apply_deltas(net_deltas(movements), user_id=user_id, existing=existing)
+    return movements
+
+
+def _scoped(queryset, product_ids, warehouse_ids):
+    if product_ids is not None:
+        queryset = queryset.filter(product_id__in=product_ids)
+    if warehouse_ids is not None:
+        queryset = queryset.filter(warehouse_id__in=warehouse_ids)
+    return queryset
+
+
+def balances_as_of(at=None, product_ids=None, warehouse_ids=None):
+    """
+    {(product_id, warehouse_id): quantity} of the non-zero balances just
+    before ``at`` (every movement when None): the latest snapshot taken at or
+    before ``at`` plus the movements since.
+    """
+    snapshots = StockSnapshot.objects.all()
+    movements = StockMovement.objects.all()
+    if at is not None:
+        snapshots = snapshots.filter(taken_at__lte=at)
+        movements = movements.filter(ts__lt=at)
+    taken_at = snapshots.aggregate(latest=Max('taken_at'))['latest']
+
+    balances = defaultdict(int)
+    if taken_at is not None:
+        rows = _scoped(StockSnapshot.objects.filter(taken_at=taken_at), product_ids, warehouse_ids)
+        for product_id, warehouse_id, quantity in rows.values_list('product_id', 'warehouse_id', 'quantity'):
+            balances[product_id, warehouse_id] = quantity
+        movements = movements.filter(ts__gte=taken_at)
+
+    deltas = (
+        _scoped(movements, product_ids, warehouse_ids)
+        .values('product_id', 'warehouse_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('product_id', 'warehouse_id', 'total')
+        .order_by()
+    )
+    for product_id, warehouse_id, total in deltas:
+        balances[product_id, warehouse_id] += total
+    return {pair: quantity for pair, quantity in balances.items() if quantity}
+
+
+def snapshot_cutoff():
+    """The latest time a snapshot can be taken at (see the module docstring)."""
+    return timezone.now() - timedelta(seconds=settings.STOCK_SNAPSHOT_MARGIN)
+
+
+def take_snapshot(at):
+    """Store the balances just before ``at``; returns the number of rows, or None if one exists."""
+    if at > snapshot_cutoff():
+        raise ValueError(
+            f"Snapshots must be at least {settings.STOCK_SNAPSHOT_MARGIN}s old; "
+            "movements stamped before then may still be committing."
+        )
+    with transaction.atomic():
+        if StockSnapshot.objects.filter(taken_at=at).exists():
+            return None
+        rows = StockSnapshot.objects.bulk_create(
+            (
+                StockSnapshot(product_id=product_id, warehouse_id=warehouse_id, taken_at=at, quantity=quantity)
+                for (product_id, warehouse_id), quantity in sorted(balances_as_of(at).items())
+            ),
+            batch_size=BATCH_SIZE,
+        )
+    return len(rows)
+
+
+def find_drift():
+    """{(product_id, warehouse_id): (stored, ledger)} where Inventory.quantity disagrees with the ledger."""
+    ledger = balances_as_of()
+    stored = {
+        (product_id, warehouse_id): quantity
+        for product_id, warehouse_id, quantity in Inventory.objects.values_list('product_id', 'warehouse_id', 'quantity')
+    }
+    return {
+        pair: (stored.get(pair, 0), ledger.get(pair, 0))
+        for pair in stored.keys() | ledger.keys()
+        if stored.get(pair, 0) != ledger.get(pair, 0)
+    }
@@ -0,0 +1,139 @@
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from inventory.models import Inventory, Product, Transfer, Warehouse
+from inventory.pagination import KeysetPagination
+from inventory.views import InventoryListCreateView, TransferListCreateView
+from sales.models import Customer, Invoice
+from sales.views import InvoiceListCreateView
+
+
+@contextmanager
+def explicit_created_at(*models):
+    """Let bulk_create keep the created_at values it is given."""
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare page-number (OFFSET) and keyset (?cursor=) pagination of the "
+        "invoice, transfer and inventory lists at a deep page. Everything runs in "
+        "a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=30000, help="Invoices and transfers to generate.")
+        parser.add_argument('--warehouses', type=int, default=10, help="Inventory rows per product.")
+        parser.add_argument('--page', type=int, default=1000)
+        parser.add_argument('--page-size', type=int, default=25)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        page, page_size = options['page'], options['page_size']
+        with transaction.atomic():
+            self.seed(rng, options)
+            targets = [
+                ('invoices', InvoiceListCreateView.as_view(), '/api/sales/invoices/', Invoice.objects.all()),
+                ('transfers', TransferListCreateView.as_view(), '/api/inventory/transfers/', Transfer.objects.all()),
+                ('inventory', InventoryListCreateView.as_view(), '/api/inventory/inventory/', Inventory.objects.all()),
+            ]
+            for label, view, url, queryset in targets:
+                # The cursor a client holds after following `next` to the page
+                before = queryset.order_by('-created_at', 'id')[(page - 1) * page_size - 1]
+                cursor = KeysetPagination().encode_cursor(before)
+                self.measure(f'{label} page 1', view, url, {'page_size': page_size}, options['repeat'])
+                self.measure(f'{label} page {page} (offset)', view, url,
+                             {'page_size': page_size, 'page': page}, options['repeat'])
+                self.measure(f'{label} page {page} (cursor)', view, url,
+                             {'page_size': page_size, 'cursor': cursor}, options['repeat'])
+            transaction.set_rollback(True)
+
+    def seed(self, rng, options):
+        self.user = get_user_model().objects.create(username=f'benchmark-{time.time_ns()}')
+        rows = options['rows']
+        warehouses = Warehouse.objects.bulk_create(
+            Warehouse(name_en=f'Warehouse {n}', name_ar=f'Warehouse {n}', location='Benchmark')
+            for n in range(options['warehouses'])
+        )
+        products = Product.objects.bulk_create(
+            (Product(isbn=f'bench-{n}', title_ar=f'Book {n}', title_en=f'Book {n}')
+             for n in range(rows // len(warehouses) + 1)),
+            batch_size=1000,
+        )
+        customer = Customer.objects.create(institution_name='Benchmark', contact_person='Benchmark')
+
+        now = timezone.now()
+
+        def created_at(n):
+            # Roughly a row a minute going back in time, with the odd tie
+            return now - timedelta(seconds=60 * n + rng.choice((0, 0, 0, 1)))
+
+        with explicit_created_at(Invoice, Transfer, Inventory):
+            Invoice.objects.bulk_create(
+                (Invoice(customer=customer, warehouse=rng.choice(warehouses), created_at=created_at(n))
+                 for n in range(rows)),
+                batch_size=1000,
+            )
+            Transfer.objects.bulk_create(
+                (
+                    Transfer(
+                        product=rng.choice(products), from_warehouse=warehouses[0], to_warehouse=warehouses[1],
+                        quantity=rng.randint(1, 50), shipping_cost=Decimal('1.00'), transfer_date=now,
+                        created_at=created_at(n),
+                    )
+                    for n in range(rows)
+                ),
+                batch_size=1000,
+            )
+            Inventory.objects.bulk_create(
+                (
+                    Inventory(product=product, warehouse=warehouse, quantity=rng.randint(0, 50),
+                              created_at=created_at(n))
+                    for n, (product, warehouse) in enumerate(
+                        (product, warehouse) for product in products for warehouse in warehouses
+                    )
+                ),
+                batch_size=1000,
+            )
+        self.stdout.write(
+            f"Seeded {rows} invoices, {rows} transfers and {len(products) * len(warehouses)} inventory rows."
+        )
+
+    def measure(self, label, view, url, params, repeat):
+        # Pagination builds absolute links, so use a host ALLOWED_HOSTS accepts
+        factory = APIRequestFactory(SERVER_NAME='127.0.0.1')
+        timings, queries = [], 0
+        for _ in range(repeat):
+            request = factory.get(url, params)
+            force_authenticate(request, user=self.user)
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = len(ctx.captured_queries)
+            assert response.status_code == 200, (label, response.status_code)
+        self.stdout.write(
+            f"{label:<32} queries={queries:<4} median={statistics.median(timings):8.1f} ms  "
+            f"min={min(timings):8.1f} ms"
+        )
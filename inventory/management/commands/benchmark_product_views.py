@@ -0,0 +1,118 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from inventory import search
+from inventory.models import Inventory, PrintRun, Product, Warehouse
+from inventory.views import POSProductViewSet, ProductSummaryView
+
+
+class Command(BaseCommand):
+    help = (
+        "Report query count and latency of the product summary and POS product "
+        "lists against a generated catalog. Everything runs in a transaction that "
+        "is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--editions', type=int, default=5, help="Print runs per product.")
+        parser.add_argument('--warehouses', type=int, default=10, help="Inventory rows per product.")
+        parser.add_argument('--page-size', type=int, default=25)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            warehouse = self.seed(rng, options)
+            page = {'page_size': options['page_size']}
+            last_page = {**page, 'page': max(1, options['products'] // options['page_size'])}
+            targets = [
+                ('product summary', ProductSummaryView.as_view(), '/api/inventory/product-summary/', page),
+                ('product summary (last page)', ProductSummaryView.as_view(), '/api/inventory/product-summary/',
+                 last_page),
+                ('product summary by price', ProductSummaryView.as_view(), '/api/inventory/product-summary/',
+                 {**page, 'ordering': '-latest_price'}),
+                ('product summary search', ProductSummaryView.as_view(), '/api/inventory/product-summary/',
+                 {**page, 'search': 'Book 1'}),
+                ('product summary search (narrow)', ProductSummaryView.as_view(), '/api/inventory/product-summary/',
+                 {**page, 'search': 'Book 1234'}),
+                ('pos products search', POSProductViewSet.as_view({'get': 'list'}), '/api/inventory/pos-product-summary/',
+                 {**page, 'warehouse_id': warehouse.id, 'search': 'Book 12'}),
+                ('pos products search (broad)', POSProductViewSet.as_view({'get': 'list'}),
+                 '/api/inventory/pos-product-summary/', {**page, 'warehouse_id': warehouse.id, 'search': 'Book 1'}),
+                ('pos products', POSProductViewSet.as_view({'get': 'list'}), '/api/inventory/pos-product-summary/',
+                 {**page, 'warehouse_id': warehouse.id}),
+            ]
+            for label, view, url, params in targets:
+                self.measure(label, view, url, params, options['repeat'])
+            transaction.set_rollback(True)
+
+    def seed(self, rng, options):
+        self.user = get_user_model().objects.create(username=f'benchmark-{time.time_ns()}')
+        warehouses = Warehouse.objects.bulk_create(
+            Warehouse(name_en=f'Warehouse {n}', name_ar=f'Warehouse {n}', location='Benchmark')
+            for n in range(options['warehouses'])
+        )
+        products = Product.objects.bulk_create(
+            (Product(isbn=f'bench-{n}', title_ar=f'Book {n}', title_en=f'Book {n}') for n in range(options['products'])),
+            batch_size=1000,
+        )
+        first_published = date(2015, 1, 1)
+        PrintRun.objects.bulk_create(
+            (
+                PrintRun(
+                    product=product, edition_number=edition, price=Decimal(rng.randint(500, 3000)) / 100,
+                    price_omr=Decimal(rng.randint(200, 1200)) / 100,
+                    published_at=first_published + timedelta(days=365 * edition + rng.randrange(300)),
+                )
+                for product in products
+                for edition in range(1, options['editions'] + 1)
+            ),
+            batch_size=1000,
+        )
+        # bulk_create skips the print run signals
+        Product.objects.filter(pk__in=[product.pk for product in products]).refresh_current_print_run()
+        Inventory.objects.bulk_create(
+            (
+                Inventory(product=product, warehouse=warehouse, quantity=rng.randint(0, 50))
+                for product in products
+                for warehouse in warehouses
+            ),
+            batch_size=1000,
+        )
+        # bulk_create skips the search index signals too
+        search.products.rebuild()
+        self.stdout.write(
+            f"Seeded {len(products)} products x {options['editions']} editions x "
+            f"{len(warehouses)} warehouses."
+        )
+        return warehouses[0]
+
+    def measure(self, label, view, url, params, repeat):
+        # Pagination builds absolute links, so use a host ALLOWED_HOSTS accepts
+        factory = APIRequestFactory(SERVER_NAME='127.0.0.1')
+        timings, queries = [], 0
+        for _ in range(repeat):
+            request = factory.get(url, params)
+            force_authenticate(request, user=self.user)
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = len(ctx.captured_queries)
+            assert response.status_code == 200, (label, response.status_code)
+        self.stdout.write(
+            f"{label:<32} queries={queries:<4} median={statistics.median(timings):8.1f} ms  "
+            f"min={min(timings):8.1f} ms"
+        )
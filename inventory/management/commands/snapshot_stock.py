@@ -0,0 +1,37 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inventory import ledger
+
+
+def _datetime(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid datetime {value!r}; expected ISO 8601 (YYYY-MM-DD[THH:MM]).")
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Store every stock balance at a point in time (by default the start of "
+        "today), so as-of queries read the snapshot plus the movements since. "
+        "Meant to run from cron, e.g. nightly, at least STOCK_SNAPSHOT_MARGIN "
+        "seconds after midnight."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--at', type=_datetime, help="Snapshot time (default: the start of today).")
+
+    def handle(self, *args, **options):
+        at = options['at'] or timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+        try:
+            written = ledger.take_snapshot(at)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if written is None:
+            self.stdout.write(f"A snapshot at {at.isoformat()} already exists.")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Snapshot at {at.isoformat()}: {written} balance(s)."))
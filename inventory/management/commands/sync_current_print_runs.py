@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Product.current_edition / current_price / current_price_omr from "
+        "the print runs, or report drift between stored and computed values with --check."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report products whose stored current print run is out of date; exit with an error if any are found.",
+        )
+        parser.add_argument('--product-id', type=int, action='append', dest='product_ids',
+                            help="Limit to the given product id (repeatable).")
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['product_ids']:
+            products = products.filter(pk__in=options['product_ids'])
+        stale = products.stale_current_print_run()
+
+        if options['check']:
+            if stale:
+                self.stdout.write("Stale products: " + ", ".join(str(pk) for pk in stale[:50]))
+                raise CommandError(
+                    f"{len(stale)} product(s) have a stale current print run"
+                    + (" (first 50 shown)" if len(stale) > 50 else "")
+                )
+            self.stdout.write(self.style.SUCCESS("All product current print runs are up to date."))
+            return
+
+        updated = products.refresh_current_print_run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed current print run for {updated} product(s); {len(stale)} had drifted."
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from inventory import ledger
+
+
+class Command(BaseCommand):
+    help = (
+        "Set Inventory.quantity to the balance of the stock ledger wherever they "
+        "disagree, or only report the drift with --check."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report balances that disagree with the ledger; exit with an error if any are found.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = ledger.find_drift()
+            if drift and not options['check']:
+                ledger.apply_deltas({pair: expected - stored for pair, (stored, expected) in drift.items()})
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Inventory matches the stock ledger."))
+            return
+        if options['check']:
+            for (product_id, warehouse_id), (stored, expected) in sorted(drift.items())[:50]:
+                self.stdout.write(f"product={product_id} warehouse={warehouse_id} stored={stored} ledger={expected}")
+            raise CommandError(
+                f"{len(drift)} balance(s) disagree with the stock ledger"
+                + (" (first 50 shown)" if len(drift) > 50 else "")
+            )
+        self.stdout.write(self.style.SUCCESS(f"Corrected {len(drift)} balance(s) from the stock ledger."))
@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-16 23:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_listitem_created_by_listitem_updated_by_and_more'),
+        ('inventory', '0014_contract_royalties_type_product_language_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='printrun',
+            index=models.Index(fields=['product', 'published_at'], name='printrun_product_published_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-16 23:31
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_current_print_run(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    PrintRun = apps.get_model('inventory', 'PrintRun')
+    latest = PrintRun.objects.filter(product=OuterRef('pk')).order_by('-edition_number', '-published_at', '-pk')
+    Product.objects.update(
+        current_edition=Subquery(latest.values('edition_number')[:1]),
+        current_price=Subquery(latest.values('price')[:1]),
+        current_price_omr=Subquery(latest.values('price_omr')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_listitem_created_by_listitem_updated_by_and_more'),
+        ('inventory', '0015_printrun_product_published_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='current_edition',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='current_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='current_price_omr',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['current_price'], name='product_current_price_idx'),
+        ),
+        migrations.RunPython(fill_current_print_run, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+from common.search import document_tokens
+
+INDEXES = {
+    'product': {'title_ar': 3, 'title_en': 3, 'isbn': 3, 'author__name': 1, 'translator__name': 1},
+    'project': {'title_ar': 3, 'title_original': 3},
+}
+
+
+def build_search_index(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    SearchToken = apps.get_model('common', 'SearchToken')
+    for model_name, fields in INDEXES.items():
+        model = apps.get_model('inventory', model_name)
+        content_type, _ = ContentType.objects.get_or_create(app_label='inventory', model=model_name)
+        paths = list(fields)
+        batch = []
+        for pk, *values in model.objects.values_list('pk', *paths).iterator(chunk_size=1000):
+            tokens = {}
+            for path, value in zip(paths, values):
+                for token in document_tokens(value):
+                    tokens[token] = max(tokens.get(token, 0), fields[path])
+            batch.extend(
+                SearchToken(content_type_id=content_type.pk, object_id=pk, token=token, weight=weight)
+                for token, weight in tokens.items()
+            )
+            if len(batch) >= 5000:
+                SearchToken.objects.bulk_create(batch)
+                batch = []
+        SearchToken.objects.bulk_create(batch)
+
+
+def clear_search_index(apps, schema_editor):
+    SearchToken = apps.get_model('common', 'SearchToken')
+    SearchToken.objects.filter(content_type__app_label='inventory', content_type__model__in=list(INDEXES)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0003_search_token'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('inventory', '0016_product_current_print_run'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_search_index, clear_search_index),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2 on 2026-10-17 00:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def open_ledger(apps, schema_editor):
+    # Today's balances become the ledger's opening movements
+    Inventory = apps.get_model('inventory', 'Inventory')
+    StockMovement = apps.get_model('inventory', 'StockMovement')
+    now = django.utils.timezone.now()
+    StockMovement.objects.bulk_create(
+        (
+            StockMovement(product_id=product_id, warehouse_id=warehouse_id, quantity=quantity, kind='opening', ts=now)
+            for product_id, warehouse_id, quantity in Inventory.objects.exclude(quantity=0)
+            .order_by('pk').values_list('product_id', 'warehouse_id', 'quantity').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0018_keyset_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ts', models.DateTimeField(default=django.utils.timezone.now)),
+                ('quantity', models.IntegerField()),
+                ('kind', models.CharField(choices=[('opening', 'Opening balance'), ('receipt', 'Print run receipt'), ('sale', 'Sale'), ('return', 'Return'), ('transfer_out', 'Transfer out'), ('transfer_in', 'Transfer in'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('reference_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.product')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.warehouse')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'warehouse', 'ts'], name='stock_movement_pair_ts_idx'), models.Index(fields=['ts'], name='stock_movement_ts_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('quantity', models.IntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.product')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.warehouse')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('taken_at', 'product', 'warehouse'), name='stock_snapshot_unique')],
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models import OuterRef, Subquery
 from django.conf import settings
+from django.utils import timezone
 from common.models import ListItem
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -140,6 +142,41 @@ class Project(AuditModel):
         ]
 
 # 📦 Product
+class ProductQuerySet(models.QuerySet):
+    def with_current_print_run(self):
+        """
+        Annotate expected_edition / expected_price / expected_price_omr from the
+        product's current print run (highest edition, then latest publication).
+        """
+        latest = PrintRun.objects.filter(product=OuterRef('pk')).order_by(*PrintRun.CURRENT_ORDER)
+        return self.annotate(
+            expected_edition=Subquery(latest.values('edition_number')[:1]),
+            expected_price=Subquery(latest.values('price')[:1]),
+            expected_price_omr=Subquery(latest.values('price_omr')[:1]),
+        )
+
+    def refresh_current_print_run(self):
+        """
+        Copy the current print run's edition and prices onto current_edition,
+        current_price and current_price_omr in a single UPDATE. Products without
+        print runs are reset to null. Returns the number of rows updated.
+        """
+        latest = PrintRun.objects.filter(product=OuterRef('pk')).order_by(*PrintRun.CURRENT_ORDER)
+        return self.update(
+            current_edition=Subquery(latest.values('edition_number')[:1]),
+            current_price=Subquery(latest.values('price')[:1]),
+            current_price_omr=Subquery(latest.values('price_omr')[:1]),
+        )
+
+    def stale_current_print_run(self):
+        """Ids of products whose stored current_* columns disagree with their print runs."""
+        rows = self.with_current_print_run().values_list(
+            'pk', 'current_edition', 'current_price', 'current_price_omr',
+            'expected_edition', 'expected_price', 'expected_price_omr',
+        )
+        return [row[0] for row in rows if row[1:4] != row[4:]]
+
+
 class Product(AuditModel):
     project= models.ForeignKey(Project, on_delete=models.SET_NULL, null=True, blank=True)
     isbn= models.CharField(max_length=100)
@@ -158,6 +195,30 @@ class Product(AuditModel):
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Price ($)")
     price_omr = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Price (OMR)")
 
+    # Copied from the current print run (see ProductQuerySet.refresh_current_print_run)
+    current_edition = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    current_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    current_price_omr = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+
+    CURRENT_PRINT_RUN_FIELDS = ('current_edition', 'current_price', 'current_price_omr')
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['current_price'], name='product_current_price_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never overwrite the copied print run columns from a possibly stale
+            # instance; they are owned by refresh_current_print_run().
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.CURRENT_PRINT_RUN_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.title_ar or self.isbn
 # PrintRun
@@ -170,10 +231,14 @@ class PrintRun(AuditModel):
     published_at= models.DateField()
     notes= models.TextField(blank=True)
 
+    # The product's current print run is the first one in this order
+    CURRENT_ORDER = ('-edition_number', '-published_at', '-pk')
+
     class Meta:
         ordering = ['product', 'edition_number']
         indexes = [
             models.Index(fields=['product','edition_number']),  # composite index
+            models.Index(fields=['product', 'published_at'], name='printrun_product_published_idx'),  # edition in effect at a date
         ]
 
     def __str__(self):
@@ -203,6 +268,8 @@ class Inventory(AuditModel):
         verbose_name_plural = "Inventories"
         indexes = [
             models.Index(fields=['product']),   # explicit index
+            # Keyset pagination (inventory.pagination.KeysetPagination)
+            models.Index(fields=['-created_at', 'id'], name='inventory_created_id_idx'),
         ]
 
     def __str__(self):
@@ -210,6 +277,67 @@ class Inventory(AuditModel):
         warehouse_name = str(self.warehouse) if self.warehouse else "No Warehouse"
         return f"{product_name} @ {warehouse_name}"
 
+# 📒 Stock ledger
+class StockMovement(models.Model):
+    """
+    One signed change of a (product, warehouse) balance. The ledger is
+    append-only; Inventory.quantity is its running total, written in the same
+    transaction (see inventory.ledger).
+    """
+    class Kind(models.TextChoices):
+        OPENING = 'opening', 'Opening balance'
+        RECEIPT = 'receipt', 'Print run receipt'
+        SALE = 'sale', 'Sale'
+        RETURN = 'return', 'Return'
+        TRANSFER_OUT = 'transfer_out', 'Transfer out'
+        TRANSFER_IN = 'transfer_in', 'Transfer in'
+        ADJUSTMENT = 'adjustment', 'Adjustment'
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='+')
+    ts = models.DateTimeField(default=timezone.now)
+    quantity = models.IntegerField()
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    # Id of the PrintRun, InvoiceItem, Return or Transfer behind the movement
+    reference_id = models.PositiveBigIntegerField(null=True, blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'warehouse', 'ts'], name='stock_movement_pair_ts_idx'),
+            # Deltas since the latest snapshot, across all pairs
+            models.Index(fields=['ts'], name='stock_movement_ts_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Stock movements are append-only; record a correcting movement instead.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d} of product {self.product_id} @ warehouse {self.warehouse_id}"
+
+
+class StockSnapshot(models.Model):
+    """
+    Ledger balance of every non-zero (product, warehouse) pair just before
+    ``taken_at``, so as-of queries only add the movements since.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='+')
+    taken_at = models.DateTimeField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['taken_at', 'product', 'warehouse'], name='stock_snapshot_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} of product {self.product_id} @ warehouse {self.warehouse_id} at {self.taken_at}"
+
 # 🔄 Transfer
 class Transfer(AuditModel):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -219,6 +347,12 @@ class Transfer(AuditModel):
     shipping_cost = models.DecimalField(max_digits=10, decimal_places=2)
     transfer_date = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            # Keyset pagination (inventory.pagination.KeysetPagination)
+            models.Index(fields=['-created_at', 'id'], name='transfer_created_id_idx'),
+        ]
+
     def __str__(self):
         product_name = str(self.product) if self.product else "No Product"
         from_warehouse = str(self.from_warehouse) if self.from_warehouse else "No Warehouse"
@@ -1,7 +1,154 @@
 # inventory/pagination.py
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 25
     page_size_query_param = 'page_size'
     max_page_size = 1000
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over (created_at, id), newest first.
+
+    The opaque cursor holds the created_at and id of the row a page continues
+    from, so every page is one indexed range read of page_size + 1 rows: no
+    COUNT(*) and no OFFSET, however deep the client goes. Responses carry
+    next/previous links but no count. The queryset's ordering is replaced by
+    -created_at, id; models paged this way index those columns in that order.
+    """
+    cursor_query_param = 'cursor'
+    page_size = StandardResultsSetPagination.page_size
+    page_size_query_param = StandardResultsSetPagination.page_size_query_param
+    max_page_size = StandardResultsSetPagination.max_page_size
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        if reverse:
+            # Walk backwards from the cursor, then restore the display order
+            queryset = queryset.order_by('created_at', '-id')
+            if position is not None:
+                created_at, pk = position
+                queryset = queryset.filter(created_at__gte=created_at).filter(
+                    Q(created_at__gt=created_at) | Q(id__lt=pk)
+                )
+        else:
+            queryset = queryset.order_by('-created_at', 'id')
+            if position is not None:
+                created_at, pk = position
+                # The created_at__lte bound gives the planner a plain index range
+                queryset = queryset.filter(created_at__lte=created_at).filter(
+                    Q(created_at__lt=created_at) | Q(id__gt=pk)
+                )
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, position is not None
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size,
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def decode_cursor(self, request):
+        """Return ((created_at, id) or None, reverse) for the request's cursor."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            created_at, pk, reverse = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position = (datetime.fromisoformat(created_at), int(pk))
+        except (TypeError, ValueError, UnicodeEncodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(reverse)
+
+    def encode_cursor(self, row, reverse=False):
+        payload = json.dumps([row.created_at.isoformat(), row.pk, int(reverse)], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+
+    def _link(self, cursor):
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # The rows around the cursor are gone; start over from the first page
+            return self._link('')
+        return self._link(self.encode_cursor(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self._link('')
+        return self._link(self.encode_cursor(self.page[0], reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class KeysetOrPageNumberPagination(StandardResultsSetPagination):
+    """
+    Page-number pagination that switches to KeysetPagination when the request
+    carries a ``cursor`` parameter. An empty ``?cursor=`` asks for the first
+    keyset page; follow its ``next`` link from there.
+    """
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            self.display_page_controls = False
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
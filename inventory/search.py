@@ -0,0 +1,18 @@
+"""Search indexes over inventory models (see common.search)."""
+from common.search import SearchIndex
+
+from .models import Product, Project
+
+# Titles and ISBNs outrank matches on people's names
+products = SearchIndex('products', Product, {
+    'title_ar': 3,
+    'title_en': 3,
+    'isbn': 3,
+    'author__name': 1,
+    'translator__name': 1,
+})
+
+projects = SearchIndex('projects', Project, {
+    'title_ar': 3,
+    'title_original': 3,
+})
@@ -4,7 +4,7 @@ from django.core.exceptions import ValidationError
 import os
 
 from users.serializers import User, UserBasicSerializer
-from .models import (PrintRun, PrintTask, Product, Stakeholder, Warehouse, Inventory, Transfer,
+from .models import (PrintRun, PrintTask, Product, Stakeholder, StockMovement, Warehouse, Inventory, Transfer,
     Author, Translator, RightsOwner, Reviewer,
     Project, Contract
 )
@@ -91,6 +91,20 @@ class TransferSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_by', 'updated_by', 'created_at', 'updated_at']
 
 
+class StockMovementSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockMovement
+        fields = ['id', 'product', 'warehouse', 'ts', 'quantity', 'kind', 'reference_id', 'created_by']
+        read_only_fields = fields
+
+
+class StockReceiptSerializer(serializers.Serializer):
+    """Copies of a print run delivered to a warehouse."""
+    print_run_id = serializers.PrimaryKeyRelatedField(queryset=PrintRun.objects.all(), source='print_run')
+    warehouse_id = serializers.PrimaryKeyRelatedField(queryset=Warehouse.objects.all(), source='warehouse')
+    quantity = serializers.IntegerField(min_value=1)
+
+
 class AuthorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Author
@@ -403,16 +417,13 @@ class ProjectSerializer(serializers.ModelSerializer):
             return obj.all_contracts_closed
         # Fallback to direct query if annotation not available
         from .models import Contract
-        from common.models import ListItem
+        from common import reference_data
         
         contracts = Contract.objects.filter(project=obj)
         if not contracts.exists():
             return True  # No contracts means all are "closed" (none to close)
         
-        closed_status = ListItem.objects.filter(
-            list_type__code="contract_status",
-            value__iexact="closed"
-        ).first()
+        closed_status = reference_data.get("contract_status", "closed")
         
         if not closed_status:
             return False  # Can't determine if closed status exists
@@ -723,6 +734,9 @@ class POSProductSummarySerializer(ProductSummarySerializer):
         fields = ProductSummarySerializer.Meta.fields + ['warehouse_stock']
     
     def get_warehouse_stock(self, obj):
+        # Use annotated value if available (POSProductViewSet adds it)
+        if hasattr(obj, 'warehouse_stock'):
+            return obj.warehouse_stock
         warehouse_id = self.context.get('warehouse_id')
         if warehouse_id:
             try:
@@ -0,0 +1,131 @@
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from . import bootstrap_cache, ledger, search
+from .models import (
+    Author, Inventory, PrintRun, Product, Project, Reviewer, RightsOwner, StockMovement, Translator, Warehouse,
+)
+
+User = get_user_model()
+
+
+# ======== Product current print run ========
+@receiver(pre_save, sender=PrintRun)
+def print_run_before_save(sender, instance, **kwargs):
+    # A print run moved to another product changes both products' current edition
+    instance._product_id_before = (
+        PrintRun.objects.filter(pk=instance.pk).values_list('product_id', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=PrintRun)
+@receiver(post_delete, sender=PrintRun)
+def print_run_changed(sender, instance, **kwargs):
+    product_ids = {instance.product_id, getattr(instance, '_product_id_before', None)} - {None}
+    Product.objects.filter(pk__in=product_ids).refresh_current_print_run()
+
+
+# ======== Stock ledger ========
+@receiver(pre_save, sender=Inventory)
+def inventory_before_save(sender, instance, **kwargs):
+    # A balance written directly is logged as an adjustment by the difference
+    instance._stock_before = (
+        Inventory.objects.filter(pk=instance.pk).values_list('product_id', 'warehouse_id', 'quantity').first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Inventory)
+def inventory_saved(sender, instance, **kwargs):
+    ledger.log(ledger.change(
+        StockMovement.Kind.ADJUSTMENT,
+        getattr(instance, '_stock_before', None),
+        (instance.product_id, instance.warehouse_id, instance.quantity),
+        user_id=instance.updated_by_id,
+    ))
+
+
+@receiver(post_delete, sender=Inventory)
+def inventory_deleted(sender, instance, origin=None, **kwargs):
+    # Rows deleted along with their product or warehouse take the ledger with them
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is Inventory:
+        ledger.log(ledger.change(
+            StockMovement.Kind.ADJUSTMENT, (instance.product_id, instance.warehouse_id, instance.quantity), None,
+        ))
+
+
+# ======== Search index ========
+@receiver(post_save, sender=Product)
+def product_search_changed(sender, instance, **kwargs):
+    search.products.reindex([instance.pk])
+
+
+@receiver(post_save, sender=Project)
+def project_search_changed(sender, instance, **kwargs):
+    search.projects.reindex([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Project)
+def search_object_deleted(sender, instance, **kwargs):
+    index = search.products if sender is Product else search.projects
+    index.remove([instance.pk])
+
+
+def _products_of(person):
+    # Product.author / Product.translator share the person model's name
+    field = person._meta.model_name
+    return Product.objects.filter(**{f'{field}_id': person.pk}).values_list('pk', flat=True)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Translator)
+def person_search_changed(sender, instance, created, **kwargs):
+    # Product documents carry author and translator names
+    if not created:
+        search.products.reindex(_products_of(instance))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Translator)
+def person_before_delete(sender, instance, **kwargs):
+    # The products' foreign keys are nulled without signals
+    instance._search_product_ids = list(_products_of(instance))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Translator)
+def person_deleted(sender, instance, **kwargs):
+    search.products.reindex(getattr(instance, '_search_product_ids', ()))
+
+
+# ======== Bootstrap bundles ========
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Translator)
+@receiver(post_delete, sender=Translator)
+@receiver(post_save, sender=RightsOwner)
+@receiver(post_delete, sender=RightsOwner)
+@receiver(post_save, sender=Reviewer)
+@receiver(post_delete, sender=Reviewer)
+def people_changed(sender, **kwargs):
+    bootstrap_cache.invalidate('people')
+
+
+@receiver(post_save, sender=Warehouse)
+@receiver(post_delete, sender=Warehouse)
+def warehouse_changed(sender, **kwargs):
+    bootstrap_cache.invalidate('warehouses')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, update_fields=None, **kwargs):
+    # Logins only touch last_login, which no bundle carries
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    bootstrap_cache.invalidate('users')
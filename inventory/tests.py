@@ -1,3 +1,715 @@
+import gzip
+import json
+from io import StringIO
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from common import reference_data
+from common.models import ListItem, ListType, SearchToken
+from common.search import SearchIndex
+from . import ledger
+from .models import (
+    Author, Contract, Inventory, PrintRun, Product, Project, StockMovement, StockSnapshot, Transfer, Warehouse,
+)
+
+User = get_user_model()
+
+
+class BootstrapBundleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        genres = ListType.objects.create(name_en='Genre', name_ar='النوع', code='genre')
+        cls.genre = ListItem.objects.create(
+            list_type=genres, value='novel', display_name_en='Novel', display_name_ar='رواية'
+        )
+        cls.author = Author.objects.create(name='Author')
+        cls.warehouse = Warehouse.objects.create(name_en='Main', name_ar='الرئيسي', location='Muscat')
+
+    def setUp(self):
+        cache.clear()
+        reference_data.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url='/api/inventory/bootstrap/', **headers):
+        return self.client.get(url, headers=headers)
+
+    def test_bundle_is_served_from_cache_with_etag(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        data = json.loads(first.content)
+        self.assertNotIn('product_summary', data)
+        self.assertEqual([row['name'] for row in data['authors']], ['Author'])
+        self.assertEqual([row['value'] for row in data['genres']], ['novel'])
+
+        with self.assertNumQueries(0):
+            second = self.get()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        not_modified = self.get(if_none_match=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+    def test_gzip_representation(self):
+        plain = self.get()
+        compressed = self.get(accept_encoding='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertNotEqual(compressed['ETag'], plain['ETag'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertEqual(self.get(accept_encoding='gzip', if_none_match=compressed['ETag']).status_code, 304)
+
+    def test_source_writes_rebuild_only_affected_bundles(self):
+        inventory = self.get()
+        contracts = self.get('/api/inventory/contracts/bootstrap/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Warehouse.objects.create(name_en='Second', name_ar='الثاني', location='Sohar')
+        rebuilt = self.get()
+        self.assertNotEqual(rebuilt['ETag'], inventory['ETag'])
+        self.assertEqual(len(json.loads(rebuilt.content)['warehouses']), 2)
+        self.assertEqual(self.get('/api/inventory/contracts/bootstrap/')['ETag'], contracts['ETag'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user_logged_in.send(sender=User, request=None, user=self.user)
+        self.assertEqual(self.get('/api/inventory/contracts/bootstrap/')['ETag'], contracts['ETag'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(username='signatory', first_name='New')
+        signatories = json.loads(self.get('/api/inventory/contracts/bootstrap/').content)['signatories']
+        self.assertIn('New', [row['full_name'] for row in signatories])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genre.display_name_en = 'Fiction'
+            self.genre.save()
+        self.assertEqual(json.loads(self.get().content)['genres'][0]['display_name_en'], 'Fiction')
+
+
+class ProjectListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        statuses = ListType.objects.create(name_en='Contract Status', name_ar='حالة العقد', code='contract_status')
+        cls.closed = ListItem.objects.create(
+            list_type=statuses, value='closed', display_name_en='Closed', display_name_ar='مغلق'
+        )
+        cls.open = ListItem.objects.create(
+            list_type=statuses, value='open', display_name_en='Open', display_name_ar='مفتوح'
+        )
+        cls.author = Author.objects.create(name='Author')
+        cls.author_type = ContentType.objects.get_for_model(Author)
+
+    def setUp(self):
+        cache.clear()
+        reference_data.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_projects(self, count):
+        for n in range(count):
+            project = Project.objects.create(title_ar=f'Project {n}', author=self.author)
+            if n % 2:
+                Product.objects.create(project=project, isbn=str(n), title_ar='Book', title_en='Book')
+            for status in ([self.closed], [self.closed, self.open], [self.closed, None], [])[n % 4]:
+                Contract.objects.create(
+                    project=project, content_type=self.author_type, object_id=self.author.pk,
+                    status=status, contract_type=self.open,
+                )
+
+    def get_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/inventory/projects/', {'page_size': 100, 'include_contracts': 'true'})
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_page_uses_constant_queries(self):
+        self.make_projects(4)
+        reference_data.get_registry()
+        response, small = self.get_page()
+        rows = {row['title_ar']: row for row in response.data['results']}
+        # Closed only; one open; one without status; none at all
+        self.assertEqual(
+            [rows[f'Project {n}']['all_contracts_closed'] for n in range(4)], [True, False, False, True]
+        )
+        self.assertEqual([rows[f'Project {n}']['has_product'] for n in range(4)], [False, True, False, True])
+
+        self.make_projects(96)
+        response, large = self.get_page()
+        self.assertEqual(len(response.data['results']), 100)
+        self.assertEqual(large, small)
+
+
+class POSProductQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        cls.till = Warehouse.objects.create(name_en='Till', name_ar='نقطة البيع', location='Muscat')
+        cls.store = Warehouse.objects.create(name_en='Store', name_ar='المخزن', location='Sohar')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_products(self, start, count):
+        for n in range(start, start + count):
+            product = Product.objects.create(isbn=str(n), title_ar=f'Book {n}', title_en=f'Book {n}')
+            for edition in (1, 2):
+                PrintRun.objects.create(
+                    product=product, edition_number=edition, price=5, price_omr=2, published_at=date(2024, edition, 1)
+                )
+            Inventory.objects.create(product=product, warehouse=self.till, quantity=n % 3)
+            Inventory.objects.create(product=product, warehouse=self.store, quantity=7)
+
+    def get_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/inventory/pos-product-summary/', {
+                'warehouse_id': self.till.pk, 'page_size': 100,
+            })
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_page_reads_warehouse_stock_in_two_queries(self):
+        self.make_products(0, 6)
+        response, queries = self.get_page()
+        self.assertEqual(queries, 2)
+        # Products without stock in the till are left out, the others appear once
+        self.assertEqual(
+            [(row['isbn'], row['warehouse_stock']) for row in response.data['results']],
+            [('1', 1), ('2', 2), ('4', 1), ('5', 2)],
+        )
+
+        self.make_products(6, 60)
+        response, queries = self.get_page()
+        self.assertEqual(response.data['count'], 44)
+        self.assertEqual(queries, 2)
+
+
+class ProductSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_aggregates_do_not_multiply(self):
+        product = Product.objects.create(isbn='1', title_ar='كتاب', title_en='Book')
+        Product.objects.create(isbn='2', title_ar='كتاب', title_en='Unstocked')
+        for edition, price in ((1, 5), (2, 8), (3, 9)):
+            PrintRun.objects.create(
+                product=product, edition_number=edition, price=price, price_omr=2, published_at=date(2024, edition, 1)
+            )
+        for n, quantity in enumerate((3, 4)):
+            warehouse = Warehouse.objects.create(name_en=f'W{n}', name_ar=f'W{n}', location='Muscat')
+            Inventory.objects.create(product=product, warehouse=warehouse, quantity=quantity)
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/inventory/product-summary/')
+        rows = [(row['editions_count'], row['stock'], row['latest_price']) for row in response.data['results']]
+        self.assertEqual(rows, [(3, 7, '9.00'), (0, 0, None)])
+
+
+class ProductCurrentPrintRunTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(isbn='1', title_ar='كتاب', title_en='Book')
+
+    def make_run(self, edition, price, product=None):
+        return PrintRun.objects.create(
+            product=product or self.product, edition_number=edition, price=price, price_omr=price / 2,
+            published_at=date(2020 + edition, 1, 1),
+        )
+
+    def current(self, product=None):
+        product = Product.objects.get(pk=(product or self.product).pk)
+        return product.current_edition, product.current_price, product.current_price_omr
+
+    def test_print_run_writes_keep_product_in_sync(self):
+        self.assertEqual(self.current(), (None, None, None))
+        self.make_run(1, 10)
+        second = self.make_run(2, 14)
+        self.assertEqual(self.current(), (2, 14, 7))
+
+        second.price = 16
+        second.save()
+        self.assertEqual(self.current()[1], 16)
+
+        other = Product.objects.create(isbn='2', title_ar='كتاب', title_en='Other')
+        second.product = other
+        second.save()
+        self.assertEqual(self.current(), (1, 10, 5))
+        self.assertEqual(self.current(other), (2, 16, 7))
+
+        second.delete()
+        self.assertEqual(self.current(other), (None, None, None))
+
+    def test_stale_product_save_does_not_clobber_the_copy(self):
+        self.make_run(1, 10)
+        stale = Product.objects.get(pk=self.product.pk)
+        self.make_run(2, 14)
+        stale.title_en = 'Renamed'
+        stale.save()
+        self.assertEqual(self.current(), (2, 14, 7))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).title_en, 'Renamed')
+
+        response = self.client.patch(f'/api/inventory/products/{self.product.pk}/', {'title_en': 'Again'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.current(), (2, 14, 7))
+        self.assertEqual(Product.objects.stale_current_print_run(), [])
+
+    def test_bulk_upsert_keeps_product_in_sync(self):
+        first = self.make_run(1, 10)
+        statuses = ListType.objects.create(name_en='Print Run Status', name_ar='الحالة', code='printrun_status')
+        status = ListItem.objects.create(list_type=statuses, value='done', display_name_en='Done', display_name_ar='تم')
+        response = self.client.post('/api/inventory/print-runs/bulk/', [
+            {'id': first.pk, 'price': '12.00'},
+            {'product_id': self.product.pk, 'edition_number': 3, 'price': '20.00', 'price_omr': '8.00',
+             'published_at': '2024-01-01', 'status_id': status.pk},
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.current(), (3, 20, 8))
+
+    def test_summary_orders_by_stored_price(self):
+        cheap = Product.objects.create(isbn='2', title_ar='كتاب', title_en='Cheap')
+        self.make_run(1, 30)
+        self.make_run(1, 5, product=cheap)
+        response = self.client.get('/api/inventory/product-summary/', {'ordering': '-latest_price'})
+        self.assertEqual(
+            [(row['isbn'], row['latest_price']) for row in response.data['results']], [('1', '30.00'), ('2', '5.00')]
+        )
+
+    def test_sync_command_reports_and_repairs_drift(self):
+        self.make_run(1, 10)
+        Product.objects.filter(pk=self.product.pk).update(current_price=99)
+        with self.assertRaises(CommandError):
+            call_command('sync_current_print_runs', '--check', stdout=StringIO())
+        call_command('sync_current_print_runs', stdout=StringIO())
+        self.assertEqual(self.current(), (1, 10, 5))
+        call_command('sync_current_print_runs', '--check', stdout=StringIO())
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        cls.author = Author.objects.create(name='نجيب محفوظ')
+        cls.nights = Product.objects.create(isbn='978-9948-00-001', title_ar='ألف ليلة وليلة', title_en='Arabian Nights')
+        cls.novel = Product.objects.create(
+            isbn='978-1-00', title_ar='الثلاثية', title_en='The Cairo Trilogy', author=cls.author
+        )
+        cls.guide = Product.objects.create(isbn='978-2-00', title_ar='دليل', title_en='A night guide to Cairo')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def summary(self, query, url='/api/inventory/product-summary/', **params):
+        response = self.client.get(url, {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_arabic_spelling_variants_and_diacritics_match(self):
+        for query in ('الف ليله', 'أَلْف لَيْلَة', 'ليلة'):
+            self.assertEqual(self.summary(query), [self.nights.pk], query)
+
+    def test_isbn_with_or_without_separators(self):
+        self.assertEqual(self.summary('9789948'), [self.nights.pk])
+        self.assertEqual(self.summary('978-9948-00'), [self.nights.pk])
+
+    def test_results_are_ranked(self):
+        # Whole-word title match first, partial match after
+        self.assertEqual(self.summary('cairo'), [self.novel.pk, self.guide.pk])
+        self.assertEqual(self.summary('night'), [self.guide.pk, self.nights.pk])
+        # An explicit ordering wins over the rank
+        self.assertEqual(self.summary('night', ordering='id'), [self.nights.pk, self.guide.pk])
+        self.assertEqual(self.summary('cairo', url='/api/inventory/pos-product-summary/'), [self.novel.pk, self.guide.pk])
+        self.assertEqual(self.summary('!!'), [])
+
+    def test_broad_queries_match_the_same_without_ranking(self):
+        queries = ['night', 'NIGHTS', 'أَلْف لَيْلَة', 'الف ليله', 'ثلاثيه', '978-9948-00', 'cairo guide', 'nightz']
+        ranked = {query: sorted(self.summary(query)) for query in queries}
+        with patch.object(SearchIndex, 'BROAD_CANDIDATES', 0):
+            for query in queries:
+                with self.subTest(query=query):
+                    self.assertEqual(sorted(self.summary(query)), ranked[query])
+        with patch.object(SearchIndex, 'BROAD_CANDIDATES', 1):
+            # "nig" is held by two products: unranked, default order
+            self.assertEqual(self.summary('night'), [self.nights.pk, self.guide.pk])
+            self.assertEqual(self.summary('night', url='/api/inventory/pos-product-summary/'),
+                             [self.nights.pk, self.guide.pk])
+
+    def test_people_names_are_searchable_and_kept_current(self):
+        self.assertEqual(self.summary('محفوظ'), [self.novel.pk])
+        self.author.name = 'Naguib Mahfouz'
+        self.author.save()
+        self.assertEqual(self.summary('mahfouz'), [self.novel.pk])
+        self.author.delete()
+        self.assertEqual(self.summary('mahfouz'), [])
+
+    def test_projects_search(self):
+        project = Project.objects.create(title_ar='مشروع الترجمة', title_original='Translation')
+        Project.objects.create(title_ar='مشروع آخر')
+        response = self.client.get('/api/inventory/projects/', {'search': 'الترجمه'})
+        self.assertEqual([row['id'] for row in response.data['results']], [project.pk])
+
+    def test_sync_command(self):
+        SearchToken.objects.filter(object_id=self.guide.pk).delete()
+        with self.assertRaises(CommandError):
+            call_command('sync_search_index', '--check', stdout=StringIO())
+        call_command('sync_search_index', stdout=StringIO())
+        call_command('sync_search_index', '--check', stdout=StringIO())
+        self.assertEqual(self.summary('guide'), [self.guide.pk])
+
+
+class KeysetPaginationTests(TestCase):
+    URL = '/api/inventory/transfers/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        product = Product.objects.create(isbn='1', title_ar='كتاب', title_en='Book')
+        source = Warehouse.objects.create(name_en='Main', name_ar='الرئيسي', location='Muscat')
+        target = Warehouse.objects.create(name_en='Shop', name_ar='المتجر', location='Sohar')
+        now = timezone.now()
+        for n in range(8):
+            transfer = Transfer.objects.create(
+                product=product, from_warehouse=source, to_warehouse=target, quantity=n + 1,
+                shipping_cost=0, transfer_date=now,
+            )
+            # Pairs share a timestamp so the id tie-break is exercised
+            Transfer.objects.filter(pk=transfer.pk).update(created_at=now - timedelta(minutes=n // 2))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def offset_order(self):
+        return [row['id'] for row in self.client.get(self.URL, {'page_size': 100}).data['results']]
+
+    def test_cursor_walks_forward_and_back(self):
+        response = self.client.get(self.URL, {'cursor': '', 'page_size': 3})
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+        pages = [[row['id'] for row in response.data['results']]]
+        while response.data['next']:
+            with self.assertNumQueries(1):
+                response = self.client.get(response.data['next'])
+            pages.append([row['id'] for row in response.data['results']])
+        self.assertEqual([pk for page in pages for pk in page], self.offset_order())
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([row['id'] for row in response.data['results']], pages[1])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([row['id'] for row in response.data['results']], pages[0])
+        self.assertIsNone(response.data['previous'])
+
+    def test_page_numbers_stay_the_default(self):
+        response = self.client.get(self.URL, {'page': 2, 'page_size': 3})
+        self.assertEqual(response.data['count'], 8)
+        self.assertEqual([row['id'] for row in response.data['results']], self.offset_order()[3:6])
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'WzEsMl0=', 'WyJ4IiwxLDBd'):
+            self.assertEqual(self.client.get(self.URL, {'cursor': cursor}).status_code, 404, cursor)
+
+
+class TransferBulkCreateTests(TestCase):
+    URL = '/api/inventory/transfers/bulk/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        cls.products = [
+            Product.objects.create(isbn=str(n), title_ar=f'كتاب {n}', title_en=f'Book {n}') for n in range(12)
+        ]
+        cls.main, cls.shop, cls.kiosk = (
+            Warehouse.objects.create(name_en=name, name_ar=name, location='Muscat') for name in ('Main', 'Shop', 'Kiosk')
+        )
+        for product in cls.products:
+            Inventory.objects.create(product=product, warehouse=cls.main, quantity=10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def transfer(self, product, source, target, quantity, **extra):
+        return {'product_id': product.pk, 'from_warehouse_id': source.pk, 'to_warehouse_id': target.pk,
+                'quantity': quantity, **extra}
+
+    def stock(self, product):
+        return dict(Inventory.objects.filter(product=product).values_list('warehouse_id', 'quantity'))
+
+    def test_items_run_in_order_against_running_balances(self):
+        book = self.products[0]
+        response = self.client.post(self.URL, {'transfers': [
+            self.transfer(book, self.main, self.shop, 6),
+            # Uses the stock the first item brought to the shop
+            self.transfer(book, self.shop, self.kiosk, 4),
+            self.transfer(book, self.main, self.shop, 5),
+            {**self.transfer(book, self.main, self.shop, 1), 'product_id': 999999},
+            self.transfer(book, self.main, self.shop, 0),
+            self.transfer(book, self.main, self.shop, 1, transfer_date='not a date'),
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['success_count'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [2, 3, 4, 5])
+        self.assertIn('Available: 4, Requested: 5', str(response.data['errors'][0]['errors']['quantity']))
+        self.assertEqual(
+            list(Transfer.objects.order_by('pk').values_list('pk', 'quantity')),
+            list(zip(response.data['created_transfer_ids'], [6, 4])),
+        )
+        self.assertEqual(self.stock(book), {self.main.pk: 4, self.shop.pk: 2, self.kiosk.pk: 4})
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def run(products):
+            payload = {'transfers': [self.transfer(product, self.main, self.shop, 1) for product in products]}
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(self.URL, payload, format='json')
+            self.assertEqual(response.status_code, 201)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(run(self.products[:2]), run(self.products))
+        for product in self.products:
+            self.assertEqual(self.stock(product)[self.shop.pk], 2 if product in self.products[:2] else 1)
+
+    def test_ids_are_read_back_without_insert_returning(self):
+        book, other = self.products[:2]
+        payload = {'transfers': [self.transfer(book, self.main, self.shop, 1)]}
+        earlier = self.client.post(self.URL, payload, format='json').data['created_transfer_ids']
+        batch = [
+            self.transfer(book, self.main, self.shop, 2),
+            self.transfer(other, self.main, self.kiosk, 3),
+            self.transfer(book, self.shop, self.kiosk, 1),
+        ]
+        # As on MySQL, which cannot report the ids of a multi-row INSERT
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(self.URL, {'transfers': batch}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "inventory_transfer"')]
+        self.assertEqual(len(inserts), 1)
+
+        ids = response.data['created_transfer_ids']
+        self.assertEqual(ids, sorted(set(Transfer.objects.values_list('pk', flat=True)) - set(earlier)))
+        self.assertEqual(
+            list(Transfer.objects.filter(pk__in=ids).order_by('pk').values_list('quantity', flat=True)), [2, 3, 1]
+        )
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(reference_id__in=ids).values_list('reference_id', 'quantity')),
+            sorted((pk, sign * quantity) for pk, quantity in zip(ids, [2, 3, 1]) for sign in (-1, 1)),
+        )
+
+    def test_retried_batch_runs_once(self):
+        payload = {'transfers': [self.transfer(self.products[0], self.main, self.shop, 3)]}
+        first = self.client.post(self.URL, payload, format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+        retry = self.client.post(self.URL, payload, format='json', HTTP_IDEMPOTENCY_KEY='batch-1')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Transfer.objects.count(), 1)
+        self.assertEqual(self.stock(self.products[0]), {self.main.pk: 7, self.shop.pk: 3})
+
+    def test_all_failed(self):
+        response = self.client.post(self.URL, {'transfers': [
+            self.transfer(self.products[0], self.shop, self.main, 1),
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transfer.objects.exists())
+        self.assertEqual(self.stock(self.products[0]), {self.main.pk: 10})
+
+
+class InventoryBulkUpsertTests(TestCase):
+    URL = '/api/inventory/inventory/bulk/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        cls.products = [
+            Product.objects.create(isbn=str(n), title_ar=f'كتاب {n}', title_en=f'Book {n}') for n in range(10)
+        ]
+        cls.main = Warehouse.objects.create(name_en='Main', name_ar='الرئيسي', location='Muscat')
+        cls.shop = Warehouse.objects.create(name_en='Shop', name_ar='المتجر', location='Sohar')
+        cls.stocked = Inventory.objects.create(product=cls.products[0], warehouse=cls.main, quantity=7)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def row(self, product, warehouse, quantity):
+        return {'product_id': product.pk, 'warehouse_id': warehouse.pk, 'quantity': quantity}
+
+    def test_upsert_reports_each_item(self):
+        first, second = self.products[:2]
+        response = self.client.post(self.URL, [
+            self.row(first, self.main, 3),
+            self.row(second, self.shop, 5),
+            self.row(second, self.shop, 6),
+            {'id': self.stocked.pk, 'quantity': 4},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        results = response.data['results']
+        self.assertEqual(
+            [(row['_action'], row.get('_old_quantity'), row['quantity']) for row in results[:3]],
+            [('updated', 7, 3), ('created', None, 5), ('updated', 5, 6)],
+        )
+        self.assertNotIn('_action', results[3])
+        self.assertEqual(results[0]['product']['id'], first.pk)
+        self.assertEqual(results[1]['warehouse']['id'], self.shop.pk)
+        self.assertEqual(
+            dict(Inventory.objects.values_list('product_id', 'quantity')), {first.pk: 4, second.pk: 6}
+        )
+
+    def test_query_count_does_not_grow_with_the_payload(self):
+        def run(warehouse, products):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(
+                    self.URL, [self.row(product, warehouse, 1) for product in products], format='json'
+                )
+            self.assertEqual(response.status_code, 200, response.data)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(run(self.main, self.products[:2]), run(self.shop, self.products))
+        self.assertEqual(Inventory.objects.filter(warehouse=self.shop).count(), len(self.products))
+
+    def test_invalid_items_fail_the_whole_payload(self):
+        response = self.client.post(self.URL, [
+            self.row(self.products[1], self.main, 1),
+            {**self.row(self.products[2], self.main, 1), 'product_id': 999999},
+            self.row(self.products[3], self.main, 'many'),
+            {'id': 999999, 'quantity': 1},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.data['errors']), ['index_1', 'index_2', 'index_3'])
+        self.assertEqual(Inventory.objects.count(), 1)
+
+
+class StockLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        cls.book = Product.objects.create(isbn='1', title_ar='كتاب', title_en='Book')
+        cls.main = Warehouse.objects.create(name_en='Main', name_ar='الرئيسي', location='Muscat')
+        cls.shop = Warehouse.objects.create(name_en='Shop', name_ar='المتجر', location='Sohar')
+        cls.print_run = PrintRun.objects.create(product=cls.book, edition_number=1, price='2.00', price_omr='1.00',
+                                                published_at=date(2024, 1, 1))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stock(self):
+        return dict(Inventory.objects.filter(product=self.book).values_list('warehouse_id', 'quantity'))
+
+    def movements(self):
+        return list(StockMovement.objects.order_by('pk').values_list('kind', 'warehouse_id', 'quantity'))
+
+    def receive(self, quantity, warehouse=None):
+        return self.client.post('/api/inventory/stock/receipts/', {
+            'print_run_id': self.print_run.pk, 'warehouse_id': (warehouse or self.main).pk, 'quantity': quantity,
+        }, format='json')
+
+    def test_every_write_is_a_movement(self):
+        response = self.receive(50)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['reference_id'], self.print_run.pk)
+
+        self.client.post('/api/inventory/transfers/bulk/', {'transfers': [
+            {'product_id': self.book.pk, 'from_warehouse_id': self.main.pk, 'to_warehouse_id': self.shop.pk,
+             'quantity': 20},
+        ]}, format='json')
+        self.client.post('/api/inventory/inventory/bulk/', [
+            {'product_id': self.book.pk, 'warehouse_id': self.shop.pk, 'quantity': 18},
+        ], format='json')
+        row = Inventory.objects.get(product=self.book, warehouse=self.main)
+        row.quantity = 31
+        row.save()
+
+        self.assertEqual(self.stock(), {self.main.pk: 31, self.shop.pk: 18})
+        self.assertEqual(self.movements(), [
+            ('receipt', self.main.pk, 50),
+            ('transfer_out', self.main.pk, -20),
+            ('transfer_in', self.shop.pk, 20),
+            ('adjustment', self.shop.pk, -2),
+            ('adjustment', self.main.pk, 1),
+        ])
+        self.assertEqual(ledger.find_drift(), {})
+
+        row.delete()
+        self.assertEqual(ledger.balances_as_of(), {(self.book.pk, self.shop.pk): 18})
+
+    def test_deleting_a_warehouse_takes_its_ledger_along(self):
+        self.receive(5, self.shop)
+        self.shop.delete()
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_as_of_reads_the_snapshot_plus_later_movements(self):
+        now = timezone.now()
+        for days_ago, quantity in [(3, 10), (2, 5), (1, -4)]:
+            StockMovement.objects.create(product=self.book, warehouse=self.main, quantity=quantity,
+                                         kind=StockMovement.Kind.ADJUSTMENT, ts=now - timedelta(days=days_ago))
+        snapshot_at = now - timedelta(days=2, hours=12)
+        call_command('snapshot_stock', '--at', snapshot_at.isoformat(), stdout=StringIO())
+        self.assertEqual(list(StockSnapshot.objects.values_list('taken_at', 'quantity')), [(snapshot_at, 10)])
+
+        # Rows before the snapshot are not read again
+        StockMovement.objects.filter(ts__lt=snapshot_at).delete()
+        pair = (self.book.pk, self.main.pk)
+        self.assertEqual(ledger.balances_as_of(now - timedelta(days=1, hours=12)), {pair: 15})
+        self.assertEqual(ledger.balances_as_of(now), {pair: 11})
+        self.assertEqual(ledger.balances_as_of(now - timedelta(days=5)), {})
+
+        response = self.client.get('/api/inventory/stock/as-of/', {
+            'at': (now - timedelta(days=1, hours=12)).isoformat(), 'warehouse_id': self.main.pk,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [
+            {'product_id': self.book.pk, 'warehouse_id': self.main.pk, 'quantity': 15},
+        ])
+        self.assertEqual(self.client.get('/api/inventory/stock/as-of/', {'at': 'yesterday'}).status_code, 400)
+
+    def test_movements_committed_after_a_snapshot_are_read(self):
+        now = timezone.now()
+        margin = timedelta(seconds=settings.STOCK_SNAPSHOT_MARGIN)
+        with self.assertRaises(CommandError):
+            call_command('snapshot_stock', '--at', (now - margin / 2).isoformat(), stdout=StringIO())
+
+        StockMovement.objects.create(product=self.book, warehouse=self.main, quantity=10,
+                                     kind=StockMovement.Kind.ADJUSTMENT, ts=now - margin * 2)
+        ledger.take_snapshot(now - margin)
+        # Stamped before it committed, but after the latest time a snapshot can have
+        StockMovement.objects.create(product=self.book, warehouse=self.main, quantity=-3,
+                                     kind=StockMovement.Kind.ADJUSTMENT, ts=now - margin / 2)
+        self.assertEqual(ledger.balances_as_of(), {(self.book.pk, self.main.pk): 7})
+        self.assertEqual(ledger.balances_as_of(now - margin / 4), {(self.book.pk, self.main.pk): 7})
 
-# Create your tests here.
+    def test_sync_repairs_drift(self):
+        self.receive(8)
+        Inventory.objects.filter(product=self.book).update(quantity=3)
+        with self.assertRaises(CommandError):
+            call_command('sync_stock_ledger', check=True, stdout=StringIO())
+        call_command('sync_stock_ledger', stdout=StringIO())
+        self.assertEqual(self.stock(), {self.main.pk: 8})
+        call_command('sync_stock_ledger', check=True, stdout=StringIO())
@@ -0,0 +1,220 @@
+"""
+Set-based engine behind TransferBulkCreateView.
+
+TransferBatch checks every id of a batch in three queries (products,
+warehouses, and the Inventory rows it will touch, locked with SELECT ... FOR
+UPDATE in (product, warehouse) order so concurrent batches queue instead of
+deadlocking). Items are then judged one by one in request order against the
+running balances, so an item may move stock an earlier item brought in and a
+failing item does not stop the rest. The result is one bulk INSERT of the
+Transfer rows and their stock movements (see inventory.ledger), which apply
+the net F() deltas to Inventory in one UPDATE.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import ledger
+from .models import Inventory, Product, StockMovement, Transfer, Warehouse
+
+
+@dataclass
+class TransferItem:
+    index: int
+    product_id: int
+    from_warehouse_id: int
+    to_warehouse_id: int
+    quantity: int
+    shipping_cost: Decimal
+    transfer_date: datetime
+
+
+def _error(detail):
+    """``detail`` in the shape a raised serializers.ValidationError reports."""
+    return serializers.ValidationError(detail).detail
+
+
+def _to_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TransferBatch:
+    def __init__(self, items, user):
+        self.raw_items = items
+        self.user = user
+        self.errors = {}
+
+    def parse(self, index, data):
+        if not isinstance(data, dict):
+            raise serializers.ValidationError({"detail": "Each transfer must be an object"})
+        product_id = data.get('product_id')
+        from_warehouse_id = data.get('from_warehouse_id')
+        to_warehouse_id = data.get('to_warehouse_id')
+        quantity = data.get('quantity', 0)
+
+        if not product_id:
+            raise serializers.ValidationError({"product_id": "Product ID is required"})
+        if not from_warehouse_id:
+            raise serializers.ValidationError({"from_warehouse_id": "From warehouse ID is required"})
+        if not to_warehouse_id:
+            raise serializers.ValidationError({"to_warehouse_id": "To warehouse ID is required"})
+        if isinstance(quantity, bool) or _to_id(quantity) is None:
+            raise serializers.ValidationError({"quantity": "Quantity must be a whole number"})
+        quantity = int(quantity)
+        if quantity <= 0:
+            raise serializers.ValidationError({"quantity": "Quantity must be greater than 0"})
+        if str(from_warehouse_id) == str(to_warehouse_id):
+            raise serializers.ValidationError({"warehouses": "From and to warehouses must be different"})
+
+        # Values the INSERT would reject fail this item only, not the batch
+        errors = {}
+        values = {}
+        for name, raw in (('shipping_cost', data.get('shipping_cost', 0)),
+                          ('transfer_date', data.get('transfer_date') or timezone.now())):
+            try:
+                values[name] = Transfer._meta.get_field(name).clean(raw, None)
+            except DjangoValidationError as e:
+                errors[name] = e.messages
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return TransferItem(
+            index=index,
+            product_id=_to_id(product_id),
+            from_warehouse_id=_to_id(from_warehouse_id),
+            to_warehouse_id=_to_id(to_warehouse_id),
+            quantity=quantity,
+            **values,
+        )
+
+    def validate_ids(self, items):
+        product_ids = {item.product_id for item in items}
+        warehouse_ids = {item.from_warehouse_id for item in items} | {item.to_warehouse_id for item in items}
+        known_products = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        known_warehouses = set(Warehouse.objects.filter(pk__in=warehouse_ids).values_list('pk', flat=True))
+
+        valid = []
+        for item in items:
+            raw = self.raw_items[item.index]
+            if item.product_id not in known_products:
+                self.errors[item.index] = _error({"product_id": f"Product with id {raw['product_id']} not found"})
+            elif item.from_warehouse_id not in known_warehouses:
+                self.errors[item.index] = _error({
+                    "from_warehouse_id": f"Warehouse with id {raw['from_warehouse_id']} not found"
+                })
+            elif item.to_warehouse_id not in known_warehouses:
+                self.errors[item.index] = _error({
+                    "to_warehouse_id": f"Warehouse with id {raw['to_warehouse_id']} not found"
+                })
+            else:
+                valid.append(item)
+        return valid
+
+    def lock_balances(self, items):
+        """Lock the Inventory rows of the batch and return {(product, warehouse): quantity}."""
+        product_ids = {item.product_id for item in items}
+        warehouse_ids = {item.from_warehouse_id for item in items} | {item.to_warehouse_id for item in items}
+        # A batch usually moves many products between two warehouses, where
+        # this product x warehouse filter is exactly the rows it touches.
+        rows = (
+            Inventory.objects.select_for_update()
+            .filter(product_id__in=product_ids, warehouse_id__in=warehouse_ids)
+            .order_by('product_id', 'warehouse_id')
+            .values_list('product_id', 'warehouse_id', 'quantity')
+        )
+        return {(product_id, warehouse_id): quantity for product_id, warehouse_id, quantity in rows}
+
+    def insert_transfers(self, items):
+        transfers = [
+            Transfer(
+                product_id=item.product_id,
+                from_warehouse_id=item.from_warehouse_id,
+                to_warehouse_id=item.to_warehouse_id,
+                quantity=item.quantity,
+                shipping_cost=item.shipping_cost,
+                transfer_date=item.transfer_date,
+                created_by=self.user,
+                updated_by=self.user,
+            )
+            for item in items
+        ]
+        started = timezone.now()
+        Transfer.objects.bulk_create(transfers)
+        if not connections[Transfer.objects.db].features.can_return_rows_from_bulk_insert:
+            # MySQL cannot report the ids of a multi-row INSERT, and the response
+            # lists them. Other writers of these (product, warehouse) pairs wait
+            # on the locks taken by lock_balances, so this user's rows on the
+            # pairs since the INSERT began are this batch, in insertion order.
+            keys = {(t.product_id, t.from_warehouse_id, t.to_warehouse_id) for t in transfers}
+            rows = (
+                Transfer.objects.filter(
+                    created_by=self.user, created_at__gte=started,
+                    product_id__in={key[0] for key in keys},
+                    from_warehouse_id__in={key[1] for key in keys},
+                    to_warehouse_id__in={key[2] for key in keys},
+                )
+                .order_by('pk')
+                .values_list('pk', 'product_id', 'from_warehouse_id', 'to_warehouse_id')
+            )
+            ids = [pk for pk, *key in rows if tuple(key) in keys]
+            if len(ids) != len(transfers):
+                raise DatabaseError(f"Read back {len(ids)} ids for {len(transfers)} inserted transfers")
+            for transfer, pk in zip(transfers, ids):
+                transfer.pk = pk
+        return transfers
+
+    def movements(self, transfers):
+        for transfer in transfers:
+            for warehouse_id, quantity, kind in (
+                (transfer.from_warehouse_id, -transfer.quantity, StockMovement.Kind.TRANSFER_OUT),
+                (transfer.to_warehouse_id, transfer.quantity, StockMovement.Kind.TRANSFER_IN),
+            ):
+                yield StockMovement(
+                    product_id=transfer.product_id, warehouse_id=warehouse_id, quantity=quantity, kind=kind,
+                    reference_id=transfer.pk, created_by=self.user,
+                )
+
+    def run(self):
+        """
+        Validate and apply the batch. Returns (created transfers in request
+        order, {index: error detail} of the items that failed).
+        """
+        items = []
+        for index, data in enumerate(self.raw_items):
+            try:
+                items.append(self.parse(index, data))
+            except serializers.ValidationError as e:
+                self.errors[index] = e.detail
+
+        items = self.validate_ids(items) if items else []
+        if not items:
+            return [], self.errors
+
+        with transaction.atomic():
+            existing = self.lock_balances(items)
+            balances = defaultdict(int, existing)
+            accepted = []
+            for item in items:
+                source = (item.product_id, item.from_warehouse_id)
+                target = (item.product_id, item.to_warehouse_id)
+                if balances[source] < item.quantity:
+                    self.errors[item.index] = _error({
+                        "quantity": f"Insufficient inventory. Available: {balances[source]}, Requested: {item.quantity}"
+                    })
+                    continue
+                balances[source] -= item.quantity
+                balances[target] += item.quantity
+                accepted.append(item)
+
+            transfers = self.insert_transfers(accepted) if accepted else []
+            ledger.record(self.movements(transfers), user_id=self.user.pk, existing=existing)
+        return transfers, self.errors
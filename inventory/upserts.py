@@ -0,0 +1,216 @@
+"""
+Set-based engine behind InventoryBulkUpsertView.
+
+InventoryUpsertBatch validates a whole stocktake payload in one pass (one
+query each for the referenced products, warehouses and id-addressed rows),
+resolves the existing (product, warehouse) pairs in one query and writes
+them with chunked INSERT ... ON CONFLICT DO UPDATE statements, all in one
+transaction. Items are still reported one by one in request order: a pair
+that already had a row (or appeared earlier in the payload) is reported as
+updated with its previous quantity, a new one as created. The difference
+each row's new quantity makes is logged to the stock ledger as an adjustment.
+"""
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import ledger
+from .models import Inventory, Product, StockMovement, Warehouse
+from .serializers import InventorySerializer
+
+CHUNK_SIZE = 500
+
+# Everything InventorySerializer's nested product and warehouse read
+SERIALIZER_RELATED = (
+    'warehouse', 'product__project', 'product__author', 'product__translator', 'product__rights_owner',
+    'product__reviewer', 'product__genre', 'product__status', 'product__language',
+)
+
+_quantity_field = serializers.IntegerField()
+
+
+class InventoryUpsertBatch:
+    def __init__(self, items, user, context=None):
+        self.items = items
+        self.user = user
+        self.context = context or {}
+
+    def validate(self):
+        """
+        Check every item's values and references and raise one ValidationError
+        keyed ``index_<n>`` for all that fail. Items must already have the keys
+        the view requires.
+        """
+        product_ids = {item['product_id'] for item in self.items if 'product_id' in item}
+        warehouse_ids = {item['warehouse_id'] for item in self.items if 'warehouse_id' in item}
+        row_ids = {item['id'] for item in self.items if item.get('id')}
+        products = self._existing(Product.objects.all(), product_ids)
+        warehouses = self._existing(Warehouse.objects.all(), warehouse_ids)
+        self.rows_by_id = {row.pk: row for row in Inventory.objects.filter(pk__in=self._valid_ids(row_ids))}
+
+        errors = {}
+        self.cleaned = []
+        for index, item in enumerate(self.items):
+            item_errors = {}
+            try:
+                quantity = _quantity_field.run_validation(item['quantity'])
+            except serializers.ValidationError as e:
+                item_errors['quantity'] = e.detail
+            for name, known in (('product_id', products), ('warehouse_id', warehouses)):
+                if name in item and self._key(item[name]) not in known:
+                    item_errors[name] = [f'Invalid pk "{item[name]}" - object does not exist.']
+            pk = item.get('id')
+            if pk and self._key(pk) not in self.rows_by_id:
+                errors[f'index_{index}'] = f"Inventory with id {pk} not found."
+                continue
+            if item_errors:
+                errors[f'index_{index}'] = item_errors
+                continue
+            self.cleaned.append({
+                'id': self._key(pk) if pk else None,
+                'product_id': self._key(item['product_id']) if 'product_id' in item else None,
+                'warehouse_id': self._key(item['warehouse_id']) if 'warehouse_id' in item else None,
+                'quantity': quantity,
+            })
+        if errors:
+            raise serializers.ValidationError(errors)
+
+    @staticmethod
+    def _key(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _valid_ids(self, values):
+        return {key for key in map(self._key, values) if key is not None}
+
+    def _existing(self, queryset, values):
+        return set(queryset.filter(pk__in=self._valid_ids(values)).values_list('pk', flat=True))
+
+    def run(self):
+        """Validate, write and return the per-item results in request order."""
+        self.validate()
+        now = timezone.now()
+        with transaction.atomic():
+            moved = {}
+            by_pair = {}
+            movements = []
+            for item in self.cleaned:
+                pair = (item['product_id'], item['warehouse_id'])
+                if item['id']:
+                    row = self.rows_by_id[item['id']]
+                    pair = (item['product_id'] or row.product_id, item['warehouse_id'] or row.warehouse_id)
+                    if pair != (row.product_id, row.warehouse_id):
+                        # Moving a row to another product or warehouse is not an upsert
+                        movements += self._adjustment(
+                            (row.product_id, row.warehouse_id, row.quantity), (*pair, item['quantity']),
+                        )
+                        row.product_id, row.warehouse_id = pair
+                        row.quantity = item['quantity']
+                        row.updated_by, row.updated_at = self.user, now
+                        moved[row.pk] = row
+                        item['key'] = row.pk
+                        continue
+                item['key'] = pair
+                by_pair.setdefault(pair, []).append(item)
+
+            if moved:
+                Inventory.objects.bulk_update(
+                    moved.values(), ['product', 'warehouse', 'quantity', 'updated_by', 'updated_at'],
+                    batch_size=CHUNK_SIZE,
+                )
+            if by_pair:
+                previous = self._lock_pairs(by_pair)
+                self._annotate(by_pair, previous)
+                self._upsert(by_pair, now)
+                for pair, items in sorted(by_pair.items()):
+                    before = (*pair, previous[pair]) if pair in previous else None
+                    movements += self._adjustment(before, (*pair, items[-1]['quantity']))
+            ledger.log(movements)
+
+            rows = self._load(moved, by_pair)
+        return self._results(rows)
+
+    def _adjustment(self, before, after):
+        return ledger.change(StockMovement.Kind.ADJUSTMENT, before, after, user_id=self.user.pk)
+
+    def _lock_pairs(self, by_pair):
+        """{(product, warehouse): quantity} of the pairs that already have a row, locked."""
+        product_ids = {product_id for product_id, _ in by_pair}
+        warehouse_ids = {warehouse_id for _, warehouse_id in by_pair}
+        # A stocktake covers one or a few warehouses, so this product x
+        # warehouse filter reads little more than the pairs themselves.
+        rows = (
+            Inventory.objects.select_for_update()
+            .filter(product_id__in=product_ids, warehouse_id__in=warehouse_ids)
+            .order_by('product_id', 'warehouse_id')
+            .values_list('product_id', 'warehouse_id', 'quantity')
+        )
+        return {(product_id, warehouse_id): quantity for product_id, warehouse_id, quantity in rows
+                if (product_id, warehouse_id) in by_pair}
+
+    def _annotate(self, by_pair, previous):
+        """Set each pair item's _action/_old_quantity, replaying the items in request order."""
+        current = dict(previous)
+        for item in self.cleaned:
+            pair = item['key']
+            if pair not in by_pair:
+                continue
+            if not item['id']:
+                item['action'], item['old_quantity'] = (
+                    ('updated', current[pair]) if pair in current else ('created', None)
+                )
+            current[pair] = item['quantity']
+
+    def _upsert(self, by_pair, now):
+        # MySQL upserts on any unique key and rejects an explicit target
+        features = connections[Inventory.objects.db].features
+        unique_fields = ['product', 'warehouse'] if features.supports_update_conflicts_with_target else None
+        # The last item for a pair wins, as it did when items were saved in turn
+        Inventory.objects.bulk_create(
+            [
+                Inventory(product_id=product_id, warehouse_id=warehouse_id, quantity=items[-1]['quantity'],
+                          created_by=self.user, updated_by=self.user, created_at=now, updated_at=now)
+                for (product_id, warehouse_id), items in sorted(by_pair.items())
+            ],
+            batch_size=CHUNK_SIZE,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['quantity', 'updated_by', 'updated_at'],
+        )
+
+    def _load(self, moved, by_pair):
+        rows = {}
+        queryset = Inventory.objects.select_related(*SERIALIZER_RELATED)
+        ids = list(moved)
+        for start in range(0, len(ids), CHUNK_SIZE):
+            for row in queryset.filter(pk__in=ids[start:start + CHUNK_SIZE]):
+                rows[row.pk] = row
+        pairs = sorted(by_pair)
+        for start in range(0, len(pairs), CHUNK_SIZE):
+            chunk = pairs[start:start + CHUNK_SIZE]
+            filtered = queryset.filter(
+                product_id__in={product_id for product_id, _ in chunk},
+                warehouse_id__in={warehouse_id for _, warehouse_id in chunk},
+            )
+            for row in filtered:
+                rows[row.product_id, row.warehouse_id] = row
+        return rows
+
+    def _results(self, rows):
+        keys = list(dict.fromkeys(item['key'] for item in self.cleaned))
+        # One list serializer: building a nested serializer per row costs more than the writes
+        data = InventorySerializer([rows[key] for key in keys], many=True, context=self.context).data
+        serialized = dict(zip(keys, data))
+        results = []
+        for item in self.cleaned:
+            key = item['key']
+            # Each item reports the quantity it set, as when items were saved in turn
+            data = {**serialized[key], 'quantity': item['quantity']}
+            if not item['id']:
+                data['_action'] = item['action']
+                if item['old_quantity'] is not None:
+                    data['_old_quantity'] = item['old_quantity']
+            results.append(data)
+        return results
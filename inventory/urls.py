@@ -51,6 +51,11 @@ urlpatterns = [
     path("transfers/<int:pk>/", views.TransferUpdateView.as_view(), name="transfer-update"),
     path("transfers/<int:pk>/delete/", views.TransferDeleteView.as_view(), name="transfer-delete"),
 
+    ### ===== Stock ledger =====
+    path("stock/movements/", views.StockMovementListView.as_view(), name="stock-movement-list"),
+    path("stock/receipts/", views.StockReceiptView.as_view(), name="stock-receipt"),
+    path("stock/as-of/", views.StockAsOfView.as_view(), name="stock-as-of"),
+
     ### ===== Authors =====
     path("authors/", views.AuthorListCreateView.as_view(), name="author-list-create"),
     path("authors/<int:pk>/", views.AuthorUpdateView.as_view(), name="author-update"),
@@ -2,27 +2,35 @@ from rest_framework import generics, viewsets, filters
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from django.db import transaction, models
-from django.db.models import ProtectedError, Sum, Count, OuterRef, Subquery, Q, Value, F, Case, When, Exists
+from django.db.models import ProtectedError, Sum, Count, OuterRef, Subquery, F, Case, When, Exists
 from django.db.models.functions import Coalesce
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, timedelta
 from rest_framework.response import Response
 from rest_framework import status
 from django.http import Http404
 from rest_framework import serializers
-from inventory.pagination import StandardResultsSetPagination
+from inventory.pagination import KeysetOrPageNumberPagination, StandardResultsSetPagination
 
+from . import bootstrap_cache, ledger
+from . import search as search_indexes
+from .transfers import TransferBatch
+from .upserts import InventoryUpsertBatch
 from .models import (
-    PrintRun, Project, Product, Stakeholder, Warehouse, Inventory, Transfer,
+    PrintRun, Project, Product, Stakeholder, StockMovement, Warehouse, Inventory, Transfer,
     Author, Translator, RightsOwner, Reviewer,
     Contract, PrintTask
 )
 from .serializers import (
     POSProductSummarySerializer, PrintRunSerializer, ProductSummarySerializer, ProjectSerializer, ProductSerializer, StakeholderSerializer, WarehouseSerializer,
-    InventorySerializer, InventoryListSerializer, TransferSerializer,
+    InventorySerializer, InventoryListSerializer, TransferSerializer, StockMovementSerializer, StockReceiptSerializer,
     AuthorSerializer, TranslatorSerializer, RightsOwnerSerializer,
     ReviewerSerializer, ContractSerializer, PrintTaskSerializer
 )
-from common.models import ListItem
+from common import reference_data
+from common.idempotency import idempotent
+from common.search import RankedOrderingFilter
 from common.serializers import ListItemSerializer
 from users.serializers import UserBasicSerializer
 from django.contrib.auth import get_user_model
@@ -54,27 +62,21 @@ class ProjectListCreateView(generics.ListCreateAPIView):
         'translator',
         'rights_owner',
         'reviewer'
-    ).prefetch_related('contract_set').order_by('-created_at', 'id')
+    ).order_by('-created_at', 'id')
     serializer_class = ProjectSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = StandardResultsSetPagination
-    filter_backends = [filters.OrderingFilter]
+    filter_backends = [RankedOrderingFilter]
     ordering_fields = ['title_ar', 'title_original', 'approval_status', 'created_at', 'updated_at']
     ordering = ['-created_at']
 
     def get_queryset(self):
-        from .models import Product
-        from common.models import ListItem
-        
         queryset = super().get_queryset()
         
-        # Search filter - search in title_ar and title_original
-        search = self.request.query_params.get('search')
+        # Search filter - ranked search in title_ar and title_original
+        search = self.request.query_params.get('search', '').strip()
         if search:
-            queryset = queryset.filter(
-                Q(title_ar__icontains=search) | 
-                Q(title_original__icontains=search)
-            )
+            queryset = search_indexes.projects.search(queryset, search)
         
         # Approval status filter
         approval_status = self.request.query_params.get('approval_status')
@@ -108,8 +110,17 @@ class ProjectListCreateView(generics.ListCreateAPIView):
         # Check if contracts should be included
         include_contracts = self.request.query_params.get('include_contracts', 'false').lower() == 'true'
         
-        # Note: has_product and all_contracts_closed are calculated in the serializer
-        # to avoid complex annotation issues. The serializer methods handle this efficiently.
+        # has_product / all_contracts_closed as subqueries, so the serializer never
+        # falls back to per-row queries. The closed status is resolved once.
+        contracts = Contract.objects.filter(project=OuterRef('pk'))
+        closed_status = reference_data.get("contract_status", "closed")
+        if closed_status:
+            # Contracts without a status count as open, as exclude(status=...) did
+            contracts = contracts.exclude(status_id=closed_status.pk)
+        queryset = queryset.annotate(
+            has_product=Exists(Product.objects.filter(project=OuterRef('pk'))),
+            all_contracts_closed=~Exists(contracts),
+        )
         
         # Note: Ordering is handled by OrderingFilter, so we don't need to call order_by here
         # The default ordering is set via the 'ordering' attribute
@@ -118,6 +129,7 @@ class ProjectListCreateView(generics.ListCreateAPIView):
             'progress_status',
             'status',
             'type',
+            'language',
             'author',
             'translator',
             'rights_owner',
@@ -126,7 +138,7 @@ class ProjectListCreateView(generics.ListCreateAPIView):
         
         # Only prefetch contracts if requested (to avoid unnecessary queries)
         if include_contracts:
-            queryset = queryset.prefetch_related('contract_set')
+            queryset = queryset.prefetch_related('contract_set__contract_type')
         
         return queryset
 
@@ -184,10 +196,8 @@ class ProjectToProductView(APIView):
         contracts = project.contract_set.all()
         
         # Check if all contracts are closed
-        closed_status = ListItem.objects.filter(
-            list_type__code="contract_status",
-            value__iexact="closed"
-        ).first()
+        refs = reference_data.get_registry()
+        closed_status = refs.get("contract_status", "closed")
         
         if closed_status:
             open_contracts = contracts.exclude(status=closed_status)
@@ -198,10 +208,7 @@ class ProjectToProductView(APIView):
                 )
         
         # Check if project status is finalized
-        finalized_status = ListItem.objects.filter(
-            list_type__code="projects_status",
-            value__iexact="finalized"
-        ).first()
+        finalized_status = refs.get("projects_status", "finalized")
         
         if finalized_status and project.status != finalized_status:
             return Response(
@@ -210,10 +217,7 @@ class ProjectToProductView(APIView):
             )
         
         # Check if progress status is completed
-        completed_status = ListItem.objects.filter(
-            list_type__code="progress_status",
-            value__iexact="completed"
-        ).first()
+        completed_status = refs.get("progress_status", "completed")
         
         if completed_status and project.progress_status != completed_status:
             return Response(
@@ -222,10 +226,7 @@ class ProjectToProductView(APIView):
             )
         
         # Get available status for product
-        available_status = ListItem.objects.filter(
-            list_type__code="product_status",
-            value__iexact="available"
-        ).first()
+        available_status = refs.get("product_status", "available")
         
         if not available_status:
             return Response(
@@ -266,8 +267,8 @@ class ProjectToProductView(APIView):
             reviewer_id = project.reviewer.id
         
         # Get default genre and language
-        default_genre = ListItem.objects.filter(id=9).first()
-        default_language = ListItem.objects.filter(id=50).first()
+        default_genre = refs.get_by_id(9)
+        default_language = refs.get_by_id(50)
         
         # Use project's language if available, otherwise use default
         product_language = project.language if project.language else default_language
@@ -302,64 +303,41 @@ class ProjectToProductView(APIView):
             status=status.HTTP_201_CREATED
         )
 
+def _people_data():
+    """Authors, translators, rights owners and reviewers for the bootstrap bundles."""
+    return {
+        "authors": AuthorSerializer(Author.objects.order_by("name"), many=True).data,
+        "translators": TranslatorSerializer(Translator.objects.order_by("name"), many=True).data,
+        "rights_owners": RightsOwnerSerializer(RightsOwner.objects.order_by("name"), many=True).data,
+        "reviewers": ReviewerSerializer(Reviewer.objects.order_by("name"), many=True).data,
+    }
+
+
 class ProjectsBootstrapView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
         """
         Bootstrap endpoint for projects page.
-        Returns all static data needed for the projects page in a single request.
+        Returns all static data needed for the projects page in a single request,
+        prebuilt and cached until one of its source tables changes.
         """
+        return bootstrap_cache.cached_bundle(request, "projects", ("list_items", "people"), self.build)
+
+    def build(self):
         # List items for projects
-        progress_statuses = ListItem.objects.filter(
-            list_type__code="progress_status", 
-            is_active=True
-        ).order_by("display_name_en")
-        
-        projects_statuses = ListItem.objects.filter(
-            list_type__code="projects_status", 
-            is_active=True
-        ).order_by("display_name_en")
-        
-        projects_types = ListItem.objects.filter(
-            list_type__code="projects_type", 
-            is_active=True
-        ).order_by("display_name_en")
+        progress_statuses = reference_data.items("progress_status", order_by="display_name_en")
         
-        listitem_context = {"request": request}
-        progress_statuses_data = ListItemSerializer(
-            progress_statuses, many=True, context=listitem_context
-        ).data
-        projects_statuses_data = ListItemSerializer(
-            projects_statuses, many=True, context=listitem_context
-        ).data
-        projects_types_data = ListItemSerializer(
-            projects_types, many=True, context=listitem_context
-        ).data
+        projects_statuses = reference_data.items("projects_status", order_by="display_name_en")
         
-        # People data
-        authors_data = AuthorSerializer(
-            Author.objects.order_by("name"), many=True, context={"request": request}
-        ).data
-        translators_data = TranslatorSerializer(
-            Translator.objects.order_by("name"), many=True, context={"request": request}
-        ).data
-        rights_owners_data = RightsOwnerSerializer(
-            RightsOwner.objects.order_by("name"), many=True, context={"request": request}
-        ).data
-        reviewers_data = ReviewerSerializer(
-            Reviewer.objects.order_by("name"), many=True, context={"request": request}
-        ).data
+        projects_types = reference_data.items("projects_type", order_by="display_name_en")
         
-        return Response({
-            "progress_options": progress_statuses_data,
-            "status_options": projects_statuses_data,
-            "type_options": projects_types_data,
-            "authors": authors_data,
-            "translators": translators_data,
-            "rights_owners": rights_owners_data,
-            "reviewers": reviewers_data,
-        })
+        return {
+            "progress_options": ListItemSerializer(progress_statuses, many=True).data,
+            "status_options": ListItemSerializer(projects_statuses, many=True).data,
+            "type_options": ListItemSerializer(projects_types, many=True).data,
+            **_people_data(),
+        }
 
 
 class ContractsBootstrapView(APIView):
@@ -368,69 +346,34 @@ class ContractsBootstrapView(APIView):
     def get(self, request):
         """
         Bootstrap endpoint for contracts page.
-        Returns all static data needed for the contracts page in a single request.
+        Returns all static data needed for the contracts page in a single request,
+        prebuilt and cached until one of its source tables changes.
         Note: Projects are fetched separately with pagination.
         """
+        return bootstrap_cache.cached_bundle(
+            request, "contracts", ("list_items", "users", "people"), self.build
+        )
+
+    def build(self):
         # Contract types
-        contract_types = ListItem.objects.filter(
-            list_type__code="contract_type",
-            is_active=True
-        ).order_by("id")
+        contract_types = reference_data.items("contract_type")
         
         # Contract statuses
-        contract_statuses = ListItem.objects.filter(
-            list_type__code="contract_status",
-            is_active=True
-        ).order_by("id")
+        contract_statuses = reference_data.items("contract_status")
         
         # Royalties types
-        royalties_types = ListItem.objects.filter(
-            list_type__code="royalties_type",
-            is_active=True
-        ).order_by("id")
-        
-        listitem_context = {"request": request}
-        contract_types_data = ListItemSerializer(
-            contract_types, many=True, context=listitem_context
-        ).data
-        contract_statuses_data = ListItemSerializer(
-            contract_statuses, many=True, context=listitem_context
-        ).data
-        royalties_types_data = ListItemSerializer(
-            royalties_types, many=True, context=listitem_context
-        ).data
+        royalties_types = reference_data.items("royalties_type")
         
         # Signatories (users)
-        signatories_data = UserBasicSerializer(
-            User.objects.filter(is_active=True).order_by("username"),
-            many=True,
-            context={"request": request}
-        ).data
-        
-        # People data
-        authors_data = AuthorSerializer(
-            Author.objects.order_by("name"), many=True, context={"request": request}
-        ).data
-        translators_data = TranslatorSerializer(
-            Translator.objects.order_by("name"), many=True, context={"request": request}
-        ).data
-        rights_owners_data = RightsOwnerSerializer(
-            RightsOwner.objects.order_by("name"), many=True, context={"request": request}
-        ).data
-        reviewers_data = ReviewerSerializer(
-            Reviewer.objects.order_by("name"), many=True, context={"request": request}
-        ).data
+        signatories = User.objects.filter(is_active=True).order_by("username")
         
-        return Response({
-            "contract_types": contract_types_data,
-            "contract_statuses": contract_statuses_data,
-            "royalties_types": royalties_types_data,
-            "signatories": signatories_data,
-            "authors": authors_data,
-            "translators": translators_data,
-            "rights_owners": rights_owners_data,
-            "reviewers": reviewers_data,
-        })
+        return {
+            "contract_types": ListItemSerializer(contract_types, many=True).data,
+            "contract_statuses": ListItemSerializer(contract_statuses, many=True).data,
+            "royalties_types": ListItemSerializer(royalties_types, many=True).data,
+            "signatories": UserBasicSerializer(signatories, many=True).data,
+            **_people_data(),
+        }
 
 # ============================== Product ==============================
 class ProductListCreateView(generics.ListCreateAPIView):
@@ -755,7 +698,7 @@ class InventoryListCreateView(generics.ListCreateAPIView):
     queryset = Inventory.objects.all()
     serializer_class = InventorySerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = StandardResultsSetPagination
+    pagination_class = KeysetOrPageNumberPagination
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['product', 'warehouse', 'quantity', 'updated_at', 'created_at']
     ordering = ['-created_at', 'id']  # Default ordering
@@ -952,9 +895,6 @@ class InventoryBulkUpsertView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        results = []
-        errors = []
-        
         # Validate all items first before processing
         validated_data = []
         for index, item in enumerate(request.data):
@@ -995,73 +935,9 @@ class InventoryBulkUpsertView(APIView):
             
             validated_data.append(item)
 
-        # Process all items in a single transaction
+        # Validate everything, then write in one transaction (see inventory.upserts)
         try:
-            with transaction.atomic():
-                for index, item_data in enumerate(validated_data):
-                    pk = item_data.get("id")
-                    
-                    if pk:
-                        # Update existing inventory
-                        try:
-                            instance = Inventory.objects.get(pk=pk)
-                            serializer = InventorySerializer(
-                                instance,
-                                data=item_data,
-                                partial=True,
-                                context={"request": request},
-                            )
-                            serializer.is_valid(raise_exception=True)
-                            serializer.save(updated_by=request.user)
-                            results.append(serializer.data)
-                        except Inventory.DoesNotExist:
-                            raise serializers.ValidationError(
-                                {f"index_{index}": f"Inventory with id {pk} not found."}
-                            )
-                    else:
-                        # Create new inventory or update existing (handles unique_together constraint)
-                        product_id = item_data.get("product_id")
-                        warehouse_id = item_data.get("warehouse_id")
-                        quantity = item_data.get("quantity", 0)
-                        
-                        # Check if inventory already exists for this product+warehouse combination
-                        # Due to unique_together constraint, only one inventory per product+warehouse
-                        existing = Inventory.objects.filter(
-                            product_id=product_id,
-                            warehouse_id=warehouse_id
-                        ).first()
-                        
-                        if existing:
-                            # Update existing inventory - replace quantity with new value
-                            # This ensures one inventory record per product+warehouse combination
-                            old_quantity = existing.quantity
-                            serializer = InventorySerializer(
-                                existing,
-                                data=item_data,
-                                partial=True,
-                                context={"request": request},
-                            )
-                            serializer.is_valid(raise_exception=True)
-                            serializer.save(updated_by=request.user)
-                            result_data = serializer.data
-                            result_data['_action'] = 'updated'
-                            result_data['_old_quantity'] = old_quantity
-                            results.append(result_data)
-                        else:
-                            # Create new inventory
-                            serializer = InventorySerializer(
-                                data=item_data,
-                                context={"request": request},
-                            )
-                            serializer.is_valid(raise_exception=True)
-                            serializer.save(
-                                created_by=request.user,
-                                updated_by=request.user,
-                            )
-                            result_data = serializer.data
-                            result_data['_action'] = 'created'
-                            results.append(result_data)
-
+            results = InventoryUpsertBatch(validated_data, request.user, context={"request": request}).run()
             return Response(
                 {
                     "detail": f"Successfully processed {len(results)} inventory item(s).",
@@ -1133,6 +1009,7 @@ class TransferListCreateView(generics.ListCreateAPIView):
     queryset = Transfer.objects.all().order_by('-created_at', 'id')
     serializer_class = TransferSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetOrPageNumberPagination
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user, updated_by=self.request.user)
@@ -1152,9 +1029,10 @@ class TransferDeleteView(BaseDeleteView):
 class TransferBulkCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         """
-        Bulk create transfers and update inventory.
+        Bulk create transfers and update inventory (see inventory.transfers).
         Expects: { "transfers": [{ "product_id": 1, "from_warehouse_id": 1, "to_warehouse_id": 2, "quantity": 10 }, ...] }
         Returns: { "success_count": X, "failed_count": Y, "errors": [...] }
         """
@@ -1171,111 +1049,19 @@ class TransferBulkCreateView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        success_count = 0
-        failed_count = 0
-        errors = []
-        created_transfers = []
-
-        # Process all transfers in a single transaction
         try:
-            with transaction.atomic():
-                for index, transfer_data in enumerate(transfers_data):
-                    try:
-                        # Validate required fields
-                        product_id = transfer_data.get('product_id')
-                        from_warehouse_id = transfer_data.get('from_warehouse_id')
-                        to_warehouse_id = transfer_data.get('to_warehouse_id')
-                        quantity = transfer_data.get('quantity', 0)
-
-                        if not product_id:
-                            raise serializers.ValidationError({"product_id": "Product ID is required"})
-                        if not from_warehouse_id:
-                            raise serializers.ValidationError({"from_warehouse_id": "From warehouse ID is required"})
-                        if not to_warehouse_id:
-                            raise serializers.ValidationError({"to_warehouse_id": "To warehouse ID is required"})
-                        if quantity <= 0:
-                            raise serializers.ValidationError({"quantity": "Quantity must be greater than 0"})
-                        if from_warehouse_id == to_warehouse_id:
-                            raise serializers.ValidationError({"warehouses": "From and to warehouses must be different"})
-
-                        # Get product and warehouses
-                        try:
-                            product = Product.objects.get(id=product_id)
-                        except Product.DoesNotExist:
-                            raise serializers.ValidationError({"product_id": f"Product with id {product_id} not found"})
-
-                        try:
-                            from_warehouse = Warehouse.objects.get(id=from_warehouse_id)
-                        except Warehouse.DoesNotExist:
-                            raise serializers.ValidationError({"from_warehouse_id": f"Warehouse with id {from_warehouse_id} not found"})
-
-                        try:
-                            to_warehouse = Warehouse.objects.get(id=to_warehouse_id)
-                        except Warehouse.DoesNotExist:
-                            raise serializers.ValidationError({"to_warehouse_id": f"Warehouse with id {to_warehouse_id} not found"})
-
-                        # Check if from_warehouse has enough inventory
-                        from_inventory, created = Inventory.objects.get_or_create(
-                            product=product,
-                            warehouse=from_warehouse,
-                            defaults={'quantity': 0}
-                        )
-
-                        if from_inventory.quantity < quantity:
-                            raise serializers.ValidationError({
-                                "quantity": f"Insufficient inventory. Available: {from_inventory.quantity}, Requested: {quantity}"
-                            })
-
-                        # Get or create to_warehouse inventory
-                        to_inventory, created = Inventory.objects.get_or_create(
-                            product=product,
-                            warehouse=to_warehouse,
-                            defaults={'quantity': 0}
-                        )
-
-                        # Create transfer record
-                        transfer = Transfer.objects.create(
-                            product=product,
-                            from_warehouse=from_warehouse,
-                            to_warehouse=to_warehouse,
-                            quantity=quantity,
-                            shipping_cost=transfer_data.get('shipping_cost', 0),
-                            transfer_date=transfer_data.get('transfer_date') or timezone.now(),
-                            created_by=request.user,
-                            updated_by=request.user
-                        )
-
-                        # Update inventory: subtract from from_warehouse, add to to_warehouse
-                        from_inventory.quantity -= quantity
-                        from_inventory.updated_by = request.user
-                        from_inventory.save()
-
-                        to_inventory.quantity += quantity
-                        to_inventory.updated_by = request.user
-                        to_inventory.save()
-
-                        created_transfers.append(transfer.id)
-                        success_count += 1
-
-                    except serializers.ValidationError as e:
-                        failed_count += 1
-                        errors.append({
-                            "index": index,
-                            "errors": e.detail
-                        })
-                    except Exception as e:
-                        failed_count += 1
-                        errors.append({
-                            "index": index,
-                            "errors": {"detail": str(e)}
-                        })
-
+            transfers, item_errors = TransferBatch(transfers_data, request.user).run()
         except Exception as e:
             return Response(
                 {"detail": f"Error processing bulk transfers: {str(e)}"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        success_count = len(transfers)
+        failed_count = len(item_errors)
+        created_transfers = [transfer.id for transfer in transfers]
+        errors = [{"index": index, "errors": detail} for index, detail in sorted(item_errors.items())]
+
         # Prepare response
         response_data = {
             "success_count": success_count,
@@ -1394,6 +1180,102 @@ class TransferPreviewView(APIView):
 
         return Response({"results": results, "count": len(results)})
 
+# ============================== Stock ledger ==============================
+def _id_list(request, name):
+    """Integer ids from ?name=1&name=2, None when absent."""
+    raw = request.query_params.getlist(name)
+    if not raw:
+        return None
+    try:
+        return [int(value) for value in raw]
+    except (TypeError, ValueError):
+        raise serializers.ValidationError({name: "Must be integers."})
+
+
+class StockMovementListView(generics.ListAPIView):
+    """
+    The stock ledger, newest first.
+    GET /inventory/stock/movements/?product_id=1&warehouse_id=2&kind=sale
+    """
+    serializer_class = StockMovementSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = StandardResultsSetPagination
+
+    def get_queryset(self):
+        queryset = StockMovement.objects.all()
+        product_ids = _id_list(self.request, 'product_id')
+        if product_ids is not None:
+            queryset = queryset.filter(product_id__in=product_ids)
+        warehouse_ids = _id_list(self.request, 'warehouse_id')
+        if warehouse_ids is not None:
+            queryset = queryset.filter(warehouse_id__in=warehouse_ids)
+        kinds = self.request.query_params.getlist('kind')
+        if kinds:
+            queryset = queryset.filter(kind__in=kinds)
+        return queryset.order_by('-ts', '-id')
+
+
+class StockReceiptView(APIView):
+    """
+    Record copies of a print run delivered to a warehouse.
+    POST /inventory/stock/receipts/ { "print_run_id": 1, "warehouse_id": 2, "quantity": 500 }
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = StockReceiptSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        print_run = serializer.validated_data['print_run']
+        movements = ledger.record(
+            [StockMovement(
+                product_id=print_run.product_id,
+                warehouse=serializer.validated_data['warehouse'],
+                quantity=serializer.validated_data['quantity'],
+                kind=StockMovement.Kind.RECEIPT,
+                reference_id=print_run.pk,
+                created_by=request.user,
+            )],
+            user_id=request.user.pk,
+        )
+        return Response(StockMovementSerializer(movements[0]).data, status=status.HTTP_201_CREATED)
+
+
+class StockAsOfView(APIView):
+    """
+    Balances at a point in time, from the latest snapshot plus the movements since.
+    GET /inventory/stock/as-of/?at=2025-01-31&product_id=1&warehouse_id=2
+    ``at`` is a datetime, or a date for the balances at the end of that day.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        raw = (request.query_params.get('at') or '').strip()
+        if not raw:
+            return Response({"detail": "at is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            at = parse_datetime(raw)
+            day = parse_date(raw) if at is None else None
+        except ValueError:
+            at = day = None
+        if at is None:
+            if day is None:
+                return Response(
+                    {"detail": "at must be a date (YYYY-MM-DD) or an ISO 8601 datetime."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            at = datetime.combine(day + timedelta(days=1), datetime.min.time())
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+
+        balances = ledger.balances_as_of(
+            at, _id_list(request, 'product_id'), _id_list(request, 'warehouse_id'),
+        )
+        results = [
+            {"product_id": product_id, "warehouse_id": warehouse_id, "quantity": quantity}
+            for (product_id, warehouse_id), quantity in sorted(balances.items())
+        ]
+        return Response({"at": at, "results": results, "count": len(results)})
+
 # ============================== People ==============================
 class AuthorListCreateView(generics.ListCreateAPIView):
     queryset = Author.objects.all().order_by('name')
@@ -1571,80 +1453,67 @@ class PrintTaskDeleteView(BaseDeleteView):
 
 
 class BootstrapDataView(APIView):
+    """
+    Static data for the inventory page, prebuilt and cached until one of its
+    source tables changes. The product summary is paginated and fetched from
+    ProductSummaryView.
+    """
     permission_classes = [IsAuthenticated]
-    pagination_class = StandardResultsSetPagination
 
     def get(self, request, *args, **kwargs):
-        # Product summaries with pagination (reuse ProductSummaryView logic)
-        summary_view = ProductSummaryView()
-        summary_view.request = request
-        queryset = summary_view.get_queryset()
-
-        paginator = self.pagination_class()
-        paginated_qs = paginator.paginate_queryset(queryset, request, view=summary_view)
-        summary_serializer = ProductSummarySerializer(
-            paginated_qs, many=True, context={"request": request}
+        return bootstrap_cache.cached_bundle(
+            request, "inventory", ("list_items", "warehouses", "people"), self.build
         )
-        paginated_summary = paginator.get_paginated_response(summary_serializer.data).data
 
+    def build(self):
         # List items
-        genres = ListItem.objects.filter(list_type__code="genre", is_active=True).order_by("display_name_en")
-        statuses = ListItem.objects.filter(list_type__code="product_status", is_active=True).order_by(
-            "display_name_en"
-        )
-        languages = ListItem.objects.filter(list_type__code="product_language", is_active=True).order_by(
-            "display_name_en"
-        )
-        print_run_statuses = ListItem.objects.filter(list_type__code="printrun_status", is_active=True).order_by(
-            "display_name_en"
-        )
+        refs = reference_data.get_registry()
+        genres = refs.items("genre", order_by="display_name_en")
+        statuses = refs.items("product_status", order_by="display_name_en")
+        languages = refs.items("product_language", order_by="display_name_en")
+        print_run_statuses = refs.items("printrun_status", order_by="display_name_en")
+
+        return {
+            "genres": ListItemSerializer(genres, many=True).data,
+            "statuses": ListItemSerializer(statuses, many=True).data,
+            "languages": ListItemSerializer(languages, many=True).data,
+            "warehouses": WarehouseSerializer(Warehouse.objects.order_by("name_en"), many=True).data,
+            **_people_data(),
+            "print_run_statuses": ListItemSerializer(print_run_statuses, many=True).data,
+        }
 
-        listitem_context = {"request": request}
-        genres_data = ListItemSerializer(genres, many=True, context=listitem_context).data
-        statuses_data = ListItemSerializer(statuses, many=True, context=listitem_context).data
-        languages_data = ListItemSerializer(languages, many=True, context=listitem_context).data
-        print_run_statuses_data = ListItemSerializer(
-            print_run_statuses, many=True, context=listitem_context
-        ).data
-
-        # Warehouses & stakeholders
-        warehouse_data = WarehouseSerializer(
-            Warehouse.objects.order_by("name_en"), many=True, context={"request": request}
-        ).data
-        author_data = AuthorSerializer(
-            Author.objects.order_by("name"), many=True, context={"request": request}
-        ).data
-        translator_data = TranslatorSerializer(
-            Translator.objects.order_by("name"), many=True, context={"request": request}
-        ).data
-        rights_owner_data = RightsOwnerSerializer(
-            RightsOwner.objects.order_by("name"), many=True, context={"request": request}
-        ).data
-        reviewer_data = ReviewerSerializer(
-            Reviewer.objects.order_by("name"), many=True, context={"request": request}
-        ).data
 
-        return Response(
-            {
-                "product_summary": paginated_summary,
-                "genres": genres_data,
-                "statuses": statuses_data,
-                "languages": languages_data,
-                "warehouses": warehouse_data,
-                "authors": author_data,
-                "translators": translator_data,
-                "rights_owners": rights_owner_data,
-                "reviewers": reviewer_data,
-                "print_run_statuses": print_run_statuses_data,
-            }
+def product_summary_queryset():
+    """
+    Products annotated for ProductSummarySerializer. Each aggregate is its own
+    correlated subquery: joining print runs and inventory in one GROUP BY scanned
+    editions x warehouses rows per product and multiplied stock by the editions.
+    """
+    editions = (
+        PrintRun.objects.filter(product=OuterRef('pk')).order_by()
+        .values('product').annotate(count=Count('pk')).values('count')
+    )
+    stock = (
+        Inventory.objects.filter(product=OuterRef('pk')).order_by()
+        .values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    return (
+        Product.objects.annotate(
+            editions_count=Coalesce(Subquery(editions), 0),
+            stock=Coalesce(Subquery(stock), 0),
+            # Kept in sync from the print runs, so ordering by price can use an index
+            latest_price=F('current_price'),
+            latest_price_omr=F('current_price_omr'),
         )
+        .select_related('genre', 'status', 'language', 'author', 'translator')
+    )
 
 
 class ProductSummaryView(generics.ListAPIView):
     serializer_class   = ProductSummarySerializer
     permission_classes = [IsAuthenticated]
     pagination_class   = StandardResultsSetPagination
-    filter_backends    = [filters.OrderingFilter]
+    filter_backends    = [RankedOrderingFilter]
     ordering_fields    = ['id', 'title_en', 'title_ar', 'isbn', 'latest_price', 'status_id', 'created_at']
     ordering           = ['id']  # Default ordering
 
@@ -1656,27 +1525,11 @@ class ProductSummaryView(generics.ListAPIView):
         status_id = params.get("status_id")
         language_id = params.get("language_id")
 
-        latest = PrintRun.objects.filter(product=OuterRef('pk')).order_by('-edition_number')
-
-        queryset = (
-            Product.objects.annotate(
-                editions_count=Count('print_runs', distinct=True),
-                stock=Coalesce(Sum('inventory__quantity'), Value(0)),
-                latest_price=Subquery(latest.values('price')[:1]),
-                latest_price_omr=Subquery(latest.values('price_omr')[:1]),
-            )
-            .select_related('genre', 'status', 'language', 'author', 'translator')
-            .prefetch_related('print_runs')
-        )
+        queryset = product_summary_queryset()
 
         if search:
-            queryset = queryset.filter(
-                Q(isbn__icontains=search)
-                | Q(title_en__icontains=search)
-                | Q(title_ar__icontains=search)
-                | Q(author__isnull=False, author__name__icontains=search)
-                | Q(translator__isnull=False, translator__name__icontains=search)
-            )
+            # Titles, ISBN, author and translator names, best matches first
+            queryset = search_indexes.products.search(queryset, search)
 
         if genre_id:
             queryset = queryset.filter(genre_id=genre_id)
@@ -1697,35 +1550,21 @@ class POSProductViewSet(viewsets.ModelViewSet):
     pagination_class = StandardResultsSetPagination
     
     def get_queryset(self):
-        latest = PrintRun.objects.filter(product=OuterRef('pk'))\
-                                 .order_by('-edition_number')
-        queryset = (
-            Product.objects
-                   .annotate(
-                       editions_count=Count('print_runs', distinct=True),
-                       stock=Sum('inventory__quantity'),
-                       latest_price=Subquery(latest.values('price')[:1]),
-                       latest_price_omr=Subquery(latest.values('price_omr')[:1]),
-                   )
-                   .select_related('genre','status','language','author','translator')
-                   .order_by('id')
-        )
+        queryset = product_summary_queryset().order_by('id')
         
         warehouse_id = self.request.query_params.get('warehouse_id')
         if warehouse_id:
-            queryset = queryset.filter(
-                inventory__warehouse_id=warehouse_id,
-                inventory__quantity__gt=0
-            ).distinct()
+            # Stock in the till's warehouse, read by the serializer; Exists keeps
+            # the product rows unique without a join plus DISTINCT
+            warehouse_inventory = Inventory.objects.filter(product=OuterRef('pk'), warehouse_id=warehouse_id)
+            queryset = queryset.annotate(
+                warehouse_stock=Coalesce(Subquery(warehouse_inventory.values('quantity')[:1]), 0),
+            ).filter(Exists(warehouse_inventory.filter(quantity__gt=0)))
         
         # Server-side search filtering
         search = self.request.query_params.get('search', '').strip()
         if search:
-            queryset = queryset.filter(
-                Q(title_en__icontains=search) |
-                Q(title_ar__icontains=search) |
-                Q(isbn__icontains=search)
-            )
+            queryset = search_indexes.products.search(queryset, search)
         
         # Server-side genre filtering
         genre_id = self.request.query_params.get('genre_id')
@@ -1736,6 +1575,8 @@ class POSProductViewSet(viewsets.ModelViewSet):
             except (ValueError, TypeError):
                 pass  # Ignore invalid genre_id
             
+        if 'search_rank' in queryset.query.annotations:
+            return queryset.order_by('-search_rank', 'id')
         return queryset.order_by('id')
     
     def get_serializer_context(self):
@@ -99,23 +99,19 @@ class InvoiceAdmin(admin.ModelAdmin):
     is_fully_paid_display.short_description = 'Payment Status'
     
     def recalculate_payment_status(self, request, queryset):
-        for invoice in queryset:
-            invoice.recalculate_payment_status()
+        queryset.recalculate_payment_status()
         self.message_user(request, f"Payment status recalculated for {queryset.count()} invoices.")
     recalculate_payment_status.short_description = "Recalculate payment status"
     
     def generate_child_invoice(self, request, queryset):
-        if queryset.count() != 1:
-            self.message_user(request, "Please select exactly one invoice to generate a child invoice.", level='ERROR')
-            return
-        
-        invoice = queryset.first()
         try:
-            child_invoice = invoice.generate_child_invoice(paid_items_only=True)
-            self.message_user(request, f"Child invoice #{child_invoice.composite_id} generated successfully.")
+            children = queryset.generate_child_invoices(paid_items_only=True)
         except Exception as e:
-            self.message_user(request, f"Error generating child invoice: {str(e)}", level='ERROR')
-    generate_child_invoice.short_description = "Generate child invoice from selected invoice"
+            self.message_user(request, f"Error generating child invoices: {str(e)}", level='ERROR')
+            return
+        composite_ids = ', '.join(f"#{child.composite_id}" for child in children)
+        self.message_user(request, f"Child invoices {composite_ids} generated successfully.")
+    generate_child_invoice.short_description = "Generate child invoices from selected invoices"
     
     def save_model(self, request, obj, form, change):
         if not change:  # New object
@@ -0,0 +1,123 @@
+"""
+Set-based engine behind CheckoutView (POST /api/sales/checkout/).
+
+A POS sale is one request: the invoice, its items and an optional payment.
+Checkout checks the products in one query, locks the warehouse's Inventory
+rows for them with SELECT ... FOR UPDATE (in product order, like the
+transfer batches) and judges the items in request order against those
+balances, so a sale either fits the stock or nothing is written. The items
+are then written with one bulk INSERT and their stock leaves the warehouse
+through the ledger (see inventory.ledger). bulk_create sends no signals, so
+the work the InvoiceItem signals do (invoice totals, product sales stats,
+the daily rollup and the dashboard cache) is done here once for the sale.
+The number of queries does not depend on the number of items.
+"""
+from collections import defaultdict
+
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from inventory import ledger
+from inventory.models import Inventory, Product, StockMovement
+
+from . import dashboard_cache
+from .models import Invoice, InvoiceItem, Payment, ProductSalesStats, SalesDailyRollup
+from .serializers import full_payment_amount
+
+
+class Checkout:
+    def __init__(self, validated_data, user):
+        data = dict(validated_data)
+        self.items = data.pop('items')
+        self.payment_data = data.pop('payment', None)
+        self.invoice_data = data
+        self.user = user
+
+    def validate_products(self):
+        product_ids = {item['product_id'] for item in self.items}
+        known = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        errors = [
+            {} if item['product_id'] in known
+            else {"product_id": [f"Product with id {item['product_id']} not found"]}
+            for item in self.items
+        ]
+        if any(errors):
+            raise serializers.ValidationError({"items": errors})
+
+    def lock_stock(self, warehouse):
+        """Lock the warehouse's Inventory rows for the sale and return {product_id: quantity}."""
+        rows = (
+            Inventory.objects.select_for_update()
+            .filter(warehouse=warehouse, product_id__in={item['product_id'] for item in self.items})
+            .order_by('product_id')
+            .values_list('product_id', 'quantity')
+        )
+        return dict(rows)
+
+    def check_availability(self, stock):
+        balances = defaultdict(int, stock)
+        errors = []
+        for item in self.items:
+            available = balances[item['product_id']]
+            if available < item['quantity']:
+                errors.append({"quantity": [
+                    f"Insufficient inventory. Available: {available}, Requested: {item['quantity']}"
+                ]})
+                continue
+            balances[item['product_id']] -= item['quantity']
+            errors.append({})
+        if any(errors):
+            raise serializers.ValidationError({"items": errors})
+
+    def insert_items(self, invoice):
+        items = [
+            InvoiceItem(invoice=invoice, created_by=self.user, updated_by=self.user, **data).with_payment_summary()
+            for data in self.items
+        ]
+        InvoiceItem.objects.bulk_create(items)
+        if not connections[InvoiceItem.objects.db].features.can_return_rows_from_bulk_insert:
+            # MySQL cannot report the ids of a multi-row INSERT; the new
+            # invoice's rows come back in insertion order
+            for item, pk in zip(items, invoice.invoiceitem_set.order_by('pk').values_list('pk', flat=True)):
+                item.pk = pk
+        return items
+
+    def movements(self, invoice, items):
+        for item in items:
+            yield StockMovement(
+                product_id=item.product_id, warehouse_id=invoice.warehouse_id, quantity=-item.quantity,
+                kind=StockMovement.Kind.SALE, reference_id=item.pk, created_by=self.user,
+            )
+
+    def create_payment(self, invoice, items):
+        data = dict(self.payment_data)
+        data.setdefault('payment_date', timezone.localdate())
+        subtotal = sum((item.total_price for item in items), 0)
+        data['amount'] = full_payment_amount(invoice, data['amount'], subtotal=subtotal)
+        payment = Payment(invoice=invoice, created_by=self.user, updated_by=self.user, **data)
+        payment.save()
+        return payment
+
+    def run(self):
+        """Validate and write the sale. Returns (invoice, items, payment or None)."""
+        self.validate_products()
+        warehouse = self.invoice_data['warehouse']
+        with transaction.atomic():
+            stock = self.lock_stock(warehouse)
+            self.check_availability(stock)
+
+            invoice = Invoice(created_by=self.user, updated_by=self.user, **self.invoice_data)
+            invoice.save()
+            items = self.insert_items(invoice)
+            ledger.record(
+                self.movements(invoice, items),
+                user_id=self.user.pk,
+                existing={(product_id, warehouse.pk) for product_id in stock},
+            )
+            ProductSalesStats.apply_item_changes(new=[item.sales_stats_snapshot() for item in items])
+            Invoice.objects.filter(pk=invoice.pk).refresh_totals()
+            SalesDailyRollup.add_invoices(Invoice.objects.filter(pk=invoice.pk), items_only=True)
+            payment = self.create_payment(invoice, items) if self.payment_data else None
+            dashboard_cache.invalidate()
+        return invoice, items, payment
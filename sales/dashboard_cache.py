@@ -0,0 +1,80 @@
+"""
+Versioned response cache for the sales dashboards.
+
+Entries are keyed by (endpoint, warehouse_id, start_date, end_date) plus a
+generation counter. Sales writes bump the generation (see sales.signals), so
+older entries are never read again and simply age out via the TTL.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+GENERATION_KEY = 'sales:dashboard:generation'
+KEY_PARAMS = ('warehouse_id', 'start_date', 'end_date')
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so an evicted counter never repeats an old value
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate():
+    """Bump the generation once the current transaction commits."""
+    transaction.on_commit(bump_generation)
+
+
+def _etag(data):
+    payload = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    return '"%s"' % hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def _etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def cached_response(request, endpoint, build):
+    """
+    Serve ``build()`` (a view body returning a Response) from the cache.
+    Only 200 responses are stored; a matching If-None-Match yields a 304.
+    """
+    params = [request.query_params.get(name, '').strip() for name in KEY_PARAMS]
+    digest = hashlib.md5('|'.join(params).encode()).hexdigest()
+    key = f'sales:dashboard:{endpoint}:{get_generation()}:{digest}'
+
+    entry = cache.get(key)
+    if entry is None:
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        entry = {'etag': _etag(response.data), 'data': response.data}
+        cache.set(key, entry, timeout=getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', None))
+
+    if _etag_matches(request, entry['etag']):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(entry['data'])
+    response['ETag'] = entry['etag']
+    response['Cache-Control'] = 'private, no-cache'
+    return response
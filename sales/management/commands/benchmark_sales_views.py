@@ -0,0 +1,118 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from common.models import ListItem, ListType
+from inventory.models import Product, Warehouse
+from sales import dashboard_cache
+from sales.models import Customer, Invoice, InvoiceItem, SalesDailyRollup
+from sales.views import DashboardOverviewView, WarehouseDashboardView
+
+
+class Command(BaseCommand):
+    help = (
+        "Report query count and latency of the sales dashboards against a generated "
+        "dataset. Everything runs in a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=2000)
+        parser.add_argument('--items', type=int, default=5, help="Items per invoice.")
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--warehouses', type=int, default=3)
+        parser.add_argument('--days', type=int, default=90, help="Spread invoices over this many days.")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            warehouse = self.seed(rng, options)
+            today = timezone.localdate()
+            start = (today - timedelta(days=options['days'])).isoformat()
+            targets = [
+                ('dashboard overview', DashboardOverviewView, '/api/sales/dashboard/', {}),
+                ('dashboard overview (range)', DashboardOverviewView, '/api/sales/dashboard/',
+                 {'start_date': start, 'end_date': today.isoformat()}),
+                ('warehouse dashboard', WarehouseDashboardView, '/api/sales/warehouse-dashboard/',
+                 {'warehouse_id': warehouse.id, 'start_date': start, 'end_date': today.isoformat()}),
+            ]
+            for label, view_class, url, params in targets:
+                self.measure(label, view_class.as_view(), url, params, options['repeat'])
+            transaction.set_rollback(True)
+
+    def seed(self, rng, options):
+        self.user = get_user_model().objects.create(username=f'benchmark-{time.time_ns()}')
+        genres = ListType.objects.create(name_en='Genre', name_ar='Genre', code=f'benchmark-genre-{time.time_ns()}')
+        genre_items = [
+            ListItem.objects.create(list_type=genres, value=f'g{n}', display_name_en=f'Genre {n}', display_name_ar=f'Genre {n}')
+            for n in range(8)
+        ]
+        warehouses = Warehouse.objects.bulk_create(
+            Warehouse(name_en=f'Warehouse {n}', name_ar=f'Warehouse {n}', location='Benchmark')
+            for n in range(options['warehouses'])
+        )
+        products = Product.objects.bulk_create(
+            Product(isbn=f'bench-{n}', title_ar=f'Book {n}', title_en=f'Book {n}', genre=rng.choice(genre_items))
+            for n in range(options['products'])
+        )
+        customer = Customer.objects.create(institution_name='Benchmark customer')
+
+        now = timezone.now()
+        invoices = Invoice.objects.bulk_create(
+            Invoice(customer=customer, warehouse=rng.choice(warehouses))
+            for _ in range(options['invoices'])
+        )
+        for invoice in invoices:
+            invoice.created_at = now - timedelta(days=rng.randrange(options['days']), minutes=rng.randrange(1440))
+        Invoice.objects.bulk_update(invoices, ['created_at'], batch_size=1000)
+
+        items = []
+        for invoice in invoices:
+            for _ in range(options['items']):
+                quantity = rng.randint(1, 5)
+                unit_price = Decimal(rng.randint(100, 2000)) / 100
+                discount = rng.choice([Decimal('0'), Decimal('0'), Decimal('10'), Decimal('25')])
+                total = (unit_price * quantity * (100 - discount) / 100).quantize(Decimal('0.01'))
+                paid = rng.choice([Decimal('0'), total, (total / 2).quantize(Decimal('0.01'))])
+                items.append(InvoiceItem(
+                    invoice=invoice, product=rng.choice(products), quantity=quantity, unit_price=unit_price,
+                    discount_percent=discount, total_price=total, paid_amount=paid,
+                    remaining_amount=total - paid, is_paid=paid >= total,
+                ))
+        InvoiceItem.objects.bulk_create(items, batch_size=1000)
+        SalesDailyRollup.rebuild()
+
+        self.stdout.write(
+            f"Seeded {len(invoices)} invoices, {len(items)} items, {len(products)} products, "
+            f"{len(warehouses)} warehouses."
+        )
+        return warehouses[0]
+
+    def measure(self, label, view, url, params, repeat):
+        factory = APIRequestFactory()
+        timings, queries = [], 0
+        for _ in range(repeat):
+            # Measure the uncached path
+            dashboard_cache.bump_generation()
+            request = factory.get(url, params)
+            force_authenticate(request, user=self.user)
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = view(request)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = len(ctx.captured_queries)
+            assert response.status_code == 200, (label, response.status_code)
+        self.stdout.write(
+            f"{label:<32} queries={queries:<4} median={statistics.median(timings):8.1f} ms  "
+            f"min={min(timings):8.1f} ms"
+        )
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.models import Invoice
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill the stored invoice totals (subtotal, total_amount, total_paid, "
+        "payment_state) from invoice items, or report drift with --check."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report invoices whose stored totals are out of date; exit with an error if any are found.",
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--invoice-id', type=int, action='append', dest='invoice_ids',
+                            help="Limit to the given invoice id (repeatable).")
+
+    def handle(self, *args, **options):
+        queryset = Invoice.objects.all()
+        if options['invoice_ids']:
+            queryset = queryset.filter(pk__in=options['invoice_ids'])
+
+        drifted = queryset.refresh_totals(
+            batch_size=options['batch_size'],
+            commit=not options['check'],
+        )
+
+        if options['check']:
+            if drifted:
+                preview = ', '.join(str(pk) for pk in drifted[:50])
+                raise CommandError(
+                    f"{len(drifted)} invoice(s) have stale totals: {preview}"
+                    + (" ..." if len(drifted) > 50 else "")
+                )
+            self.stdout.write(self.style.SUCCESS("All invoice totals are up to date."))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"Updated totals for {len(drifted)} invoice(s)."))
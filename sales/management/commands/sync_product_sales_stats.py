@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.models import ProductSalesStats
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild ProductSalesStats (sold/actual) from invoice items, "
+        "or report drift between stored and computed values with --check."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report products whose stored stats are out of date; exit with an error if any are found.",
+        )
+        parser.add_argument('--product-id', type=int, action='append', dest='product_ids',
+                            help="Limit to the given product id (repeatable).")
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help="Rebuild this many products per transaction (recommended for large catalogs).")
+
+    def handle(self, *args, **options):
+        product_ids = options['product_ids']
+        drift = ProductSalesStats.find_drift(product_ids)
+
+        if options['check']:
+            if drift:
+                for row in drift[:50]:
+                    self.stdout.write(
+                        f"product {row['product_id']}: sold {row['sold']} (expected {row['expected_sold']}), "
+                        f"actual {row['actual']} (expected {row['expected_actual']})"
+                    )
+                raise CommandError(
+                    f"{len(drift)} product(s) have stale sales stats"
+                    + (" (first 50 shown)" if len(drift) > 50 else "")
+                )
+            self.stdout.write(self.style.SUCCESS("All product sales stats are up to date."))
+            return
+
+        report = ProductSalesStats.rebuild(product_ids=product_ids, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt sales stats for {report['products']} product(s), reset {report['reset']}, "
+            f"in {report['chunks']} chunk(s) ({report['duration_ms']} ms); {len(drift)} product(s) had drifted."
+        ))
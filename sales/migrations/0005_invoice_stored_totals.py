@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-16 23:02
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_listitem_created_by_listitem_updated_by_and_more'),
+        ('inventory', '0014_contract_royalties_type_product_language_and_more'),
+        ('sales', '0004_productsalesstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='payment_state',
+            field=models.CharField(choices=[('unpaid', 'Unpaid'), ('partial', 'Partially Paid'), ('paid', 'Fully Paid')], default='paid', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_paid',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['payment_state', 'created_at'], name='invoice_payment_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['total_paid'], name='invoice_total_paid_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-16 23:09
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_listitem_created_by_listitem_updated_by_and_more'),
+        ('inventory', '0014_contract_royalties_type_product_language_and_more'),
+        ('sales', '0005_invoice_stored_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('bills', models.IntegerField(default=0)),
+                ('genre', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='common.listitem')),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.product')),
+                ('warehouse', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.warehouse')),
+            ],
+            options={
+                'verbose_name': 'Sales Daily Rollup',
+                'verbose_name_plural': 'Sales Daily Rollups',
+                'indexes': [models.Index(fields=['date', 'warehouse'], name='sales_rollup_date_wh_idx'), models.Index(fields=['product', 'date'], name='sales_rollup_product_idx')],
+            },
+        ),
+    ]
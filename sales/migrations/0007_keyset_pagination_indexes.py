@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-16 23:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0003_search_token'),
+        ('inventory', '0018_keyset_pagination_indexes'),
+        ('sales', '0006_sales_daily_rollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['-created_at', 'id'], name='invoice_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceitem',
+            index=models.Index(fields=['-created_at', 'id'], name='invoiceitem_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-created_at', 'id'], name='payment_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations
+from django.db.models import Sum
+
+BATCH_SIZE = 500
+
+
+def invoice_totals(invoice, subtotal, paid):
+    """Invoice.compute_totals, for the historical model."""
+    subtotal = (subtotal or Decimal('0.00')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    paid = (paid or Decimal('0.00')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    customer_type = invoice.customer.customer_type if invoice.customer else None
+    if customer_type and customer_type.value == 'store':
+        total = subtotal
+    else:
+        discount = (subtotal * (invoice.global_discount_percent or Decimal('0'))) / Decimal('100')
+        discounted = subtotal - discount
+        tax = (discounted * (invoice.tax_percent or Decimal('0'))) / Decimal('100')
+        total = (discounted + tax).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    if (paid + Decimal('0.001')) >= total:
+        state = 'paid'
+    elif paid > 0:
+        state = 'partial'
+    else:
+        state = 'unpaid'
+    return {'subtotal': subtotal, 'total_amount': total, 'total_paid': paid, 'payment_state': state}
+
+
+def fill_invoice_totals(apps, schema_editor):
+    """The stored totals 0005 added with defaults, computed as InvoiceQuerySet.refresh_totals does."""
+    Invoice = apps.get_model('sales', 'Invoice')
+    InvoiceItem = apps.get_model('sales', 'InvoiceItem')
+    invoice_ids = list(Invoice.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(invoice_ids), BATCH_SIZE):
+        chunk = invoice_ids[start:start + BATCH_SIZE]
+        sums = {
+            row['invoice_id']: row
+            for row in InvoiceItem.objects.filter(invoice_id__in=chunk)
+            .values('invoice_id')
+            .annotate(subtotal=Sum('total_price'), paid=Sum('paid_amount'))
+            .order_by()
+        }
+        invoices = list(Invoice.objects.filter(pk__in=chunk).select_related('customer__customer_type'))
+        for invoice in invoices:
+            row = sums.get(invoice.pk, {})
+            for field, value in invoice_totals(invoice, row.get('subtotal'), row.get('paid')).items():
+                setattr(invoice, field, value)
+        Invoice.objects.bulk_update(invoices, ['subtotal', 'total_amount', 'total_paid', 'payment_state'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0007_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_invoice_totals, migrations.RunPython.noop),
+    ]
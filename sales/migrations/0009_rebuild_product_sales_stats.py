@@ -0,0 +1,61 @@
+from django.db import migrations, models
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Cast, Mod, Round
+
+BATCH_SIZE = 500
+
+
+def paid_quantity_expression():
+    """ProductSalesStats.paid_quantity_expression, frozen for this migration."""
+    def hundredths(field):
+        return Cast(Round(F(field) * 100), models.IntegerField())
+
+    paid = hundredths('paid_amount') * F('quantity')
+    total = hundredths('total_price')
+    return Case(
+        When(total_price__gt=0, then=Cast((paid - Mod(paid, total)) / total, models.IntegerField())),
+        When(is_paid=True, then=F('quantity')),
+        default=Value(0),
+        output_field=models.IntegerField(),
+    )
+
+
+def rebuild_product_sales_stats(apps, schema_editor):
+    """
+    ProductSalesStats.rebuild, for the historical models: the stats were only
+    recalculated by hand before the signals kept them, so the stored rows the
+    deltas now add to may be stale.
+    """
+    InvoiceItem = apps.get_model('sales', 'InvoiceItem')
+    ProductSalesStats = apps.get_model('sales', 'ProductSalesStats')
+    expected = {
+        row['product_id']: (row['sold'] or 0, row['actual'] or 0)
+        for row in InvoiceItem.objects.filter(product__isnull=False)
+        .values('product_id')
+        .annotate(sold=Sum('quantity'), actual=Sum(paid_quantity_expression()))
+        .order_by()
+    }
+
+    changed = []
+    for stats in ProductSalesStats.objects.order_by('pk'):
+        sold, actual = expected.pop(stats.product_id, (0, 0))
+        if (stats.sold, stats.actual) != (sold, actual):
+            stats.sold, stats.actual = sold, actual
+            changed.append(stats)
+    ProductSalesStats.objects.bulk_update(changed, ['sold', 'actual'], batch_size=BATCH_SIZE)
+    ProductSalesStats.objects.bulk_create(
+        [ProductSalesStats(product_id=product_id, sold=sold, actual=actual)
+         for product_id, (sold, actual) in sorted(expected.items())],
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0008_backfill_invoice_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_product_sales_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_sales_daily_rollup(apps, schema_editor):
+    """SalesDailyRollup.rebuild, for the historical models: 0006 created the table empty."""
+    Invoice = apps.get_model('sales', 'Invoice')
+    InvoiceItem = apps.get_model('sales', 'InvoiceItem')
+    SalesDailyRollup = apps.get_model('sales', 'SalesDailyRollup')
+    rows = [
+        SalesDailyRollup(
+            date=row['day'], warehouse_id=row['invoice__warehouse_id'],
+            product_id=row['product_id'], genre_id=row['product__genre_id'],
+            quantity=row['quantity'] or 0, revenue=row['revenue'] or Decimal('0.00'),
+            bills=row['bills'],
+        )
+        for row in InvoiceItem.objects.filter(product__isnull=False)
+        .annotate(day=TruncDate('invoice__created_at'))
+        .values('day', 'invoice__warehouse_id', 'product_id', 'product__genre_id')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('total_price'), bills=Count('invoice_id', distinct=True))
+        .order_by()
+    ]
+    rows.extend(
+        SalesDailyRollup(date=row['day'], warehouse_id=row['warehouse_id'], bills=row['bills'])
+        for row in Invoice.objects.annotate(day=TruncDate('created_at'))
+        .values('day', 'warehouse_id')
+        .annotate(bills=Count('id'))
+        .order_by()
+    )
+    SalesDailyRollup.objects.all().delete()
+    SalesDailyRollup.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0009_rebuild_product_sales_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_sales_daily_rollup, migrations.RunPython.noop),
+    ]
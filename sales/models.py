@@ -1,9 +1,17 @@
-from django.db import models
-from django.db.models import Sum
+from django.db import connections, models, transaction
+from django.db.models import Max, Sum, OuterRef, Subquery, Case, When, F, Value, DecimalField
+from django.db.models.functions import Cast, Coalesce, Greatest, Mod, Round, TruncDate
 from django.conf import settings
-from inventory.models import Product, Warehouse
-from common.models import ListItem
-from decimal import Decimal
+from django.utils import timezone
+from inventory.models import PrintRun, Product, Warehouse
+from common.models import ListItem, Sequence
+from . import dashboard_cache
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_FLOOR, ROUND_HALF_UP
+from functools import reduce
+from operator import or_
+import time
 
 
 # 🔁 Mixin for audit fields
@@ -34,7 +42,152 @@ class Customer(AuditModel):
         return self.institution_name
 
 # 🧾 Invoice
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def _item_sum(field):
+    """Correlated SUM over the invoice's items (no join fan-out on the outer query)."""
+    items = (
+        InvoiceItem.objects.filter(invoice=OuterRef('pk'))
+        .order_by()
+        .values('invoice')
+        .annotate(total=Sum(field))
+        .values('total')
+    )
+    return Coalesce(Subquery(items, output_field=MONEY), Value(Decimal('0.00')), output_field=MONEY)
+
+
+class InvoiceQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """Like QuerySet.bulk_create, with pks and composite ids assigned up front (Invoice.assign_ids)."""
+        objs = list(objs)
+        Invoice.assign_ids(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def with_totals(self):
+        """
+        Annotate live totals computed in SQL from the invoice items:
+        live_subtotal, live_total_paid, live_total_amount and live_total_remaining
+        (store customers already have the global discount inside item prices,
+        everyone else gets global discount and tax applied on the invoice, as in
+        calculated_total_amount).
+        """
+        hundred = Value(Decimal('100'), output_field=MONEY)
+        zero = Value(Decimal('0.00'), output_field=MONEY)
+        return self.annotate(
+            live_subtotal=_item_sum('total_price'),
+            live_total_paid=_item_sum('paid_amount'),
+        ).annotate(
+            live_total_amount=Case(
+                When(customer__customer_type__value='store', then=F('live_subtotal')),
+                default=Round(
+                    F('live_subtotal')
+                    * (hundred - Coalesce(F('global_discount_percent'), Value(Decimal('0'))))
+                    / hundred
+                    * (hundred + Coalesce(F('tax_percent'), Value(Decimal('0'))))
+                    / hundred,
+                    2,
+                ),
+                output_field=MONEY,
+            ),
+        ).annotate(
+            live_total_remaining=Greatest(F('live_total_amount') - F('live_total_paid'), zero, output_field=MONEY),
+        )
+
+    def outstanding(self):
+        """Invoices not fully paid (same 0.001 tolerance as Invoice.is_fully_paid)."""
+        return self.with_totals().filter(
+            live_total_amount__gt=F('live_total_paid') + Value(Decimal('0.001'))
+        )
+
+    def partially_paid(self):
+        """Invoices with some payment but not fully paid (Invoice.has_partial_payments)."""
+        return self.outstanding().filter(live_total_paid__gt=0)
+
+    def generate_child_invoices(self, paid_items_only=True):
+        """Invoice.create_children for every invoice in this queryset."""
+        return Invoice.create_children(list(self.order_by('pk')), paid_items_only=paid_items_only)
+
+    def recalculate_payment_status(self):
+        """
+        Set remaining_amount, item_remaining_amount and is_paid of every item of these invoices from
+        its total and paid amounts in one UPDATE, and rewrite the payment
+        notes. Items whose is_paid flips move their product's sales stats, as
+        their save signals would. Returns the number of items.
+        """
+        items = InvoiceItem.objects.filter(invoice__in=self.order_by().values('pk'))
+        paid = Case(When(paid_amount__gte=F('total_price'), then=Value(True)), default=Value(False),
+                    output_field=models.BooleanField())
+        with transaction.atomic():
+            flipped = list(
+                items.annotate(should_be_paid=paid).exclude(is_paid=F('should_be_paid'))
+                .values(*ProductSalesStats.ITEM_FIELDS)
+            )
+            remaining = F('total_price') - F('paid_amount')
+            updated = items.update(remaining_amount=remaining, item_remaining_amount=remaining, is_paid=paid)
+            ProductSalesStats.apply_item_changes(
+                old=flipped, new=[{**row, 'is_paid': not row['is_paid']} for row in flipped],
+            )
+
+            payments = Payment.objects.filter(invoice__in=self.order_by().values('pk')).only(
+                'pk', 'amount', 'payment_date', 'notes',
+            )
+            stale = []
+            for payment in payments:
+                notes = payment.notes
+                payment.update_payment_notes()
+                if payment.notes != notes:
+                    stale.append(payment)
+            Payment.objects.bulk_update(stale, ['notes'], batch_size=500)
+            if updated:
+                dashboard_cache.invalidate()
+        return updated
+
+    def refresh_totals(self, batch_size=500, commit=True):
+        """
+        Recompute the stored totals columns (subtotal, total_amount, total_paid,
+        payment_state) for every invoice in this queryset.
+
+        Item sums come from one grouped query per batch and only drifted rows are
+        written back with bulk_update. Returns the ids of the drifted invoices;
+        with commit=False nothing is written (used by the consistency check).
+        """
+        invoice_ids = list(self.order_by().values_list('pk', flat=True))
+        drifted = []
+        for start in range(0, len(invoice_ids), batch_size):
+            chunk = invoice_ids[start:start + batch_size]
+            sums = {
+                row['invoice_id']: row
+                for row in InvoiceItem.objects.filter(invoice_id__in=chunk)
+                .values('invoice_id')
+                .annotate(subtotal=Sum('total_price'), paid=Sum('paid_amount'))
+                .order_by()
+            }
+            changed = []
+            for invoice in Invoice.objects.filter(pk__in=chunk).select_related('customer__customer_type'):
+                row = sums.get(invoice.pk, {})
+                values = invoice.compute_totals(row.get('subtotal'), row.get('paid'))
+                if any(getattr(invoice, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(invoice, field, value)
+                    changed.append(invoice)
+            if commit and changed:
+                Invoice.objects.bulk_update(changed, list(Invoice.TOTALS_FIELDS))
+            drifted.extend(invoice.pk for invoice in changed)
+        return drifted
+
+
 class Invoice(AuditModel):
+    class PaymentState(models.TextChoices):
+        UNPAID = 'unpaid', 'Unpaid'
+        PARTIAL = 'partial', 'Partially Paid'
+        PAID = 'paid', 'Fully Paid'
+
+    # Denormalized from invoice items; maintained by refresh_totals()
+    TOTALS_FIELDS = ('subtotal', 'total_amount', 'total_paid', 'payment_state')
+    # common.Sequence that hands out invoice ids (see assign_ids)
+    ID_SEQUENCE = 'sales.invoice'
+
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True)
     warehouse = models.ForeignKey(Warehouse, on_delete=models.SET_NULL, null=True)
     invoice_type = models.ForeignKey(ListItem, on_delete=models.SET_NULL, null=True, related_name='invoice_type')
@@ -45,23 +198,122 @@ class Invoice(AuditModel):
     global_discount_percent = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0.00'))
     tax_percent = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0.00'))
 
-    
+    # Stored totals so list filters can run in SQL (see refresh_totals)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    total_paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    payment_state = models.CharField(
+        max_length=10, choices=PaymentState.choices, default=PaymentState.PAID, editable=False
+    )
+
     # Composite ID for display and search
     composite_id = models.CharField(max_length=50, null=True, blank=True, unique=True)
+
+    objects = InvoiceQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['payment_state', 'created_at'], name='invoice_payment_state_idx'),
+            models.Index(fields=['total_paid'], name='invoice_total_paid_idx'),
+            # Keyset pagination (inventory.pagination.KeysetPagination)
+            models.Index(fields=['-created_at', 'id'], name='invoice_created_id_idx'),
+        ]
     
     def save(self, *args, **kwargs):
-        # First save to get the ID
+        adding = self._state.adding
+        if not adding and kwargs.get('update_fields') is None:
+            # Never overwrite the stored totals from a possibly stale instance;
+            # they are owned by refresh_totals().
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.TOTALS_FIELDS
+            ]
+
+        if adding or not self.composite_id:
+            allocated, had_composite_id = self.pk is None, bool(self.composite_id)
+            Invoice.assign_ids([self])
+            if allocated:
+                # The pk is known, so skip the UPDATE Django tries first
+                kwargs.setdefault('force_insert', True)
+            elif not had_composite_id and kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = [*kwargs['update_fields'], 'composite_id']
+
         super().save(*args, **kwargs)
 
-        # Generate composite ID if not set (after we have the ID)
-        if not self.composite_id:
-            if self.main_invoice:
-                # ✅ Child invoice: parent_child (e.g., "160_161")
-                self.composite_id = f"{self.main_invoice.id}_{self.id}"
-            else:
-                # ✅ Main invoice: just its own ID
-                self.composite_id = str(self.id)
-            super().save(update_fields=['composite_id'])
+        if not adding:
+            # Customer, discount or tax may have changed
+            self.refresh_totals()
+
+    @classmethod
+    def assign_ids(cls, invoices):
+        """
+        Give unsaved invoices a pk from the invoice sequence and every invoice
+        its composite_id, so each is written with a single INSERT (save() and
+        Invoice.objects.bulk_create() call this). Unsaved invoices that bring
+        their own pk move the sequence past it; loaddata is covered by a
+        signal, but rows inserted with raw SQL must call Sequence.advance().
+        """
+        own = [invoice.pk for invoice in invoices if invoice.pk is not None and invoice._state.adding]
+        if own:
+            # Rows written with ids of their own must not be handed out later
+            Sequence.advance(cls.ID_SEQUENCE, max(own))
+        new = [invoice for invoice in invoices if invoice.pk is None]
+        if new:
+            ids = Sequence.allocate(
+                cls.ID_SEQUENCE, len(new), floor=lambda: cls.objects.aggregate(last=Max('pk'))['last'] or 0,
+            )
+            for invoice, pk in zip(new, ids):
+                invoice.pk = pk
+        for invoice in invoices:
+            if not invoice.composite_id:
+                invoice.composite_id = invoice.build_composite_id()
+
+    def build_composite_id(self):
+        if self.main_invoice_id:
+            # Child invoice: parent_child (e.g., "160_161")
+            return f"{self.main_invoice_id}_{self.pk}"
+        # Main invoice: just its own ID
+        return str(self.pk)
+
+    def refresh_totals(self):
+        """Recompute the stored totals for this invoice and reload them."""
+        Invoice.objects.filter(pk=self.pk).refresh_totals()
+        self.refresh_from_db(fields=list(self.TOTALS_FIELDS))
+
+    def compute_totals(self, subtotal=None, paid=None) -> dict:
+        """
+        Values for the stored totals columns given the item sums.
+        Mirrors calculated_total_amount / total_paid_amount / is_fully_paid.
+        """
+        # Halves round up, as SQL ROUND() does in with_totals()
+        subtotal = (subtotal or Decimal('0.00')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        paid = (paid or Decimal('0.00')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        if self._customer_type_value() == 'store':
+            total = subtotal
+        else:
+            discount = (subtotal * (self.global_discount_percent or Decimal('0'))) / Decimal('100')
+            discounted = subtotal - discount
+            tax = (discounted * (self.tax_percent or Decimal('0'))) / Decimal('100')
+            total = (discounted + tax).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+        if (paid + Decimal('0.001')) >= total:
+            state = self.PaymentState.PAID
+        elif paid > 0:
+            state = self.PaymentState.PARTIAL
+        else:
+            state = self.PaymentState.UNPAID
+
+        return {
+            'subtotal': subtotal,
+            'total_amount': total,
+            'total_paid': paid,
+            'payment_state': state,
+        }
+
+    def _customer_type_value(self):
+        if self.customer and self.customer.customer_type:
+            return self.customer.customer_type.value
+        return None
 
     @property
     def subtotal_amount(self) -> Decimal:
@@ -86,7 +338,7 @@ class Invoice(AuditModel):
         return (self.discounted_subtotal + self.tax_amount)
 
     @property
-    def total_amount(self) -> Decimal:
+    def calculated_total_amount(self) -> Decimal:
         """
         Grand total after global discount and tax (backwards-compatible name).
         
@@ -113,8 +365,10 @@ class Invoice(AuditModel):
             return sum((item.total_price for item in self.invoiceitem_set.all()), Decimal('0.00')).quantize(Decimal('0.01'))
         
         # For individual customers: global discount is NOT in item total_price
-        # So apply global discount and tax at invoice level
-        return (self.discounted_subtotal + self.tax_amount).quantize(Decimal('0.01'))
+        # So apply global discount and tax at invoice level. Halves round up
+        # (x.xx5 -> x.xx+0.01) to match the stored and SQL totals; this used to
+        # round halves to even.
+        return (self.discounted_subtotal + self.tax_amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
     @property
     def total_paid_amount(self) -> Decimal:
@@ -124,20 +378,21 @@ class Invoice(AuditModel):
     @property
     def total_remaining_amount(self) -> Decimal:
         """Invoice-level remaining = grand total - sum of item paid."""
-        rem = self.total_amount - self.total_paid_amount
+        rem = self.calculated_total_amount - self.total_paid_amount
         return rem if rem > 0 else Decimal('0.00')
 
     @property
     def payment_status(self) -> float:
         """Percent paid of the grand total."""
-        if self.total_amount == 0:
+        total = self.calculated_total_amount
+        if total == 0:
             return 100.0
-        return float((self.total_paid_amount / self.total_amount) * 100)
+        return float((self.total_paid_amount / total) * 100)
 
     @property
     def is_fully_paid(self) -> bool:
         """Treat as fully paid if within 0.001 OMR to tolerate rounding."""
-        return (self.total_paid_amount + Decimal('0.001')) >= self.total_amount
+        return (self.total_paid_amount + Decimal('0.001')) >= self.calculated_total_amount
 
     @property
     def has_partial_payments(self) -> bool:
@@ -153,54 +408,69 @@ class Invoice(AuditModel):
     
     def generate_child_invoice(self, paid_items_only=True):
         """Generate a child invoice from this invoice"""
-        # Create new invoice
-        child_invoice = Invoice.objects.create(
-            customer=self.customer,
-            warehouse=self.warehouse,
-            invoice_type=self.invoice_type,
-            payment_method=self.payment_method,
-            is_returnable=self.is_returnable,
-            main_invoice=self,  # Set this invoice as parent
-            notes=f"Generated from Invoice #{self.id}",
-            created_by=self.created_by,
-            updated_by=self.updated_by
-        )
-        
-        # Copy items based on selection
-        if paid_items_only:
-            # Copy only paid items
-            items_to_copy = self.paid_items
-        else:
-            # Copy all items
-            items_to_copy = self.invoiceitem_set.all()
-        
-        for item in items_to_copy:
-            InvoiceItem.objects.create(
-                invoice=child_invoice,
-                product=item.product,
-                quantity=item.quantity,
-                unit_price=item.unit_price,
-                discount_percent=item.discount_percent,
-                total_price=item.total_price,
-                paid_amount=item.paid_amount,
-                remaining_amount=item.remaining_amount,
-                is_paid=item.is_paid,
-                created_by=self.created_by,
-                updated_by=self.updated_by
+        return Invoice.create_children([self], paid_items_only=paid_items_only)[0]
+
+    @classmethod
+    def create_children(cls, parents, paid_items_only=True):
+        """
+        Create a child invoice for each parent with copies of its items (only
+        the paid ones with ``paid_items_only``), returned in parent order.
+
+        Children and items are written with bulk_create, so the work the
+        save signals do is done here once for all of them: stored totals,
+        product sales stats, the daily rollup and the dashboard cache. Child
+        items re-bill their parent's and move no stock.
+        """
+        if not parents:
+            return []
+        children = [
+            cls(
+                customer_id=parent.customer_id,
+                warehouse_id=parent.warehouse_id,
+                invoice_type_id=parent.invoice_type_id,
+                payment_method_id=parent.payment_method_id,
+                is_returnable=parent.is_returnable,
+                main_invoice_id=parent.pk,
+                notes=f"Generated from Invoice #{parent.pk}",
+                created_by_id=parent.created_by_id,
+                updated_by_id=parent.updated_by_id,
             )
-        
-        return child_invoice
+            for parent in parents
+        ]
+        with transaction.atomic():
+            cls.objects.bulk_create(children)
+            child_for = {parent.pk: child for parent, child in zip(parents, children)}
+            items = InvoiceItem.objects.filter(invoice_id__in=child_for).order_by('invoice_id', 'pk')
+            if paid_items_only:
+                items = items.filter(is_paid=True)
+            copies = [
+                InvoiceItem(
+                    invoice=child_for[item.invoice_id],
+                    product_id=item.product_id,
+                    quantity=item.quantity,
+                    unit_price=item.unit_price,
+                    discount_percent=item.discount_percent,
+                    total_price=item.total_price,
+                    paid_amount=item.paid_amount,
+                    created_by_id=child_for[item.invoice_id].created_by_id,
+                    updated_by_id=child_for[item.invoice_id].updated_by_id,
+                ).with_payment_summary()
+                for item in items
+            ]
+            InvoiceItem.objects.bulk_create(copies, batch_size=500)
+
+            ProductSalesStats.apply_item_changes(new=[item.sales_stats_snapshot() for item in copies])
+            cls.objects.filter(pk__in=[child.pk for child in children]).refresh_totals()
+            SalesDailyRollup.add_invoices(cls.objects.filter(pk__in=[child.pk for child in children]))
+            dashboard_cache.invalidate()
+        # With the totals just stored
+        fresh = cls.objects.in_bulk([child.pk for child in children])
+        return [fresh[child.pk] for child in children]
 
     def recalculate_payment_status(self):
         """Recalculate payment status for all items in this invoice"""
-        for item in self.invoiceitem_set.all():
-            item.remaining_amount = item.total_price - item.paid_amount
-            item.is_paid = item.paid_amount >= item.total_price
-            item.save(update_fields=['remaining_amount', 'is_paid'])
-        
-        # Update payment notes for this invoice
-        self.update_payment_notes()
-    
+        Invoice.objects.filter(pk=self.pk).recalculate_payment_status()
+
     def update_payment_notes(self):
         """Update notes for all payments of this invoice"""
         for payment in self.payment_set.all():
@@ -212,6 +482,30 @@ class Invoice(AuditModel):
         return f"Invoice #{composite_id} - {customer_name}"
 
 # 🧾 Invoice Items
+class InvoiceItemQuerySet(models.QuerySet):
+    def with_print_run(self, sold_at='invoice__created_at'):
+        """
+        Annotate ``print_run_id`` with the product's print run in effect when the
+        item was sold: the latest ``published_at`` on or before the sale date
+        (the higher edition wins a tie). Items sold before the first print run
+        get None. ``sold_at`` names the datetime the sale date is taken from.
+        """
+        in_effect = PrintRun.objects.filter(
+            product_id=OuterRef('product_id'),
+            published_at__lte=OuterRef('sale_date'),
+        ).order_by('-published_at', '-edition_number').values('pk')[:1]
+        return self.annotate(sale_date=TruncDate(sold_at), print_run_id=Subquery(in_effect))
+
+    def sales_by_print_run(self, sold_at='invoice__created_at'):
+        """Rows of {'product_id', 'print_run_id', 'items', 'quantity', 'revenue'} per edition."""
+        return (
+            self.with_print_run(sold_at)
+            .values('product_id', 'print_run_id')
+            .annotate(items=models.Count('id'), quantity=Sum('quantity'), revenue=Sum('total_price'))
+            .order_by('product_id', 'print_run_id')
+        )
+
+
 class InvoiceItem(AuditModel):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
@@ -229,18 +523,34 @@ class InvoiceItem(AuditModel):
     item_total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     item_paid_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     item_remaining_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    objects = InvoiceItemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination (inventory.pagination.KeysetPagination)
+            models.Index(fields=['-created_at', 'id'], name='invoiceitem_created_id_idx'),
+        ]
     
     def save(self, *args, **kwargs):
-        # Auto-calculate remaining amount and update paid status
+        self.with_payment_summary()
+
+        # Keep the row and the signal-maintained aggregates in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def with_payment_summary(self):
+        """Derive remaining amount, paid status and the summary fields from total and paid; returns self."""
         self.remaining_amount = self.total_price - self.paid_amount
         self.is_paid = self.paid_amount >= self.total_price
-        
-        # Update payment summary fields
         self.item_total_amount = self.total_price
         self.item_paid_amount = self.paid_amount
         self.item_remaining_amount = self.remaining_amount
-        
-        super().save(*args, **kwargs)
+        return self
+
+    def sales_stats_snapshot(self):
+        """Values ProductSalesStats derives from this item."""
+        return {field: getattr(self, field) for field in ProductSalesStats.ITEM_FIELDS}
     
     @property
     def payment_status(self):
@@ -278,6 +588,12 @@ class Payment(AuditModel):
     invoice_total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     invoice_paid_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     invoice_remaining_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination (inventory.pagination.KeysetPagination)
+            models.Index(fields=['-created_at', 'id'], name='payment_created_id_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
@@ -437,66 +753,492 @@ class ProductSalesStats(AuditModel):
         product_name = str(self.product) if self.product else "Unknown Product"
         return f"{product_name} - Sold: {self.sold}, Actual: {self.actual}"
     
+    # Fields an InvoiceItem contributes to the stats through
+    ITEM_FIELDS = ('product_id', 'quantity', 'total_price', 'paid_amount', 'is_paid')
+
+    @staticmethod
+    def paid_quantity(quantity, total_price, paid_amount, is_paid):
+        """
+        Books counted as paid for one invoice item.
+        Partially paid items count floor(paid_amount / total_price * quantity)
+        books, mirroring ``paid_quantity_expression`` in SQL.
+        """
+        if total_price > 0:
+            paid = Decimal(paid_amount) * quantity / Decimal(total_price)
+            return int(paid.to_integral_value(rounding=ROUND_FLOOR))
+        return quantity if is_paid else 0
+
+    @staticmethod
+    def paid_quantity_expression():
+        """
+        SQL version of ``paid_quantity`` for use over InvoiceItem rows.
+        The amounts have two decimal places, so it divides them as whole
+        hundredths with exact integer floor division: SQLite keeps them as
+        floats, where 3.30 * 3 / 9.90 falls just short of 1.
+        """
+        def hundredths(field):
+            return Cast(Round(F(field) * 100), models.IntegerField())
+
+        paid = hundredths('paid_amount') * F('quantity')
+        total = hundredths('total_price')
+        return Case(
+            When(total_price__gt=0, then=Cast((paid - Mod(paid, total)) / total, models.IntegerField())),
+            When(is_paid=True, then=F('quantity')),
+            default=Value(0),
+            output_field=models.IntegerField(),
+        )
+
+    @classmethod
+    def aggregate_by_product(cls, product_ids=None):
+        """
+        One grouped query returning expected ``sold``/``actual`` per product:
+        rows of {'product_id', 'sold', 'actual'}.
+        """
+        items = InvoiceItem.objects.filter(product__isnull=False)
+        if product_ids is not None:
+            items = items.filter(product_id__in=product_ids)
+        return (
+            items.values('product_id')
+            .annotate(sold=Sum('quantity'), actual=Sum(cls.paid_quantity_expression()))
+            .order_by()
+        )
+
     @classmethod
     def calculate_for_product(cls, product):
         """
         Calculate and update sales stats for a specific product.
-        This aggregates data from all InvoiceItems for this product.
+        Accepts a Product or its id; the totals come from a single aggregate.
         """
-        from django.db.models import Sum, F
-        from math import floor
-        
-        # Get all invoice items for this product
-        items = InvoiceItem.objects.filter(product=product)
-        
-        # Calculate total sold (sum of all quantities)
-        total_sold = items.aggregate(total=Sum('quantity'))['total'] or 0
-        
-        # Calculate total actual (paid books)
-        # For each item: if fully paid, count all quantity
-        # If partially paid, calculate proportion: (paid_amount / total_price) * quantity
-        total_actual = 0
-        for item in items:
-            if item.total_price > 0:
-                # Calculate paid proportion
-                paid_proportion = float(item.paid_amount) / float(item.total_price)
-                # Calculate how many books are paid (round down to be conservative)
-                paid_quantity = floor(paid_proportion * item.quantity)
-                total_actual += paid_quantity
-            elif item.is_paid:
-                # If total_price is 0 but marked as paid, count all quantity
-                total_actual += item.quantity
-        
-        # Get or create the stats record
-        stats, created = cls.objects.get_or_create(
-            product=product,
+        product_id = getattr(product, 'pk', product)
+        row = next(iter(cls.aggregate_by_product([product_id])), {})
+        stats, _ = cls.objects.update_or_create(
+            product_id=product_id,
             defaults={
-                'sold': total_sold,
-                'actual': total_actual,
+                'sold': row.get('sold') or 0,
+                'actual': row.get('actual') or 0,
             }
         )
-        
-        # Update if it already exists
-        if not created:
-            stats.sold = total_sold
-            stats.actual = total_actual
-            stats.save(update_fields=['sold', 'actual', 'updated_at'])
-        
         return stats
-    
+
+    @classmethod
+    def rebuild(cls, product_ids=None, chunk_size=None):
+        """
+        Set-based rebuild of sold/actual.
+
+        Each chunk of products costs one grouped aggregate plus an upsert
+        (bulk_create with update_conflicts) and one UPDATE resetting stats
+        rows whose products no longer have sales. Without ``chunk_size``
+        the whole catalog is one chunk. Returns counts and the elapsed time.
+        """
+        started = time.monotonic()
+        report = {'products': 0, 'reset': 0, 'chunks': 0}
+
+        if chunk_size:
+            ids = product_ids
+            if ids is None:
+                ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+            ids = sorted(ids)
+            chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+        else:
+            chunks = [product_ids]
+
+        for chunk in chunks:
+            written, reset = cls._rebuild_chunk(chunk)
+            report['products'] += written
+            report['reset'] += reset
+            report['chunks'] += 1
+
+        report['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return report
+
+    @classmethod
+    def _rebuild_chunk(cls, product_ids):
+        rows = list(cls.aggregate_by_product(product_ids))
+        now = timezone.now()
+        stats = [
+            cls(product_id=row['product_id'], sold=row['sold'] or 0, actual=row['actual'] or 0,
+                created_at=now, updated_at=now)
+            for row in rows
+        ]
+        # MySQL upserts on any unique key and rejects an explicit target
+        features = connections[cls.objects.db].features
+        unique_fields = ['product'] if features.supports_update_conflicts_with_target else None
+
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                stats,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=['sold', 'actual', 'updated_at'],
+            )
+            stale = cls.objects.exclude(product_id__in=[row['product_id'] for row in rows])
+            if product_ids is not None:
+                stale = stale.filter(product_id__in=product_ids)
+            reset = stale.exclude(sold=0, actual=0).update(sold=0, actual=0, updated_at=now)
+        return len(stats), reset
+
     @classmethod
     def recalculate_all(cls):
-        """Recalculate stats for all products that have invoice items."""
-        from inventory.models import Product
-        
-        # Get all products that have invoice items
-        products_with_sales = Product.objects.filter(
-            invoiceitem__isnull=False
-        ).distinct()
-        
-        updated_count = 0
-        for product in products_with_sales:
-            cls.calculate_for_product(product)
-            updated_count += 1
-        
-        return updated_count
\ No newline at end of file
+        """Recalculate stats for all products; returns the number with sales."""
+        return cls.rebuild()['products']
+
+    @classmethod
+    def apply_item_change(cls, old=None, new=None):
+        """
+        Apply the difference between two InvoiceItem snapshots (dicts of
+        ``ITEM_FIELDS``; None for create/delete) as F() deltas.
+        Products without a stats row yet get a one-off calculation.
+        """
+        deltas = cls._item_deltas([old] if old else [], [new] if new else [])
+
+        with transaction.atomic():
+            for product_id, (sold, actual) in deltas.items():
+                if not sold and not actual:
+                    continue
+                updated = cls.objects.filter(product_id=product_id).update(
+                    sold=F('sold') + sold,
+                    actual=F('actual') + actual,
+                    updated_at=timezone.now(),
+                )
+                if not updated:
+                    cls.calculate_for_product(product_id)
+
+    @classmethod
+    def apply_item_changes(cls, old=(), new=()):
+        """
+        apply_item_change for many items at once, for bulk writes that skip the
+        signals: one UPDATE with per-product deltas for the products that have a
+        stats row and one rebuild of those that do not. Call it after the
+        write, as the signals do.
+        """
+        deltas = {
+            product_id: delta for product_id, delta in cls._item_deltas(old, new).items() if delta != (0, 0)
+        }
+        if not deltas:
+            return
+        with transaction.atomic():
+            existing = sorted(cls.objects.filter(product_id__in=deltas).values_list('product_id', flat=True))
+            if existing:
+                cls.objects.filter(product_id__in=existing).update(
+                    **{
+                        field: F(field) + Case(
+                            *(When(product_id=product_id, then=Value(deltas[product_id][position]))
+                              for product_id in existing),
+                            default=Value(0),
+                        )
+                        for position, field in enumerate(('sold', 'actual'))
+                    },
+                    updated_at=timezone.now(),
+                )
+            missing = sorted(set(deltas) - set(existing))
+            if missing:
+                cls.rebuild(missing)
+
+    @classmethod
+    def _item_deltas(cls, old, new):
+        """{product_id: (sold, actual)} change from the ``old`` to the ``new`` item snapshots."""
+        deltas = {}
+        for snapshots, sign in ((old, -1), (new, 1)):
+            for snapshot in snapshots:
+                if not snapshot['product_id']:
+                    continue
+                sold, actual = deltas.get(snapshot['product_id'], (0, 0))
+                deltas[snapshot['product_id']] = (
+                    sold + sign * snapshot['quantity'],
+                    actual + sign * cls.paid_quantity(
+                        snapshot['quantity'], snapshot['total_price'],
+                        snapshot['paid_amount'], snapshot['is_paid'],
+                    ),
+                )
+        return deltas
+
+    @classmethod
+    def find_drift(cls, product_ids=None):
+        """
+        Compare stored stats with a fresh aggregate of the invoice items.
+        Returns a list of {'product_id', 'sold', 'actual', 'expected_sold',
+        'expected_actual'} for every product that disagrees; a missing stats
+        row counts as drift only if the product has sales.
+        """
+        expected = {
+            row['product_id']: (row['sold'] or 0, row['actual'] or 0)
+            for row in cls.aggregate_by_product(product_ids)
+        }
+        stored_qs = cls.objects.all()
+        if product_ids is not None:
+            stored_qs = stored_qs.filter(product_id__in=product_ids)
+        stored = {
+            row['product_id']: (row['sold'], row['actual'])
+            for row in stored_qs.values('product_id', 'sold', 'actual')
+        }
+
+        drift = []
+        for product_id in sorted(set(expected) | set(stored)):
+            want = expected.get(product_id, (0, 0))
+            have = stored.get(product_id)
+            if have is None and want == (0, 0):
+                continue
+            if have != want:
+                drift.append({
+                    'product_id': product_id,
+                    'sold': have[0] if have else None,
+                    'actual': have[1] if have else None,
+                    'expected_sold': want[0],
+                    'expected_actual': want[1],
+                })
+        return drift
+
+
+# 📅 Daily sales rollup
+class SalesDailyRollupQuerySet(models.QuerySet):
+    def in_range(self, start_date=None, end_date=None):
+        """Rows whose date falls in [start_date, end_date]; either bound may be open."""
+        qs = self
+        if start_date is not None:
+            qs = qs.filter(date__gte=start_date)
+        if end_date is not None:
+            qs = qs.filter(date__lte=end_date)
+        return qs
+
+    def totals(self):
+        """Bills, books and revenue over the selected rows in one query."""
+        return self.aggregate(
+            bills=Coalesce(Sum('bills', filter=models.Q(product__isnull=True)), 0),
+            books=Coalesce(Sum('quantity', filter=models.Q(product__isnull=False)), 0),
+            revenue=Coalesce(
+                Sum('revenue', filter=models.Q(product__isnull=False)),
+                Value(Decimal('0.00')), output_field=MONEY,
+            ),
+        )
+
+
+class SalesDailyRollup(models.Model):
+    """
+    Pre-aggregated sales per (date, warehouse, product, genre), keyed on the
+    local date of Invoice.created_at.
+
+    Product rows carry quantity, revenue (sum of item total_price) and the
+    number of invoices containing the product. Rows with no product carry the
+    invoice count for the (date, warehouse), items or not, so bill totals
+    can be summed without double counting multi-product invoices.
+    Maintained with per-row deltas by the sales signals (see apply_deltas).
+    """
+    date = models.DateField()
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.SET_NULL, null=True, related_name='+')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, related_name='+')
+    genre = models.ForeignKey(ListItem, on_delete=models.SET_NULL, null=True, related_name='+')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    bills = models.IntegerField(default=0)
+
+    objects = SalesDailyRollupQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Sales Daily Rollup"
+        verbose_name_plural = "Sales Daily Rollups"
+        indexes = [
+            models.Index(fields=['date', 'warehouse'], name='sales_rollup_date_wh_idx'),
+            models.Index(fields=['product', 'date'], name='sales_rollup_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} wh={self.warehouse_id} product={self.product_id}: {self.quantity}"
+
+    @staticmethod
+    def slice_for(created_at, warehouse_id):
+        """The (date, warehouse_id) slice an invoice belongs to."""
+        return (timezone.localdate(created_at), warehouse_id)
+
+    @classmethod
+    def compute(cls, invoices):
+        """Unsaved rollup rows aggregated from the given Invoice queryset (two grouped queries)."""
+        rows = [
+            cls(
+                date=row['day'], warehouse_id=row['invoice__warehouse_id'],
+                product_id=row['product_id'], genre_id=row['product__genre_id'],
+                quantity=row['quantity'] or 0, revenue=row['revenue'] or Decimal('0.00'),
+                bills=row['bills'],
+            )
+            for row in InvoiceItem.objects.filter(product__isnull=False, invoice__in=invoices)
+            .annotate(day=TruncDate('invoice__created_at'))
+            .values('day', 'invoice__warehouse_id', 'product_id', 'product__genre_id')
+            .annotate(
+                quantity=Sum('quantity'),
+                revenue=Sum('total_price'),
+                bills=models.Count('invoice_id', distinct=True),
+            )
+            .order_by()
+        ]
+        rows.extend(
+            cls(date=row['day'], warehouse_id=row['warehouse_id'], bills=row['bills'])
+            for row in invoices.annotate(day=TruncDate('created_at'))
+            .values('day', 'warehouse_id')
+            .annotate(bills=models.Count('id'))
+            .order_by()
+        )
+        return rows
+
+    @staticmethod
+    def _day_bounds(start_date, end_date):
+        tz = timezone.get_current_timezone()
+        start = timezone.make_aware(datetime.combine(start_date, datetime.min.time()), tz)
+        end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), datetime.min.time()), tz)
+        return start, end
+
+    @classmethod
+    def _invoices_in_range(cls, start_date=None, end_date=None):
+        invoices = Invoice.objects.all()
+        if start_date is not None or end_date is not None:
+            start, end = cls._day_bounds(start_date or date.min, end_date or date.max - timedelta(days=1))
+            invoices = invoices.filter(created_at__gte=start, created_at__lt=end)
+        return invoices
+
+    @staticmethod
+    def _keys_filter(keys):
+        return reduce(or_, (
+            models.Q(date=day, warehouse_id=warehouse_id, product_id=product_id)
+            for day, warehouse_id, product_id in keys
+        ))
+
+    @classmethod
+    def apply_deltas(cls, *parts):
+        """
+        Add {(date, warehouse_id, product_id): (quantity, revenue, bills)}
+        deltas (several dicts are summed) to the stored rows in one F()
+        UPDATE. A key with no row gets one, product rows with the product's
+        genre; keys left with no bills lose their rows. Two first writes to a
+        key may each insert a row; every reader sums the rows of a key.
+        """
+        deltas = defaultdict(lambda: (0, Decimal('0.00'), 0))
+        for part in parts:
+            for key, (quantity, revenue, bills) in part.items():
+                total = deltas[key]
+                deltas[key] = (total[0] + quantity, total[1] + revenue, total[2] + bills)
+        keys = sorted(
+            (key for key, delta in deltas.items() if any(delta)),
+            key=lambda key: (key[0], key[1] or 0, key[2] or 0),
+        )
+        if not keys:
+            return
+
+        with transaction.atomic():
+            first = {}
+            rows = cls.objects.filter(cls._keys_filter(keys)).order_by('pk')
+            for pk, *key in rows.values_list('pk', 'date', 'warehouse_id', 'product_id'):
+                first.setdefault(tuple(key), pk)
+            existing = [key for key in keys if key in first]
+            if existing:
+                def delta(index, zero, output_field):
+                    return Case(
+                        *(When(pk=first[key], then=Value(deltas[key][index])) for key in existing),
+                        default=Value(zero), output_field=output_field,
+                    )
+                cls.objects.filter(pk__in=[first[key] for key in existing]).update(
+                    quantity=F('quantity') + delta(0, 0, models.IntegerField()),
+                    revenue=F('revenue') + delta(1, Decimal('0.00'), MONEY),
+                    bills=F('bills') + delta(2, 0, models.IntegerField()),
+                )
+
+            missing = [key for key in keys if key not in first and deltas[key][2] > 0]
+            if missing:
+                genres = dict(
+                    Product.objects.filter(pk__in={key[2] for key in missing if key[2]}).values_list('pk', 'genre_id')
+                )
+                created = []
+                for day, warehouse_id, product_id in missing:
+                    if product_id is not None and product_id not in genres:
+                        continue  # The product is gone
+                    quantity, revenue, bills = deltas[day, warehouse_id, product_id]
+                    created.append(cls(
+                        date=day, warehouse_id=warehouse_id, product_id=product_id, genre_id=genres.get(product_id),
+                        quantity=quantity, revenue=revenue, bills=bills,
+                    ))
+                cls.objects.bulk_create(created)
+
+            emptied = [key for key in existing if deltas[key][2] < 0]
+            if emptied:
+                bills = defaultdict(int)
+                rows = cls.objects.filter(cls._keys_filter(emptied))
+                for *key, count in rows.values_list('date', 'warehouse_id', 'product_id', 'bills'):
+                    bills[tuple(key)] += count
+                gone = [key for key, count in bills.items() if count <= 0]
+                if gone:
+                    cls.objects.filter(cls._keys_filter(gone)).delete()
+
+    @classmethod
+    def item_deltas(cls, old=None, new=None, item_id=None):
+        """
+        Deltas taking one invoice item's share from ``old`` to ``new``: dicts
+        of its invoice_id, slice, product_id, quantity and total_price, or
+        None. A product's bill count only moves with the first or last item of
+        it on an invoice, which is asked of that invoice's items.
+        """
+        deltas = defaultdict(lambda: (0, Decimal('0.00'), 0))
+        same_bill = old and new and (old['invoice_id'], old['product_id']) == (new['invoice_id'], new['product_id'])
+        for entry, sign in ((old, -1), (new, 1)):
+            if not entry or not entry['product_id'] or not entry['slice']:
+                continue
+            bills = 0
+            if not same_bill:
+                others = InvoiceItem.objects.filter(invoice_id=entry['invoice_id'], product_id=entry['product_id'])
+                bills = 0 if others.exclude(pk=item_id).exists() else sign
+            key = (*entry['slice'], entry['product_id'])
+            quantity, revenue, count = deltas[key]
+            deltas[key] = (quantity + sign * entry['quantity'], revenue + sign * entry['total_price'], count + bills)
+        return deltas
+
+    @classmethod
+    def invoice_deltas(cls, invoices, sign=1, slice=None, items_only=False):
+        """
+        Deltas adding (or with sign=-1 removing) what compute() counts for
+        ``invoices``; for one invoice, ``slice`` books it under another
+        (date, warehouse_id) than its own.
+        """
+        deltas = defaultdict(lambda: (0, Decimal('0.00'), 0))
+        for row in cls.compute(invoices):
+            if items_only and row.product_id is None:
+                continue
+            day, warehouse_id = slice or (row.date, row.warehouse_id)
+            quantity, revenue, bills = deltas[day, warehouse_id, row.product_id]
+            deltas[day, warehouse_id, row.product_id] = (
+                quantity + sign * row.quantity, revenue + sign * row.revenue, bills + sign * row.bills,
+            )
+        return deltas
+
+    @classmethod
+    def add_invoices(cls, invoices, items_only=False):
+        """Count invoices (and their items) written without signals, e.g. by bulk_create."""
+        cls.apply_deltas(cls.invoice_deltas(invoices, items_only=items_only))
+
+    @classmethod
+    def rebuild(cls, start_date=None, end_date=None):
+        """
+        Replace the rollup (or the [start_date, end_date] part of it) with a
+        fresh aggregate. Returns the number of rows written.
+        """
+        invoices = cls._invoices_in_range(start_date, end_date)
+        rows = cls.compute(invoices)
+        with transaction.atomic():
+            cls.objects.in_range(start_date, end_date).delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+    @classmethod
+    def find_drift(cls, start_date=None, end_date=None):
+        """Keys (date, warehouse_id, product_id) whose stored figures differ from live data."""
+        def keyed(rows):
+            totals = {}
+            for row in rows:
+                key = (row.date, row.warehouse_id, row.product_id)
+                quantity, revenue, bills = totals.get(key, (0, Decimal('0.00'), 0))
+                totals[key] = (quantity + row.quantity, revenue + Decimal(row.revenue), bills + row.bills)
+            return totals
+
+        invoices = cls._invoices_in_range(start_date, end_date)
+        expected = keyed(cls.compute(invoices))
+        stored = keyed(cls.objects.in_range(start_date, end_date))
+        return sorted(
+            (key for key in set(expected) | set(stored) if expected.get(key) != stored.get(key)),
+            key=lambda key: (key[0], key[1] or 0, key[2] or 0),
+        )
@@ -0,0 +1,255 @@
+"""
+Royalty calculation for contracts.
+
+RoyaltyEngine loads everything the calculation needs for a batch of contracts
+in a fixed number of queries (products, sales stats, print runs, free copies,
+per-edition sales counts and latest payments), then evaluates each contract in
+memory. CalculateRoyaltiesView uses it for a single contract and
+BatchCalculateRoyaltiesView for every active contract at once.
+
+Calculation (commission_percent is a whole percentage, e.g. 5.00):
+- retail_price: Z = sum(latest payment invoice_paid_amount per invoice with
+  the product) - fixed_amount; RA = Z × commission/100 when Z >= 0.
+- list_price: X = fixed_amount × price / commission, Y = actual - X - free
+  copies of all the project's contracts; RA = Y × sum(print run price ×
+  items sold while that print run was the latest) × commission/100.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import OuterRef, Subquery, Sum
+from rest_framework import status
+
+from common import reference_data
+from inventory.models import Contract, PrintRun, Product
+from .models import InvoiceItem, Payment, ProductSalesStats
+
+LIST_PRICE = 52
+RETAIL_PRICE = 53
+
+
+def _number(value):
+    """Whole numbers as int for display, anything else as float."""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def active_contracts():
+    """Contracts whose status is not the contract_status 'closed' item."""
+    contracts = Contract.objects.select_related('project', 'royalties_type').order_by('id')
+    closed_status = reference_data.get("contract_status", "closed")
+    if closed_status:
+        contracts = contracts.exclude(status=closed_status)
+    return contracts
+
+
+class RoyaltyEngine:
+    def __init__(self, contracts):
+        self.contracts = list(contracts)
+        project_ids = {c.project_id for c in self.contracts}
+
+        # First product per project, as Product.objects.filter(project=...).first()
+        self.products = {}
+        for product in Product.objects.filter(project_id__in=project_ids).order_by('pk'):
+            self.products.setdefault(product.project_id, product)
+        product_ids = [product.pk for product in self.products.values()]
+
+        self.actual = dict(
+            ProductSalesStats.objects.filter(product_id__in=product_ids).values_list('product_id', 'actual')
+        )
+        missing = [pk for pk in product_ids if pk not in self.actual]
+        if missing:
+            ProductSalesStats.rebuild(product_ids=missing)
+            self.actual.update(
+                ProductSalesStats.objects.filter(product_id__in=missing).values_list('product_id', 'actual')
+            )
+
+        self.print_runs = defaultdict(list)
+        for print_run in PrintRun.objects.filter(product_id__in=product_ids).order_by(
+            'product_id', 'published_at', 'edition_number'
+        ):
+            self.print_runs[print_run.product_id].append(print_run)
+
+        self.free_copies = dict(
+            Contract.objects.filter(project_id__in=project_ids)
+            .values('project_id')
+            .annotate(total=Sum('free_copies'))
+            .values_list('project_id', 'total')
+        )
+
+        by_type = defaultdict(set)
+        for contract in self.contracts:
+            product = self.products.get(contract.project_id)
+            if product and contract.royalties_type_id:
+                by_type[contract.royalties_type_id].add(product.pk)
+        self.edition_sales = self._load_edition_sales(by_type[LIST_PRICE])
+        self.paid_amounts = self._load_paid_amounts(by_type[RETAIL_PRICE])
+
+    @staticmethod
+    def _load_edition_sales(product_ids):
+        """{product_id: {print_run_id: items}} from one grouped query."""
+        sales = defaultdict(dict)
+        if not product_ids:
+            return sales
+        # Windows follow the item's own created_at, as the statement always has
+        for row in InvoiceItem.objects.filter(product_id__in=product_ids).sales_by_print_run(sold_at='created_at'):
+            if row['print_run_id'] is not None:
+                sales[row['product_id']][row['print_run_id']] = row['items']
+        return sales
+
+    @staticmethod
+    def _load_paid_amounts(product_ids):
+        """{product_id: sum of the latest payment's invoice_paid_amount per invoice}."""
+        totals = defaultdict(lambda: Decimal('0'))
+        if not product_ids:
+            return totals
+        latest_paid = Payment.objects.filter(invoice_id=OuterRef('invoice_id')).order_by(
+            '-created_at', '-id'
+        ).values('invoice_paid_amount')[:1]
+        rows = (
+            InvoiceItem.objects.filter(product_id__in=product_ids)
+            .values('product_id', 'invoice_id')
+            .annotate(latest_paid=Subquery(latest_paid))
+            .order_by()
+            .distinct()
+        )
+        for row in rows:
+            if row['latest_paid']:
+                totals[row['product_id']] += Decimal(str(row['latest_paid']))
+        return totals
+
+    def sales_by_print_run(self, product_id):
+        """
+        Items sold while each print run was the latest published one.
+        Returns [(print_run, count), ...] in published order.
+        """
+        counts = self.edition_sales[product_id]
+        return [(print_run, counts.get(print_run.pk, 0)) for print_run in self.print_runs[product_id]]
+
+    def calculate_all(self):
+        return [(contract, *self.calculate(contract)) for contract in self.contracts]
+
+    def calculate(self, contract):
+        """Return (http_status, payload) for one contract."""
+        product = self.products.get(contract.project_id)
+        if product is None:
+            return status.HTTP_404_NOT_FOUND, {
+                "error": f"No product found for project ID {contract.project_id}. Project must be converted to product first."
+            }
+        actual_paid = self.actual.get(product.pk, 0)
+
+        print_runs = self.print_runs[product.pk]
+        if not print_runs:
+            return status.HTTP_404_NOT_FOUND, {
+                "error": f"No PrintRun found for product ID {product.id}. PrintRun is required to get price."
+            }
+        # Latest edition (ties broken by the most recent publication)
+        print_run = max(print_runs, key=lambda pr: (pr.edition_number, pr.published_at))
+
+        if contract.fixed_amount is None:
+            return status.HTTP_400_BAD_REQUEST, {"error": "Contract fixed_amount (advance payment) is required"}
+        if contract.commission_percent is None or contract.commission_percent == 0:
+            return status.HTTP_400_BAD_REQUEST, {
+                "error": "Contract commission_percent (royalty percentage) is required and must be > 0"
+            }
+        if print_run.price is None or print_run.price == 0:
+            return status.HTTP_400_BAD_REQUEST, {
+                "error": f"PrintRun price is required and must be > 0 for PrintRun ID {print_run.id}"
+            }
+        if not contract.royalties_type:
+            return status.HTTP_400_BAD_REQUEST, {"error": "Contract royalties_type is required"}
+
+        royalties_type_id = contract.royalties_type.id
+        fixed_amount_value = Decimal(str(contract.fixed_amount))
+        commission_percent_value = Decimal(str(contract.commission_percent))
+        commission_as_decimal = commission_percent_value / Decimal('100')
+
+        if royalties_type_id == RETAIL_PRICE:
+            sum_paid_amount = self.paid_amounts[product.pk]
+            if sum_paid_amount < fixed_amount_value:
+                return status.HTTP_200_OK, {
+                    "eligible": False,
+                    "RA": None,
+                    "reason": f"Sum of paid amount ({float(sum_paid_amount)}) is less than advance payment ({float(fixed_amount_value)})",
+                    "details": {
+                        "sum_paid_amount": float(sum_paid_amount),
+                        "fixed_amount": float(fixed_amount_value),
+                        "royalties_type_id": royalties_type_id,
+                        "royalties_type": contract.royalties_type.value
+                    }
+                }
+            Z = sum_paid_amount - fixed_amount_value
+            RA = Z * commission_as_decimal
+            return status.HTTP_200_OK, {
+                "eligible": True,
+                "RA": float(RA.quantize(Decimal('0.01'))),
+                "currency": "$",
+                "details": {
+                    "sum_paid_amount": float(sum_paid_amount),
+                    "fixed_amount": float(fixed_amount_value),
+                    "Z": _number(Z),
+                    "commission_percent": float(contract.commission_percent),
+                    "royalties_type_id": royalties_type_id,
+                    "royalties_type": contract.royalties_type.value
+                }
+            }
+
+        # X = fixed_amount / (commission_percent / price)
+        X = fixed_amount_value * (Decimal(str(print_run.price)) / commission_percent_value)
+        if X > actual_paid:
+            return status.HTTP_200_OK, {
+                "eligible": False,
+                "RA": None,
+                "reason": f"X ({_number(X)}) is greater than actual paid books ({actual_paid})",
+                "details": {
+                    "X": _number(X),
+                    "actual_paid": actual_paid,
+                    "fixed_amount": float(contract.fixed_amount),
+                    "commission_percent": float(contract.commission_percent),
+                    "price": float(print_run.price),
+                    "print_run_id": print_run.id,
+                    "edition_number": print_run.edition_number
+                }
+            }
+
+        # Y = actual - X - free copies of every contract on the project
+        free_copies = self.free_copies.get(contract.project_id) or 0
+        Y = actual_paid - X - free_copies
+        if Y <= 0:
+            return status.HTTP_200_OK, {
+                "eligible": False,
+                "RA": None,
+                "reason": f"Y ({_number(Y)}) is less than or equal to 0 after subtracting X and free copies",
+                "details": {
+                    "X": _number(X),
+                    "actual_paid": actual_paid,
+                    "free_copies": free_copies,
+                    "Y": _number(Y)
+                }
+            }
+
+        if royalties_type_id != LIST_PRICE:
+            return status.HTTP_400_BAD_REQUEST, {
+                "error": f"Invalid royalties_type ID {royalties_type_id}. Expected 52 (list_price) or 53 (retail_price)"
+            }
+
+        sum_price_transactions = sum(
+            (Decimal(str(pr.price)) * count for pr, count in self.sales_by_print_run(product.pk)),
+            Decimal('0'),
+        )
+        RA = Y * sum_price_transactions * commission_as_decimal
+        return status.HTTP_200_OK, {
+            "eligible": True,
+            "RA": float(RA.quantize(Decimal('0.01'))),
+            "currency": "$",
+            "details": {
+                "X": _number(X),
+                "Y": _number(Y),
+                "actual_paid": actual_paid,
+                "free_copies": free_copies,
+                "royalties_type_id": royalties_type_id,
+                "royalties_type": contract.royalties_type.value if contract.royalties_type else None,
+                "commission_percent": float(contract.commission_percent),
+                "sum_price_transactions": float(sum_price_transactions)
+            }
+        }
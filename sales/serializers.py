@@ -55,6 +55,8 @@ class InvoiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
         fields = '__all__'
+        # Stored totals are maintained from the items (Invoice.refresh_totals)
+        read_only_fields = Invoice.TOTALS_FIELDS
     
     def get_composite_id(self, obj):
         """Get composite ID (main_invoice-id or just id)"""
@@ -69,8 +71,8 @@ class InvoiceSerializer(serializers.ModelSerializer):
         elif display_type == 'simple':
             return str(obj.id)
         elif display_type == 'parent_child':
-            if obj.main_invoice:
-                return f"{obj.main_invoice.id}.{obj.id}"
+            if obj.main_invoice_id:
+                return f"{obj.main_invoice_id}.{obj.id}"
             return str(obj.id)
         
         return obj.composite_id
@@ -78,29 +80,46 @@ class InvoiceSerializer(serializers.ModelSerializer):
     def get_invoice_number(self, obj):
         """Use composite_id for invoice number"""
         return obj.composite_id
+
+    def _totals(self, obj):
+        """
+        (total, paid, remaining) for the invoice.
+        List views annotate these via Invoice.objects.with_totals(); single
+        objects fall back to the model properties, computed once per object.
+        """
+        if not hasattr(obj, 'live_total_amount'):
+            obj.live_total_amount = obj.calculated_total_amount
+            obj.live_total_paid = obj.total_paid_amount
+            obj.live_total_remaining = max(obj.live_total_amount - obj.live_total_paid, Decimal('0.00'))
+        return obj.live_total_amount, obj.live_total_paid, obj.live_total_remaining
     
     def get_total_amount(self, obj):
-        return float(obj.total_amount)
+        return float(self._totals(obj)[0])
     
     def get_total_paid_amount(self, obj):
-        return float(obj.total_paid_amount)
+        return float(self._totals(obj)[1])
 
     def get_total_remaining_amount(self, obj):
-        return float(obj.total_remaining_amount)
+        return float(self._totals(obj)[2])
     
     def get_payment_status(self, obj):
-        return float(obj.payment_status)
+        total, paid, _ = self._totals(obj)
+        if total == 0:
+            return 100.0
+        return float((paid / total) * 100)
     
     def get_is_fully_paid(self, obj):
-        return bool(obj.is_fully_paid)
+        total, paid, _ = self._totals(obj)
+        return bool((paid + Decimal('0.001')) >= total)
     
     def get_has_partial_payments(self, obj):
-        return bool(obj.has_partial_payments)
+        _, paid, _ = self._totals(obj)
+        return bool(paid > 0 and not self.get_is_fully_paid(obj))
     
     def get_invoice_type_display(self, obj):
         """Enhanced invoice type display with sub-invoice indicator"""
         base_type = obj.invoice_type.display_name_en if obj.invoice_type else "Unknown"
-        if obj.main_invoice:
+        if obj.main_invoice_id:
             return f"{base_type} (Sub-Invoice)"
         return f"{base_type} (Main Invoice)"
 
@@ -182,23 +201,14 @@ class InvoiceFilter(filters.FilterSet):
         ]
     
     def filter_payment_status(self, queryset, name, value):
-        # Get all invoices and filter in Python to use the model properties
-        all_invoices = queryset.select_related(
-            'customer', 'warehouse', 'invoice_type', 'payment_method'
-        ).prefetch_related('invoiceitem_set')
-        
-        filtered_invoices = []
-        for invoice in all_invoices:
-            if value == 'fully_paid' and invoice.is_fully_paid:
-                filtered_invoices.append(invoice.id)
-            elif value == 'partially_paid' and invoice.has_partial_payments:
-                filtered_invoices.append(invoice.id)
-            elif value == 'unpaid' and invoice.total_paid_amount == 0:
-                filtered_invoices.append(invoice.id)
-            elif value == 'has_partial_payments' and invoice.has_partial_payments:
-                filtered_invoices.append(invoice.id)
-        
-        return queryset.filter(id__in=filtered_invoices)
+        # Uses the stored totals columns kept in sync by Invoice.refresh_totals()
+        if value == 'fully_paid':
+            return queryset.filter(payment_state=Invoice.PaymentState.PAID)
+        elif value in ('partially_paid', 'has_partial_payments'):
+            return queryset.filter(payment_state=Invoice.PaymentState.PARTIAL)
+        elif value == 'unpaid':
+            return queryset.filter(total_paid=0)
+        return queryset
     
     def filter_invoice_type(self, queryset, name, value):
         if value == 'main':
@@ -281,6 +291,19 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
             'item_remaining': float(obj.item_remaining_amount)
         }
 
+def full_payment_amount(invoice, amount, subtotal=None):
+    """
+    The amount to record for a payment: paying exactly the original amount
+    (the item subtotal) gets the invoice's global discount applied.
+    """
+    if subtotal is None:
+        subtotal = invoice.subtotal_amount
+    if amount == subtotal and invoice.global_discount_percent > 0:
+        discount_amount = (subtotal * invoice.global_discount_percent) / Decimal('100')
+        return subtotal - discount_amount
+    return amount
+
+
 class PaymentSerializer(serializers.ModelSerializer):
     payment_type_display = serializers.SerializerMethodField()
     is_partial_payment = serializers.SerializerMethodField()
@@ -295,17 +318,7 @@ class PaymentSerializer(serializers.ModelSerializer):
         ]
     
     def create(self, validated_data):
-        # Apply discount if payment amount equals original amount
-        invoice = validated_data['invoice']
-        payment_amount = validated_data['amount']
-        
-        # If payment amount equals the original amount, apply the discount
-        if payment_amount == invoice.subtotal_amount and invoice.global_discount_percent > 0:
-            # Calculate discounted amount
-            discount_amount = (invoice.subtotal_amount * invoice.global_discount_percent) / Decimal('100')
-            discounted_amount = invoice.subtotal_amount - discount_amount
-            validated_data['amount'] = discounted_amount
-        
+        validated_data['amount'] = full_payment_amount(validated_data['invoice'], validated_data['amount'])
         return super().create(validated_data)
     
     def get_payment_type_display(self, obj):
@@ -323,6 +336,47 @@ class PaymentSerializer(serializers.ModelSerializer):
             'payment_amount': float(obj.amount)
         }
 
+class CheckoutItemSerializer(serializers.Serializer):
+    # A plain id: the checkout checks every product of the sale in one query
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    discount_percent = serializers.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0'))
+    total_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    paid_amount = serializers.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0'),
+                                           min_value=Decimal('0'))
+
+    def validate(self, attrs):
+        if 'total_price' not in attrs:
+            gross = attrs['unit_price'] * attrs['quantity']
+            attrs['total_price'] = (
+                gross - gross * attrs['discount_percent'] / Decimal('100')
+            ).quantize(Decimal('0.01'))
+        return attrs
+
+
+class CheckoutPaymentSerializer(serializers.ModelSerializer):
+    payment_date = serializers.DateField(required=False)
+
+    class Meta:
+        model = Payment
+        fields = ['amount', 'payment_date', 'payment_type', 'reference_number', 'notes']
+
+
+class CheckoutSerializer(InvoiceSerializer):
+    """An invoice with its items and an optional payment, as one POS sale."""
+    warehouse_id = serializers.PrimaryKeyRelatedField(
+        queryset=Warehouse.objects.all(), source='warehouse', write_only=True
+    )
+    items = CheckoutItemSerializer(many=True, allow_empty=False, write_only=True)
+    payment = CheckoutPaymentSerializer(required=False, allow_null=True, write_only=True)
+
+    def validate(self, attrs):
+        if attrs.get('main_invoice'):
+            raise serializers.ValidationError({"main_invoice_id": "Checkout creates main invoices only."})
+        return attrs
+
+
 class ReturnSerializer(serializers.ModelSerializer):
     class Meta:
         model = Return
@@ -412,7 +466,7 @@ class InvoiceSummarySerializer(serializers.ModelSerializer):
             return float(latest_payment.invoice_remaining_amount)
         # Fallback to direct calculation if no payment records exist
         paid = obj.payment_set.aggregate(s=Sum('amount'))['s'] or Decimal('0.00')
-        rem = Decimal(str(obj.total_amount)) - paid
+        rem = Decimal(str(obj.calculated_total_amount)) - paid
         if rem < 0:
             rem = Decimal('0.00')
         return float(rem)
@@ -0,0 +1,273 @@
+from decimal import Decimal
+
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from common.models import Sequence
+from inventory import ledger
+from inventory.models import Author, Product, Project, Reviewer, RightsOwner, StockMovement, Translator
+
+from . import dashboard_cache
+from .models import Customer, Invoice, InvoiceItem, Payment, ProductSalesStats, Return, SalesDailyRollup
+
+
+def _refresh_invoice_totals(invoice_id):
+    if invoice_id:
+        Invoice.objects.filter(pk=invoice_id).refresh_totals()
+
+
+# ======== Stored invoice totals ========
+@receiver(post_save, sender=InvoiceItem)
+@receiver(post_delete, sender=InvoiceItem)
+def invoice_item_changed(sender, instance, **kwargs):
+    _refresh_invoice_totals(instance.invoice_id)
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    _refresh_invoice_totals(instance.invoice_id)
+
+
+@receiver(post_save, sender=Customer)
+def customer_changed(sender, instance, created, **kwargs):
+    # Store customers get a different total_amount formula
+    if not created:
+        Invoice.objects.filter(customer=instance).refresh_totals()
+
+
+# ======== Product sales stats ========
+@receiver(pre_save, sender=InvoiceItem)
+def invoice_item_capture_stats(sender, instance, **kwargs):
+    # Diff against the stored row, not whatever the instance was loaded with
+    instance._sales_stats_before = None
+    if not instance._state.adding and instance.pk:
+        instance._sales_stats_before = (
+            InvoiceItem.objects.filter(pk=instance.pk)
+            .values(
+                'invoice_id', 'invoice__created_at', 'invoice__warehouse_id', 'invoice__main_invoice_id',
+                *ProductSalesStats.ITEM_FIELDS,
+            )
+            .first()
+        )
+    before = instance._sales_stats_before
+    instance._rollup_before = before and _rollup_share(
+        before, SalesDailyRollup.slice_for(before.pop('invoice__created_at'), before['invoice__warehouse_id']),
+    )
+    instance._stock_before = before and _sale_effect(
+        before['product_id'], before.pop('invoice__warehouse_id'), before.pop('invoice__main_invoice_id'),
+        before['quantity'],
+    )
+
+
+@receiver(post_save, sender=InvoiceItem)
+def invoice_item_update_stats(sender, instance, **kwargs):
+    ProductSalesStats.apply_item_change(
+        old=getattr(instance, '_sales_stats_before', None),
+        new=instance.sales_stats_snapshot(),
+    )
+
+
+@receiver(post_delete, sender=InvoiceItem)
+def invoice_item_delete_stats(sender, instance, **kwargs):
+    ProductSalesStats.apply_item_change(old=instance.sales_stats_snapshot())
+
+
+# ======== Daily sales rollup ========
+def _rollup_share(item, slice):
+    """What an item (an instance or a values() row) adds to the rollup, for SalesDailyRollup.item_deltas."""
+    if isinstance(item, InvoiceItem):
+        item = {field: getattr(item, field) for field in ('invoice_id', 'product_id', 'quantity', 'total_price')}
+    return {
+        'invoice_id': item['invoice_id'], 'slice': slice, 'product_id': item['product_id'],
+        'quantity': item['quantity'], 'total_price': item['total_price'],
+    }
+
+
+def _invoice_slice(item):
+    """The rollup slice of the item's invoice, without loading it when it is not cached."""
+    if InvoiceItem.invoice.is_cached(item):
+        return SalesDailyRollup.slice_for(item.invoice.created_at, item.invoice.warehouse_id)
+    row = Invoice.objects.filter(pk=item.invoice_id).values('created_at', 'warehouse_id').first()
+    return row and SalesDailyRollup.slice_for(row['created_at'], row['warehouse_id'])
+
+
+@receiver(post_save, sender=InvoiceItem)
+def invoice_item_update_rollup(sender, instance, **kwargs):
+    SalesDailyRollup.apply_deltas(SalesDailyRollup.item_deltas(
+        old=getattr(instance, '_rollup_before', None),
+        new=_rollup_share(instance, _invoice_slice(instance)),
+        item_id=instance.pk,
+    ))
+
+
+@receiver(post_delete, sender=InvoiceItem)
+def invoice_item_delete_rollup(sender, instance, **kwargs):
+    SalesDailyRollup.apply_deltas(SalesDailyRollup.item_deltas(
+        old=_rollup_share(instance, _invoice_slice(instance)), item_id=instance.pk,
+    ))
+
+
+@receiver(pre_save, sender=Invoice)
+def invoice_capture_slice(sender, instance, **kwargs):
+    instance._rollup_slice_before = None
+    if not instance._state.adding and instance.pk:
+        row = Invoice.objects.filter(pk=instance.pk).values('created_at', 'warehouse_id').first()
+        if row:
+            instance._rollup_slice_before = SalesDailyRollup.slice_for(row['created_at'], row['warehouse_id'])
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_update_rollup(sender, instance, created, **kwargs):
+    current = SalesDailyRollup.slice_for(instance.created_at, instance.warehouse_id)
+    before = getattr(instance, '_rollup_slice_before', None)
+    if created:
+        SalesDailyRollup.apply_deltas({(*current, None): (0, Decimal('0.00'), 1)})
+    elif before and before != current:
+        # The bill and its items move to the new slice
+        invoice = Invoice.objects.filter(pk=instance.pk)
+        SalesDailyRollup.apply_deltas(
+            SalesDailyRollup.invoice_deltas(invoice, sign=-1, slice=before),
+            SalesDailyRollup.invoice_deltas(invoice),
+        )
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_delete_rollup(sender, instance, **kwargs):
+    # Its items were deleted (and taken out of the rollup) first
+    current = SalesDailyRollup.slice_for(instance.created_at, instance.warehouse_id)
+    SalesDailyRollup.apply_deltas({(*current, None): (0, Decimal('0.00'), -1)})
+
+
+@receiver(post_save, sender=Product)
+def product_genre_changed(sender, instance, created, **kwargs):
+    if not created:
+        updated = SalesDailyRollup.objects.filter(product=instance).exclude(
+            genre_id=instance.genre_id
+        ).update(genre_id=instance.genre_id)
+        if updated:
+            dashboard_cache.invalidate()
+
+
+# ======== Stock ledger ========
+def _sale_effect(product_id, warehouse_id, main_invoice_id, quantity):
+    # Child invoices re-bill items of their main invoice, which already left the warehouse
+    if main_invoice_id:
+        return None
+    return (product_id, warehouse_id, -quantity)
+
+
+def _invoice_stock_fields(item):
+    """(warehouse_id, main_invoice_id) of the item's invoice, without loading it when it is not cached."""
+    if InvoiceItem.invoice.is_cached(item):
+        return item.invoice.warehouse_id, item.invoice.main_invoice_id
+    return Invoice.objects.filter(pk=item.invoice_id).values_list('warehouse_id', 'main_invoice_id').first() or (
+        None, None
+    )
+
+
+@receiver(post_save, sender=InvoiceItem)
+def invoice_item_move_stock(sender, instance, **kwargs):
+    after = _sale_effect(instance.product_id, *_invoice_stock_fields(instance), instance.quantity)
+    ledger.record(
+        ledger.change(StockMovement.Kind.SALE, getattr(instance, '_stock_before', None), after,
+                      reference_id=instance.pk, user_id=instance.updated_by_id),
+        user_id=instance.updated_by_id,
+    )
+
+
+@receiver(post_delete, sender=InvoiceItem)
+def invoice_item_restock(sender, instance, **kwargs):
+    # Deleting an invoice deletes its items first, so the invoice is still there to ask
+    before = _sale_effect(instance.product_id, *_invoice_stock_fields(instance), instance.quantity)
+    ledger.record(ledger.change(StockMovement.Kind.SALE, before, None, reference_id=instance.pk))
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_move_stock(sender, instance, created, **kwargs):
+    before = getattr(instance, '_rollup_slice_before', None)
+    if created or not before or before[1] == instance.warehouse_id or instance.main_invoice_id:
+        return
+    # The items of an invoice moved to another warehouse, net of what came back, leave that one instead
+    movements = []
+    items = InvoiceItem.objects.filter(invoice=instance).values_list('pk', 'product_id', 'quantity')
+    for pk, product_id, quantity in items:
+        movements += ledger.change(
+            StockMovement.Kind.SALE, (product_id, before[1], -quantity), (product_id, instance.warehouse_id, -quantity),
+            reference_id=pk, user_id=instance.updated_by_id,
+        )
+    returns = Return.objects.filter(invoice_item__invoice=instance).values_list(
+        'pk', 'invoice_item__product_id', 'returned_quantity',
+    )
+    for pk, product_id, quantity in returns:
+        movements += ledger.change(
+            StockMovement.Kind.RETURN, (product_id, before[1], quantity), (product_id, instance.warehouse_id, quantity),
+            reference_id=pk, user_id=instance.updated_by_id,
+        )
+    ledger.record(movements, user_id=instance.updated_by_id)
+
+
+def _return_effect(return_id=None, invoice_item_id=None, quantity=None):
+    """(product_id, warehouse_id, +quantity) a return puts back into its invoice's warehouse."""
+    if return_id:
+        row = Return.objects.filter(pk=return_id).values_list(
+            'invoice_item__product_id', 'invoice_item__invoice__warehouse_id', 'returned_quantity',
+        ).first()
+    else:
+        row = InvoiceItem.objects.filter(pk=invoice_item_id).values_list(
+            'product_id', 'invoice__warehouse_id',
+        ).first()
+        row = row and (*row, quantity)
+    return row or None
+
+
+@receiver(pre_save, sender=Return)
+def return_capture_stock(sender, instance, **kwargs):
+    instance._stock_before = None
+    if not instance._state.adding and instance.pk:
+        instance._stock_before = _return_effect(return_id=instance.pk)
+
+
+@receiver(post_save, sender=Return)
+def return_restock(sender, instance, **kwargs):
+    after = _return_effect(invoice_item_id=instance.invoice_item_id, quantity=instance.returned_quantity)
+    ledger.record(
+        ledger.change(StockMovement.Kind.RETURN, getattr(instance, '_stock_before', None), after,
+                      reference_id=instance.pk, user_id=instance.updated_by_id),
+        user_id=instance.updated_by_id,
+    )
+
+
+@receiver(post_delete, sender=Return)
+def return_deleted(sender, instance, **kwargs):
+    before = _return_effect(invoice_item_id=instance.invoice_item_id, quantity=instance.returned_quantity)
+    ledger.record(ledger.change(StockMovement.Kind.RETURN, before, None, reference_id=instance.pk))
+
+
+# ======== Invoice ids ========
+@receiver(post_save, sender=Invoice)
+def invoice_loaded(sender, instance, raw, **kwargs):
+    # loaddata writes invoices with their own ids and skips Invoice.save()
+    if raw:
+        Sequence.advance(Invoice.ID_SEQUENCE, instance.pk)
+
+
+# ======== Dashboard cache ========
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=InvoiceItem)
+@receiver(post_delete, sender=InvoiceItem)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Translator)
+@receiver(post_delete, sender=Translator)
+@receiver(post_save, sender=RightsOwner)
+@receiver(post_delete, sender=RightsOwner)
+@receiver(post_save, sender=Reviewer)
+@receiver(post_delete, sender=Reviewer)
+def sales_data_changed(sender, **kwargs):
+    dashboard_cache.invalidate()
@@ -1,3 +1,1095 @@
-from django.test import TestCase
+import json
+import tempfile
+from importlib import import_module
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from common import reference_data
+from common.models import IdempotencyKey, ListItem, ListType
+from inventory import ledger
+from inventory.models import (
+    Author, Contract, Inventory, PrintRun, Product, Project, Reviewer, RightsOwner, StockMovement, Translator,
+    Warehouse,
+)
+from .models import Customer, Invoice, InvoiceItem, Payment, ProductSalesStats, Return, SalesDailyRollup
+from .royalties import LIST_PRICE, RETAIL_PRICE, RoyaltyEngine
+from .serializers import InvoiceSerializer
+from .views import _month_label, _pct_change
+
+User = get_user_model()
+
+
+class SalesTestCase(TestCase):
+    """Shared fixtures for the sales tests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tester', password='secret')
+        customer_types = ListType.objects.create(name_en='Customer Type', name_ar='نوع العميل', code='customer_type')
+        cls.store_type = ListItem.objects.create(
+            list_type=customer_types, value='store', display_name_en='Store', display_name_ar='متجر'
+        )
+        cls.individual_type = ListItem.objects.create(
+            list_type=customer_types, value='individual', display_name_en='Individual', display_name_ar='فرد'
+        )
+        cls.store = Customer.objects.create(institution_name='Book Store', customer_type=cls.store_type)
+        cls.individual = Customer.objects.create(institution_name='Reader', customer_type=cls.individual_type)
+        cls.warehouse = Warehouse.objects.create(name_en='Main', name_ar='الرئيسي', location='Muscat')
+        cls.product = Product.objects.create(isbn='111', title_ar='كتاب', title_en='Book')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_invoice(self, customer=None, **kwargs):
+        return Invoice.objects.create(customer=customer or self.individual, warehouse=self.warehouse, **kwargs)
+
+    def add_item(self, invoice, quantity=1, unit_price='10.00', paid='0.00', product=None):
+        total = Decimal(unit_price) * quantity
+        return InvoiceItem.objects.create(
+            invoice=invoice,
+            product=product or self.product,
+            quantity=quantity,
+            unit_price=Decimal(unit_price),
+            total_price=total,
+            paid_amount=Decimal(paid),
+        )
+
+
+class InvoiceStoredTotalsTests(SalesTestCase):
+    def test_totals_follow_item_changes(self):
+        invoice = self.make_invoice()
+        item = self.add_item(invoice, quantity=2, unit_price='10.00')
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.subtotal, Decimal('20.00'))
+        self.assertEqual(invoice.total_amount, Decimal('20.00'))
+        self.assertEqual(invoice.payment_state, Invoice.PaymentState.UNPAID)
+
+        item.paid_amount = Decimal('5.00')
+        item.save()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_paid, Decimal('5.00'))
+        self.assertEqual(invoice.payment_state, Invoice.PaymentState.PARTIAL)
+
+        item.paid_amount = Decimal('20.00')
+        item.save()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.payment_state, Invoice.PaymentState.PAID)
+
+        item.delete()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.subtotal, Decimal('0.00'))
+        self.assertEqual(invoice.total_paid, Decimal('0.00'))
+
+    def test_discount_and_tax_match_python_properties(self):
+        individual = self.make_invoice(global_discount_percent=Decimal('10'), tax_percent=Decimal('5'))
+        store = self.make_invoice(customer=self.store, global_discount_percent=Decimal('10'))
+        for invoice in (individual, store):
+            self.add_item(invoice, quantity=3, unit_price='7.35', paid='4.00')
+            invoice.refresh_from_db()
+            self.assertEqual(invoice.total_amount, invoice.calculated_total_amount)
+            self.assertEqual(invoice.total_paid, invoice.total_paid_amount)
+
+    def test_halves_round_up_in_python_and_sql(self):
+        # 10.00 plus 1.25% tax is 10.125: banker's rounding gave 10.12, now 10.13
+        invoice = self.make_invoice(tax_percent=Decimal('1.25'))
+        self.add_item(invoice, quantity=1, unit_price='10.00')
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.grand_total.quantize(Decimal('0.01')), Decimal('10.12'))
+        self.assertEqual(invoice.total_amount, Decimal('10.13'))
+        self.assertEqual(invoice.calculated_total_amount, Decimal('10.13'))
+        self.assertEqual(Invoice.objects.with_totals().get(pk=invoice.pk).live_total_amount, Decimal('10.13'))
+        self.assertEqual(InvoiceSerializer(invoice).data['total_amount'], 10.13)
+
+    def test_totals_off_the_half_are_unchanged(self):
+        # 10.115 and 10.135 are halves banker's rounding already took up; 10.124 and 10.126 are no halves
+        for tax, total in (('1.15', '10.12'), ('1.35', '10.14'), ('1.24', '10.12'), ('1.26', '10.13')):
+            invoice = self.make_invoice(tax_percent=Decimal(tax))
+            self.add_item(invoice, quantity=1, unit_price='10.00')
+            invoice.refresh_from_db()
+            with self.subTest(tax=tax):
+                self.assertEqual(invoice.calculated_total_amount, Decimal(total))
+                self.assertEqual(invoice.total_amount, Decimal(total))
+
+    def test_stale_instance_save_does_not_clobber_totals(self):
+        invoice = self.make_invoice()
+        stale = Invoice.objects.get(pk=invoice.pk)
+        self.add_item(invoice, quantity=1, unit_price='12.00')
+        stale.notes = 'edited'
+        stale.save()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_amount, Decimal('12.00'))
+        self.assertEqual(invoice.notes, 'edited')
+
+    def test_payment_status_filter_is_sql_side(self):
+        paid = self.make_invoice()
+        self.add_item(paid, unit_price='10.00', paid='10.00')
+        partial = self.make_invoice()
+        self.add_item(partial, unit_price='10.00', paid='3.00')
+        unpaid = self.make_invoice()
+        self.add_item(unpaid, unit_price='10.00')
+
+        expected = {'fully_paid': paid, 'partially_paid': partial, 'unpaid': unpaid}
+        for value, invoice in expected.items():
+            response = self.client.get('/api/sales/invoices/', {'payment_status': value})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([row['id'] for row in response.data['results']], [invoice.id], value)
+
+    def test_sync_command_reports_and_repairs_drift(self):
+        invoice = self.make_invoice()
+        self.add_item(invoice, unit_price='10.00')
+        Invoice.objects.filter(pk=invoice.pk).update(total_amount=Decimal('0.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('sync_invoice_totals', '--check', stdout=StringIO())
+
+        call_command('sync_invoice_totals', stdout=StringIO())
+        call_command('sync_invoice_totals', '--check', stdout=StringIO())
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_amount, Decimal('10.00'))
+
+    def test_stored_totals_are_read_only_in_the_api(self):
+        invoice = self.make_invoice()
+        self.add_item(invoice, unit_price='10.00')
+        response = self.client.patch(f'/api/sales/invoices/{invoice.pk}/', {
+            'subtotal': '999.00', 'total_paid': '999.00', 'payment_state': 'paid', 'notes': 'edited',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        invoice.refresh_from_db()
+        self.assertEqual(
+            (invoice.subtotal, invoice.total_paid, invoice.payment_state, invoice.notes),
+            (Decimal('10.00'), Decimal('0.00'), Invoice.PaymentState.UNPAID, 'edited'),
+        )
+
+    def test_migration_backfills_the_default_totals(self):
+        backfill = import_module('sales.migrations.0008_backfill_invoice_totals')
+        individual = self.make_invoice(global_discount_percent=Decimal('10'), tax_percent=Decimal('5'))
+        self.add_item(individual, quantity=3, unit_price='7.35', paid='4.00')
+        store = self.make_invoice(customer=self.store, global_discount_percent=Decimal('10'))
+        self.add_item(store, quantity=2, unit_price='10.00')
+        self.make_invoice()
+        expected = list(Invoice.objects.order_by('pk').values(*Invoice.TOTALS_FIELDS))
+        # As 0005 left them
+        Invoice.objects.update(
+            subtotal=Decimal('0.00'), total_amount=Decimal('0.00'), total_paid=Decimal('0.00'),
+            payment_state=Invoice.PaymentState.PAID,
+        )
+
+        backfill.fill_invoice_totals(django_apps, None)
+        self.assertEqual(list(Invoice.objects.order_by('pk').values(*Invoice.TOTALS_FIELDS)), expected)
+
+    def test_payment_write_refreshes_totals(self):
+        invoice = self.make_invoice()
+        self.add_item(invoice, unit_price='10.00')
+        InvoiceItem.objects.filter(invoice=invoice).update(paid_amount=Decimal('10.00'))
+        Payment.objects.create(invoice=invoice, amount=Decimal('10.00'), payment_date=date.today())
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.payment_state, Invoice.PaymentState.PAID)
+
+
+class InvoiceAnnotatedTotalsTests(SalesTestCase):
+    def make_mixed_invoices(self):
+        specs = [
+            (self.individual, '0', '0', '0.00'),
+            (self.individual, '10', '5', '4.00'),
+            (self.individual, '12.5', '0', '100.00'),
+            (self.store, '10', '0', '9.99'),
+            (self.store, '0', '0', '22.05'),
+            (self.store, '15', '0', '0.00'),
+        ]
+        invoices = []
+        for customer, discount, tax, paid in specs:
+            invoice = self.make_invoice(
+                customer=customer, global_discount_percent=Decimal(discount), tax_percent=Decimal(tax)
+            )
+            self.add_item(invoice, quantity=3, unit_price='7.35', paid=paid)
+            self.add_item(invoice, quantity=1, unit_price='0.00')
+            invoices.append(invoice)
+        # An invoice without items counts as fully paid
+        invoices.append(self.make_invoice())
+        return invoices
+
+    def test_annotations_match_python_properties(self):
+        self.make_mixed_invoices()
+        for invoice in Invoice.objects.with_totals():
+            self.assertEqual(invoice.live_subtotal, invoice.subtotal_amount)
+            self.assertEqual(invoice.live_total_paid, invoice.total_paid_amount)
+            self.assertEqual(invoice.live_total_amount, invoice.calculated_total_amount)
+
+    def test_partial_and_outstanding_endpoints_match_properties(self):
+        invoices = self.make_mixed_invoices()
+        expected_partial = {i.id for i in invoices if i.has_partial_payments}
+        expected_outstanding = {i.id for i in invoices if not i.is_fully_paid}
+        self.assertTrue(expected_partial)
+        self.assertNotEqual(expected_partial, expected_outstanding)
+
+        partial = self.client.get('/api/sales/invoices/partial-payments/')
+        outstanding = self.client.get('/api/sales/invoices/outstanding-payments/')
+        self.assertEqual({row['id'] for row in partial.data['results']}, expected_partial)
+        self.assertEqual({row['id'] for row in outstanding.data['results']}, expected_outstanding)
+        self.assertIn('total_remaining_amount', partial.data['results'][0])
+
+
+class InvoiceListQueryCountTests(SalesTestCase):
+    LIST_URLS = [
+        '/api/sales/invoices/',
+        '/api/sales/invoices/main/',
+        '/api/sales/invoices/partial-payments/',
+        '/api/sales/invoices/outstanding-payments/',
+    ]
+
+    def add_invoices(self, count):
+        for _ in range(count):
+            invoice = self.make_invoice(customer=self.store)
+            self.add_item(invoice, quantity=2, unit_price='10.00', paid='5.00')
+            self.add_item(invoice, quantity=1, unit_price='4.00')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_list_endpoints_use_constant_queries(self):
+        self.add_invoices(2)
+        small = {url: self.count_queries(url)[0] for url in self.LIST_URLS}
+        self.add_invoices(10)
+        for url in self.LIST_URLS:
+            queries, response = self.count_queries(url)
+            self.assertEqual(len(response.data['results']), 12, url)
+            self.assertEqual(queries, small[url], url)
+            self.assertLessEqual(queries, 2, url)
+
+    def test_cursor_pages_follow_the_list_order(self):
+        self.add_invoices(5)
+        expected = [row['id'] for row in self.client.get('/api/sales/invoices/').data['results']]
+        response = self.client.get('/api/sales/invoices/', {'cursor': '', 'page_size': 3})
+        first = [row['id'] for row in response.data['results']]
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data['next'])
+        self.assertEqual(first + [row['id'] for row in response.data['results']], expected)
+        self.assertIsNone(response.data['next'])
+
+    def test_annotated_values_match_single_object_fallback(self):
+        self.add_invoices(1)
+        listed = self.client.get('/api/sales/invoices/').data['results'][0]
+        single = self.client.get(f"/api/sales/invoices/{listed['id']}/payment-status/").data
+        for key in ('total_amount', 'total_paid_amount', 'total_remaining_amount',
+                    'payment_status', 'is_fully_paid', 'has_partial_payments'):
+            self.assertEqual(listed[key], single[key], key)
+
+
+class ProductSalesStatsTests(SalesTestCase):
+    def stats(self, product=None):
+        return ProductSalesStats.objects.get(product=product or self.product)
+
+    def test_item_writes_apply_deltas(self):
+        invoice = self.make_invoice()
+        item = self.add_item(invoice, quantity=9, unit_price='7.00')
+        self.assertEqual((self.stats().sold, self.stats().actual), (9, 0))
+
+        # 21.00 of 63.00 paid is exactly 3 of 9 books
+        item.paid_amount = Decimal('21.00')
+        item.save()
+        self.assertEqual((self.stats().sold, self.stats().actual), (9, 3))
+
+        other = Product.objects.create(isbn='222', title_ar='كتاب آخر', title_en='Other')
+        item.product = other
+        item.quantity = 4
+        item.save()
+        self.assertEqual((self.stats().sold, self.stats().actual), (0, 0))
+        self.assertEqual((self.stats(other).sold, self.stats(other).actual), (4, 1))
+
+        self.add_item(invoice, quantity=2, unit_price='0.00', product=other)
+        self.assertEqual((self.stats(other).sold, self.stats(other).actual), (6, 3))
+
+        invoice.delete()
+        self.assertEqual((self.stats(other).sold, self.stats(other).actual), (0, 0))
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+
+    def test_stale_instance_updates_diff_against_stored_row(self):
+        item = self.add_item(self.make_invoice(), quantity=5, unit_price='2.00')
+        stale = InvoiceItem.objects.get(pk=item.pk)
+        item.quantity = 8
+        item.save()
+        stale.paid_amount = Decimal('10.00')
+        stale.save()
+        self.assertEqual((self.stats().sold, self.stats().actual), (5, 5))
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+
+    def test_sql_rebuild_matches_python_floor(self):
+        invoice = self.make_invoice()
+        for quantity, unit_price, paid in [(9, '7.00', '21.00'), (3, '3.33', '6.65'), (7, '1.10', '0.00'),
+                                           (2, '0.00', '0.00'), (4, '5.00', '25.00')]:
+            self.add_item(invoice, quantity=quantity, unit_price=unit_price, paid=paid)
+        expected = sum(
+            ProductSalesStats.paid_quantity(i.quantity, i.total_price, i.paid_amount, i.is_paid)
+            for i in InvoiceItem.objects.all()
+        )
+        ProductSalesStats.objects.all().delete()
+        ProductSalesStats.recalculate_all()
+        self.assertEqual(self.stats().actual, expected)
+        self.assertEqual(self.stats().sold, 25)
+
+    def test_rebuild_divides_exactly(self):
+        # 3.30 of 9.90 is exactly 1 of 3 books; as floats it is 0.999...
+        self.add_item(self.make_invoice(), quantity=3, unit_price='3.30', paid='3.30')
+        self.assertEqual(self.stats().actual, 1)
+        ProductSalesStats.rebuild()
+        self.assertEqual(self.stats().actual, 1)
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+
+    def test_migration_rebuilds_stale_stats(self):
+        migration = import_module('sales.migrations.0009_rebuild_product_sales_stats')
+        invoice = self.make_invoice()
+        self.add_item(invoice, quantity=3, unit_price='3.30', paid='3.30')
+        other = Product.objects.create(isbn='222', title_ar='كتاب آخر', title_en='Other')
+        self.add_item(invoice, quantity=2, unit_price='5.00', paid='10.00', product=other)
+        orphan = Product.objects.create(isbn='333', title_ar='كتاب', title_en='Orphan')
+        # As hand-run recalculations left them
+        ProductSalesStats.objects.filter(product=self.product).update(sold=10, actual=4)
+        ProductSalesStats.objects.filter(product=other).delete()
+        ProductSalesStats.objects.create(product=orphan, sold=5, actual=5)
+
+        migration.rebuild_product_sales_stats(django_apps, None)
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+        self.assertEqual((self.stats().sold, self.stats().actual), (3, 1))
+        self.assertEqual((self.stats(other).sold, self.stats(other).actual), (2, 2))
+        self.assertEqual((self.stats(orphan).sold, self.stats(orphan).actual), (0, 0))
+
+    def test_sync_command_reports_and_repairs_drift(self):
+        self.add_item(self.make_invoice(), quantity=3, unit_price='5.00', paid='15.00')
+        InvoiceItem.objects.update(paid_amount=Decimal('0.00'), is_paid=False)
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('sync_product_sales_stats', '--check', stdout=out)
+        self.assertIn(f'product {self.product.id}', out.getvalue())
+
+        call_command('sync_product_sales_stats', stdout=StringIO())
+        call_command('sync_product_sales_stats', '--check', stdout=StringIO())
+        self.assertEqual((self.stats().sold, self.stats().actual), (3, 0))
+
+    def test_recalculate_all_endpoint_uses_constant_queries(self):
+        invoice = self.make_invoice()
+        products = [self.product] + [
+            Product.objects.create(isbn=f'9{n}', title_ar='كتاب', title_en=f'Book {n}') for n in range(5)
+        ]
+        for n, product in enumerate(products):
+            self.add_item(invoice, quantity=n + 1, unit_price='2.00', paid='2.00', product=product)
+        ProductSalesStats.objects.update(sold=0, actual=0)
+        orphan = Product.objects.create(isbn='999', title_ar='كتاب', title_en='Orphan')
+        ProductSalesStats.objects.create(product=orphan, sold=7, actual=7)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/sales/product-sales-stats/recalculate-all/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated_count'], len(products))
+        self.assertEqual(response.data['reset_count'], 1)
+        self.assertIn('duration_ms', response.data)
+        self.assertLessEqual(len(ctx.captured_queries), 5)
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+
+    def test_chunked_rebuild_matches_single_pass(self):
+        invoice = self.make_invoice()
+        for n in range(5):
+            product = Product.objects.create(isbn=f'8{n}', title_ar='كتاب', title_en=f'Book {n}')
+            self.add_item(invoice, quantity=3, unit_price='3.00', paid='4.00', product=product)
+        ProductSalesStats.objects.all().delete()
+
+        report = ProductSalesStats.rebuild(chunk_size=2)
+        self.assertEqual(report['products'], 5)
+        self.assertEqual(report['chunks'], 3)
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+        self.assertEqual(set(ProductSalesStats.objects.values_list('actual', flat=True)), {1})
+
+
+class SalesDailyRollupTests(SalesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        genres = ListType.objects.create(name_en='Genre', name_ar='النوع', code='genre')
+        cls.novel = ListItem.objects.create(list_type=genres, value='novel', display_name_en='Novel', display_name_ar='رواية')
+        cls.poetry = ListItem.objects.create(list_type=genres, value='poetry', display_name_en='Poetry', display_name_ar='شعر')
+        cls.other_warehouse = Warehouse.objects.create(name_en='Branch', name_ar='الفرع', location='Sohar')
+        Product.objects.filter(pk=cls.product.pk).update(genre=cls.novel)
+        cls.product.refresh_from_db()
+        cls.poem = Product.objects.create(isbn='333', title_ar='ديوان', title_en='Poems', genre=cls.poetry)
+
+    def make_sales(self):
+        today = timezone.localdate()
+        specs = [
+            (0, self.warehouse, [(self.product, 2, '10.00'), (self.poem, 1, '4.50')]),
+            (0, self.other_warehouse, [(self.product, 1, '10.00')]),
+            (3, self.warehouse, [(self.poem, 5, '4.50'), (self.poem, 1, '4.50')]),
+            (40, self.warehouse, [(self.product, 3, '9.00')]),
+            (75, self.other_warehouse, [(self.poem, 2, '4.00')]),
+            (10, self.warehouse, []),
+        ]
+        for days_ago, warehouse, items in specs:
+            invoice = Invoice.objects.create(customer=self.individual, warehouse=warehouse)
+            Invoice.objects.filter(pk=invoice.pk).update(
+                created_at=timezone.now() - timedelta(days=days_ago)
+            )
+            for product, quantity, unit_price in items:
+                self.add_item(invoice, quantity=quantity, unit_price=unit_price, product=product)
+        # Backdating with update() bypasses the signals
+        SalesDailyRollup.rebuild()
+        return today
+
+    def live_sales(self, warehouse_id=None, start=None, end=None):
+        """The dashboard figures computed straight from invoices and items."""
+        items = InvoiceItem.objects.filter(product__isnull=False)
+        invoices = Invoice.objects.all()
+        if warehouse_id:
+            items = items.filter(invoice__warehouse_id=warehouse_id)
+            invoices = invoices.filter(warehouse_id=warehouse_id)
+        if start:
+            items = items.filter(invoice__created_at__date__gte=start, invoice__created_at__date__lte=end)
+            invoices = invoices.filter(created_at__date__gte=start, created_at__date__lte=end)
+        genres = (
+            items.filter(product__genre__isnull=False)
+            .values('product__genre__display_name_en')
+            .annotate(sales=Sum('quantity'))
+            .order_by('-sales')
+        )
+        return {
+            'total_bills': invoices.count(),
+            'total_revenue': float(items.aggregate(t=Sum('total_price'))['t'] or 0),
+            'books_sold': items.aggregate(t=Sum('quantity'))['t'] or 0,
+            'genres': {row['product__genre__display_name_en']: row['sales'] for row in genres},
+            'months': {
+                (row['month'].year, row['month'].month): row['sales']
+                for row in items.annotate(month=TruncMonth('invoice__created_at'))
+                .values('month').annotate(sales=Sum('quantity')).order_by()
+            },
+        }
+
+    def test_migration_fills_the_empty_rollup(self):
+        migration = import_module('sales.migrations.0010_fill_sales_daily_rollup')
+        self.make_sales()
+        # As 0006 left it
+        SalesDailyRollup.objects.all().delete()
+
+        migration.fill_sales_daily_rollup(django_apps, None)
+        self.assertTrue(SalesDailyRollup.objects.exists())
+        self.assertEqual(SalesDailyRollup.find_drift(), [])
+
+    def test_dashboard_matches_live_computation(self):
+        today = self.make_sales()
+        cases = [
+            {},
+            {'warehouse_id': self.warehouse.id},
+            {'start_date': today - timedelta(days=5), 'end_date': today},
+            {'start_date': today - timedelta(days=90), 'end_date': today, 'warehouse_id': self.other_warehouse.id},
+        ]
+        for params in cases:
+            response = self.client.get('/api/sales/dashboard/', params)
+            self.assertEqual(response.status_code, 200, params)
+            live = self.live_sales(params.get('warehouse_id'), params.get('start_date'), params.get('end_date'))
+            sales = response.data['sales']
+            self.assertEqual(sales['total_bills'], live['total_bills'], params)
+            self.assertAlmostEqual(sales['total_revenue'], live['total_revenue'], places=2, msg=params)
+            self.assertEqual(sales['books_sold'], live['books_sold'], params)
+            self.assertEqual(
+                {row['category']: row['sales'] for row in response.data['sales_by_genre']}, live['genres'], params
+            )
+            for point in response.data['sales_trend']:
+                matching = [sales for (y, m), sales in live['months'].items() if _month_label(y, m) == point['month']]
+                self.assertEqual(point['sales'], sum(matching), (params, point))
+
+        previous = self.client.get('/api/sales/dashboard/', {
+            'start_date': today - timedelta(days=2), 'end_date': today,
+        }).data['sales']
+        # 3 days vs the 3 days before: 2 bills / 4 books now, 1 bill / 6 books before
+        self.assertEqual(previous['bills_change_percent'], _pct_change(2, 1))
+        self.assertEqual(previous['books_sold_change_percent'], _pct_change(4, 6))
+
+    def test_incremental_maintenance_tracks_writes(self):
+        invoice = self.make_invoice()
+        item = self.add_item(invoice, quantity=2, unit_price='5.00')
+        other = self.add_item(self.make_invoice(), quantity=1, unit_price='5.00', product=self.poem)
+        self.assertEqual(SalesDailyRollup.find_drift(), [])
+
+        item.quantity = 7
+        item.save()
+        other.invoice = invoice
+        other.save()
+        invoice.warehouse = self.other_warehouse
+        invoice.save()
+        self.assertEqual(SalesDailyRollup.find_drift(), [])
+
+        poem = Product.objects.get(pk=self.poem.pk)
+        poem.genre = self.novel
+        poem.save()
+        self.assertFalse(SalesDailyRollup.objects.filter(genre=self.poetry).exists())
+
+        item.delete()
+        invoice.delete()
+        self.assertEqual(SalesDailyRollup.find_drift(), [])
+        self.assertEqual(SalesDailyRollup.objects.in_range().totals()['bills'], 1)
+
+    def test_item_writes_only_touch_their_own_rows(self):
+        invoice = self.make_invoice()
+        self.add_item(invoice, quantity=1, product=self.poem)
+        for _ in range(5):
+            self.add_item(self.make_invoice(), quantity=1, product=self.poem)
+        poem_rows = SalesDailyRollup.objects.filter(product=self.poem).values_list('pk', 'quantity', 'bills')
+        untouched = list(poem_rows)
+
+        with CaptureQueriesContext(connection) as ctx:
+            first = self.add_item(invoice, quantity=2, unit_price='5.00')
+            second = self.add_item(invoice, quantity=1, unit_price='5.00')
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('DELETE')])
+        row = SalesDailyRollup.objects.get(product=self.product)
+        self.assertEqual((row.quantity, row.revenue, row.bills, row.genre_id), (3, Decimal('15.00'), 1, self.novel.pk))
+        self.assertEqual(list(poem_rows), untouched)
+
+        # The bill count follows the first and last item of the product on the invoice
+        first.delete()
+        self.assertEqual(SalesDailyRollup.objects.get(product=self.product).bills, 1)
+        second.product = self.poem
+        second.save()
+        self.assertFalse(SalesDailyRollup.objects.filter(product=self.product).exists())
+        self.assertEqual(SalesDailyRollup.find_drift(), [])
+
+    def test_sync_command_reports_and_repairs_drift(self):
+        self.add_item(self.make_invoice(), quantity=2)
+        SalesDailyRollup.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('sync_sales_rollup', '--check', stdout=StringIO())
+        call_command('sync_sales_rollup', stdout=StringIO())
+        call_command('sync_sales_rollup', '--check', stdout=StringIO())
+
+
+class DashboardCacheTests(SalesTestCase):
+    URLS = [
+        ('/api/sales/dashboard/', {}),
+        ('/api/sales/warehouse-dashboard/', {'start_date': '2020-01-01', 'end_date': '2100-01-01'}),
+    ]
+
+    def urls(self):
+        for url, params in self.URLS:
+            if 'warehouse' in url:
+                params = {**params, 'warehouse_id': self.warehouse.id}
+            yield url, params
+
+    def check_cache_cycle(self):
+        invoice = self.make_invoice()
+        self.add_item(invoice, quantity=2)
+        for url, params in self.urls():
+            first = self.client.get(url, params)
+            self.assertEqual(first.status_code, 200, url)
+            etag = first['ETag']
+
+            with self.assertNumQueries(0):
+                cached = self.client.get(url, params)
+            self.assertEqual(cached.data, first.data)
+            self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(url, {**params, 'start_date': '2020-01-01', 'end_date': '2100-01-02'})
+            self.assertTrue(ctx.captured_queries, 'other date range must not hit the cached entry')
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.add_item(invoice, quantity=3)
+            fresh = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(fresh.status_code, 200, url)
+            self.assertNotEqual(fresh['ETag'], etag)
+
+    def test_locmem_cache(self):
+        self.check_cache_cycle()
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+            with override_settings(CACHES={'default': backend}):
+                self.check_cache_cycle()
+
+    def test_people_writes_refresh_the_overview(self):
+        for model in (Author, Translator, RightsOwner, Reviewer):
+            with self.subTest(model=model.__name__):
+                self.client.get('/api/sales/dashboard/')
+                with self.captureOnCommitCallbacks(execute=True):
+                    person = model.objects.create(name='Person')
+                people = self.client.get('/api/sales/dashboard/').data['people']
+                self.assertEqual(list(people.values()).count(1), 1)
+                with self.captureOnCommitCallbacks(execute=True):
+                    person.delete()
+                self.assertEqual(set(self.client.get('/api/sales/dashboard/').data['people'].values()), {0})
+
+    def test_errors_are_not_cached(self):
+        response = self.client.get('/api/sales/warehouse-dashboard/')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('ETag', response)
+
+
+class WarehouseDashboardTests(SalesTestCase):
+    def test_single_pass_figures(self):
+        genres = ListType.objects.create(name_en='Genre', name_ar='النوع', code='genre')
+        novel = ListItem.objects.create(list_type=genres, value='novel', display_name_en='Novel', display_name_ar='رواية')
+        Product.objects.filter(pk=self.product.pk).update(genre=novel)
+        other = Product.objects.create(isbn='444', title_ar='آخر', title_en='Other')
+
+        first = self.make_invoice()
+        self.add_item(first, quantity=3, unit_price='10.00', paid='30.00')
+        self.add_item(first, quantity=1, unit_price='5.00', paid='2.00', product=other)
+        second = self.make_invoice()
+        discounted = self.add_item(second, quantity=2, unit_price='10.00')
+        InvoiceItem.objects.filter(pk=discounted.pk).update(discount_percent=Decimal('10'), total_price=Decimal('18.00'))
+        InvoiceItem.objects.create(invoice=second, product=None, quantity=4, unit_price=Decimal('1.00'),
+                                   total_price=Decimal('4.00'), paid_amount=Decimal('4.00'))
+        yesterday = self.make_invoice()
+        self.add_item(yesterday, quantity=1, unit_price='10.00')
+        Invoice.objects.filter(pk=yesterday.pk).update(created_at=timezone.now() - timedelta(days=1))
+        self.make_invoice()  # no items, still a bill
+
+        today = timezone.localdate()
+        params = {
+            'warehouse_id': self.warehouse.id,
+            'start_date': (today - timedelta(days=1)).isoformat(),
+            'end_date': today.isoformat(),
+        }
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/sales/warehouse-dashboard/', params)
+        data = response.data
+
+        self.assertEqual(data['total_income'], Decimal('67.00'))
+        self.assertEqual(data['total_income_without_discount'], Decimal('69.00'))
+        self.assertEqual(data['total_books_sold'], 11)
+        self.assertEqual(data['total_bills'], 4)
+        self.assertEqual(data['bills_with_discount'], 1)
+        self.assertEqual(Decimal(data['average_discount']), Decimal('10'))
+        self.assertEqual(data['popular_books'][0], {'product__title_ar': 'كتاب', 'total': 6})
+        self.assertEqual(
+            {row['product__genre__display_name_en']: row['total'] for row in data['top_categories']},
+            {'Novel': 6, None: 5},
+        )
+        self.assertEqual(
+            [(row['date'], row['sales'], row['revenue']) for row in data['daily_sales']],
+            [(today - timedelta(days=1), 1, Decimal('10.00')), (today, 10, Decimal('57.00'))],
+        )
+        self.assertEqual(
+            [(row['product__id'], row['quantity'], row['total_paid']) for row in data['paid_books']],
+            [(self.product.id, 3, Decimal('30.00')), (other.id, 1, Decimal('2.00'))],
+        )
+
+
+class RoyaltyEngineTests(SalesTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        royalties = ListType.objects.create(name_en='Royalties', name_ar='الحقوق', code='royalties_type')
+        cls.list_price = ListItem.objects.create(
+            id=LIST_PRICE, list_type=royalties, value='list_price', display_name_en='List', display_name_ar='قائمة'
+        )
+        cls.retail_price = ListItem.objects.create(
+            id=RETAIL_PRICE, list_type=royalties, value='retail_price', display_name_en='Retail', display_name_ar='تجزئة'
+        )
+        statuses = ListType.objects.create(name_en='Contract Status', name_ar='حالة العقد', code='contract_status')
+        cls.closed = ListItem.objects.create(
+            list_type=statuses, value='closed', display_name_en='Closed', display_name_ar='مغلق'
+        )
+        cls.author = Author.objects.create(name='Author')
+
+    def make_title(self, n, royalties_type, fixed='10.00', commission='10.00', free_copies=0):
+        project = Project.objects.create(title_ar=f'مشروع {n}')
+        product = Product.objects.create(isbn=f'r{n}', title_ar=f'كتاب {n}', title_en=f'Book {n}', project=project)
+        today = timezone.localdate()
+        PrintRun.objects.create(product=product, edition_number=1, price=Decimal('2.00'), price_omr=Decimal('1.00'),
+                                published_at=today - timedelta(days=30))
+        PrintRun.objects.create(product=product, edition_number=2, price=Decimal('3.00'), price_omr=Decimal('1.00'),
+                                published_at=today - timedelta(days=10))
+        contract = Contract.objects.create(
+            project=project, content_type=ContentType.objects.get_for_model(Author), object_id=self.author.id,
+            royalties_type=royalties_type, fixed_amount=Decimal(fixed), commission_percent=Decimal(commission),
+            free_copies=free_copies,
+        )
+        invoice = self.make_invoice()
+        for days_ago in (40, 20, 15, 5, 0):
+            item = self.add_item(invoice, quantity=10, unit_price='3.00', paid='30.00', product=product)
+            InvoiceItem.objects.filter(pk=item.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        Payment.objects.create(invoice=invoice, amount=Decimal('150.00'), payment_date=date.today())
+        return contract, product
+
+    def test_items_are_assigned_to_print_run_windows(self):
+        contract, product = self.make_title(1, self.list_price)
+        engine = RoyaltyEngine([contract])
+        counts = [(pr.edition_number, count) for pr, count in engine.sales_by_print_run(product.id)]
+        # 40 days ago predates the first print run
+        self.assertEqual(counts, [(1, 2), (2, 2)])
+
+    def test_batch_matches_single_contract_endpoint(self):
+        contracts = [
+            self.make_title(1, self.list_price)[0],
+            self.make_title(2, self.list_price, free_copies=48)[0],
+            self.make_title(3, self.retail_price, fixed='50.00')[0],
+            self.make_title(4, self.retail_price, fixed='500.00')[0],
+            self.make_title(5, self.list_price, fixed='1000.00')[0],
+        ]
+        response = self.client.post('/api/sales/calculate-royalties/batch/', {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], len(contracts))
+        for row in response.data['results']:
+            single = self.client.post('/api/sales/calculate-royalties/', {'contract_id': row['contract_id']}, format='json')
+            self.assertEqual(row['status'], single.status_code)
+            expected = dict(single.data)
+            self.assertEqual({k: v for k, v in row.items() if k in expected}, expected)
+        self.assertEqual(response.data['eligible_count'], 2)
+
+        # 50 books paid; latest edition price 3.00 -> X = 10 * 3 / 10 = 3, Y = 47
+        first = response.data['results'][0]
+        self.assertEqual((first['details']['X'], first['details']['Y']), (3, 47))
+        self.assertEqual(first['details']['sum_price_transactions'], 2 * 2.0 + 2 * 3.0)
+        # Retail counts each invoice's latest payment once, however many items it has
+        self.assertEqual(response.data['results'][2]['details']['sum_paid_amount'], 150.0)
+
+    def test_batch_uses_constant_queries_and_skips_closed(self):
+        self.make_title(1, self.list_price)
+        self.make_title(2, self.retail_price)
+        reference_data.get_registry()  # loaded once per process, not per request
+        with CaptureQueriesContext(connection) as small:
+            self.client.post('/api/sales/calculate-royalties/batch/', {}, format='json')
+        for n in range(3, 9):
+            self.make_title(n, self.list_price if n % 2 else self.retail_price)
+        closed, _ = self.make_title(9, self.list_price)
+        Contract.objects.filter(pk=closed.pk).update(status=self.closed)
+
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post('/api/sales/calculate-royalties/batch/', {}, format='json')
+        self.assertEqual(response.data['count'], 8)
+        self.assertNotIn(closed.id, [row['contract_id'] for row in response.data['results']])
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+
+class InvoiceItemPrintRunTests(SalesTestCase):
+    def test_items_are_tagged_with_print_run_in_effect(self):
+        today = timezone.localdate()
+        first = PrintRun.objects.create(product=self.product, edition_number=1, price=Decimal('2.00'),
+                                        price_omr=Decimal('1.00'), published_at=today - timedelta(days=30))
+        PrintRun.objects.create(product=self.product, edition_number=2, price=Decimal('3.00'),
+                                price_omr=Decimal('1.00'), published_at=today - timedelta(days=10))
+        reprint = PrintRun.objects.create(product=self.product, edition_number=3, price=Decimal('3.00'),
+                                          price_omr=Decimal('1.00'), published_at=today - timedelta(days=10))
+        expected = {}
+        for days_ago, print_run in [(40, None), (30, first), (11, first), (10, reprint), (0, reprint)]:
+            invoice = self.make_invoice()
+            Invoice.objects.filter(pk=invoice.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+            item = self.add_item(invoice, quantity=2)
+            expected[item.pk] = print_run.pk if print_run else None
+
+        with self.assertNumQueries(1):
+            tagged = dict(InvoiceItem.objects.with_print_run().values_list('pk', 'print_run_id'))
+        self.assertEqual(tagged, expected)
+
+        rows = list(InvoiceItem.objects.sales_by_print_run())
+        self.assertEqual(
+            {row['print_run_id']: row['quantity'] for row in rows},
+            {None: 2, first.pk: 4, reprint.pk: 4},
+        )
+
+
+class SalesStockLedgerTests(SalesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = Warehouse.objects.create(name_en='Shop', name_ar='المتجر', location='Sohar')
+        ledger.record([StockMovement(product=self.product, warehouse=self.warehouse, quantity=20,
+                                     kind=StockMovement.Kind.RECEIPT)])
+
+    def stock(self):
+        return dict(Inventory.objects.filter(product=self.product).values_list('warehouse_id', 'quantity'))
+
+    def test_sales_and_returns_move_stock(self):
+        invoice = self.make_invoice()
+        item = self.add_item(invoice, quantity=5)
+        self.assertEqual(self.stock(), {self.warehouse.pk: 15})
+
+        item.quantity = 7
+        item.save()
+        returned = Return.objects.create(invoice_item=item, returned_quantity=2, return_date=date.today())
+        self.assertEqual(self.stock(), {self.warehouse.pk: 15})
+
+        invoice.warehouse = self.shop
+        invoice.save()
+        self.assertEqual(self.stock(), {self.warehouse.pk: 20, self.shop.pk: -5})
+
+        returned.delete()
+        self.assertEqual(self.stock(), {self.warehouse.pk: 20, self.shop.pk: -7})
+        invoice.delete()
+        self.assertEqual(self.stock(), {self.warehouse.pk: 20, self.shop.pk: 0})
+        self.assertEqual(
+            set(StockMovement.objects.values_list('kind', flat=True)), {'receipt', 'sale', 'return'},
+        )
+        self.assertEqual(ledger.find_drift(), {})
+
+    def test_child_invoices_do_not_sell_again(self):
+        invoice = self.make_invoice()
+        self.add_item(invoice, quantity=4, paid='40.00')
+        invoice.generate_child_invoice()
+        self.assertEqual(self.stock(), {self.warehouse.pk: 16})
+
+
+class CheckoutTests(SalesTestCase):
+    URL = '/api/sales/checkout/'
+
+    def setUp(self):
+        super().setUp()
+        self.products = [self.product] + [
+            Product.objects.create(isbn=f'9{n}', title_ar=f'كتاب {n}', title_en=f'Book {n}') for n in range(4)
+        ]
+        ledger.record([
+            StockMovement(product=product, warehouse=self.warehouse, quantity=10, kind=StockMovement.Kind.RECEIPT)
+            for product in self.products
+        ])
+
+    def sale(self, items, **extra):
+        return {'customer_id': self.individual.pk, 'warehouse_id': self.warehouse.pk, 'items': items, **extra}
+
+    def line(self, product, quantity, unit_price='5.00'):
+        return {'product_id': product.pk, 'quantity': quantity, 'unit_price': unit_price}
+
+    def stock(self, product):
+        return Inventory.objects.get(product=product, warehouse=self.warehouse).quantity
+
+    def test_checkout_writes_the_whole_sale(self):
+        response = self.client.post(self.URL, self.sale(
+            [self.line(self.products[0], 3), {**self.line(self.products[1], 2), 'paid_amount': '10.00'}],
+            payment={'amount': '25.00'},
+        ), format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        invoice = Invoice.objects.get()
+        self.assertEqual(response.data['id'], invoice.pk)
+        self.assertEqual([item['total_price'] for item in response.data['items']], ['15.00', '10.00'])
+        self.assertEqual(response.data['payment']['amount'], '25.00')
+        self.assertEqual((invoice.subtotal, invoice.total_paid), (Decimal('25.00'), Decimal('10.00')))
+        self.assertEqual((self.stock(self.products[0]), self.stock(self.products[1])), (7, 8))
+        self.assertEqual(ledger.find_drift(), {})
+        self.assertEqual(ProductSalesStats.objects.get(product=self.products[1]).actual, 2)
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+        self.assertEqual(SalesDailyRollup.find_drift(), [])
+
+    def test_oversold_checkout_writes_nothing(self):
+        response = self.client.post(self.URL, self.sale([
+            self.line(self.products[0], 6),
+            self.line(self.products[0], 5),
+            {'product_id': 999999, 'quantity': 1, 'unit_price': '1.00'},
+        ]), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_id', response.data['items'][2])
+
+        response = self.client.post(self.URL, self.sale([
+            self.line(self.products[0], 6),
+            self.line(self.products[0], 5),
+        ]), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['items'][0], {})
+        self.assertIn('Available: 4, Requested: 5', str(response.data['items'][1]['quantity']))
+        self.assertFalse(Invoice.objects.exists())
+        self.assertEqual(self.stock(self.products[0]), 10)
+
+    def test_query_count_does_not_grow_with_the_items(self):
+        def run(products):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(self.URL, self.sale(
+                    [self.line(product, 1) for product in products], payment={'amount': '5.00'},
+                ), format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            return len(ctx.captured_queries)
+
+        run(self.products)  # every product has its stats row from here on
+        self.assertEqual(run(self.products[:1]), run(self.products))
+
+
+class IdempotencyKeyTests(SalesTestCase):
+    def post(self, url, data, key):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retries_replay_the_stored_response(self):
+        data = {'customer_id': self.individual.pk, 'warehouse_id': self.warehouse.pk}
+        first = self.post('/api/sales/invoices/', data, 'till-1-0001')
+        self.assertEqual(first.status_code, 201)
+
+        retry = self.post('/api/sales/invoices/', data, 'till-1-0001')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Invoice.objects.count(), 1)
+
+        invoice = Invoice.objects.get()
+        payment = {'invoice': invoice.pk, 'amount': '5.00', 'payment_date': date.today().isoformat()}
+        self.assertEqual(self.post('/api/sales/payments/', payment, 'till-1-0002').status_code, 201)
+        self.assertEqual(self.post('/api/sales/payments/', payment, 'till-1-0002').status_code, 201)
+        self.assertEqual(Payment.objects.count(), 1)
+
+        # Without a key every POST creates
+        self.client.post('/api/sales/invoices/', data, format='json')
+        self.assertEqual(Invoice.objects.count(), 2)
+
+    def test_a_key_belongs_to_one_request(self):
+        data = {'customer_id': self.individual.pk, 'warehouse_id': self.warehouse.pk}
+        self.post('/api/sales/invoices/', data, 'till-1-0003')
+        response = self.post('/api/sales/invoices/', {**data, 'notes': 'other'}, 'till-1-0003')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Invoice.objects.count(), 1)
+
+        # Another user's key is their own
+        other = User.objects.create_user(username='other', password='secret')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.post('/api/sales/invoices/', data, 'till-1-0003').status_code, 201)
+        self.assertEqual(Invoice.objects.count(), 2)
+
+    def test_expired_keys_run_again_and_are_purged(self):
+        data = {'customer_id': self.individual.pk, 'warehouse_id': self.warehouse.pk}
+        self.post('/api/sales/invoices/', data, 'till-1-0004')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(self.post('/api/sales/invoices/', data, 'till-1-0004').status_code, 201)
+        self.assertEqual(Invoice.objects.count(), 2)
+
+
+class InvoiceCompositeIdTests(SalesTestCase):
+    def invoice_writes(self, ctx):
+        return [
+            query['sql'].split()[0] for query in ctx.captured_queries
+            if query['sql'].startswith(('INSERT INTO "sales_invoice"', 'UPDATE "sales_invoice"'))
+        ]
+
+    def test_invoices_are_written_once(self):
+        main = self.make_invoice()
+        with CaptureQueriesContext(connection) as ctx:
+            child = Invoice.objects.create(customer=self.individual, warehouse=self.warehouse,
+                                           main_invoice_id=main.pk)
+        self.assertEqual(self.invoice_writes(ctx), ['INSERT'])
+        self.assertEqual(main.composite_id, str(main.pk))
+        self.assertEqual(child.composite_id, f"{main.pk}_{child.pk}")
+        self.assertEqual(Invoice.objects.get(pk=child.pk).composite_id, child.composite_id)
+
+    def test_bulk_create_assigns_ids_up_front(self):
+        main = self.make_invoice()
+        invoices = Invoice.objects.bulk_create([
+            Invoice(customer=self.store, warehouse=self.warehouse),
+            Invoice(customer=self.store, warehouse=self.warehouse, main_invoice=main),
+        ])
+        self.assertEqual([invoice.pk for invoice in invoices], [main.pk + 1, main.pk + 2])
+        self.assertEqual(
+            list(Invoice.objects.filter(pk__gt=main.pk).order_by('pk').values_list('composite_id', flat=True)),
+            [str(main.pk + 1), f"{main.pk}_{main.pk + 2}"],
+        )
+        self.assertEqual(self.make_invoice().pk, main.pk + 3)
+
+    def test_invoices_with_their_own_ids_move_the_counter(self):
+        main = self.make_invoice()
+        own = Invoice.objects.create(id=main.pk + 10, customer=self.individual, warehouse=self.warehouse)
+        self.assertEqual(own.composite_id, str(main.pk + 10))
+        self.assertEqual(self.make_invoice().pk, main.pk + 11)
+
+        Invoice.objects.bulk_create([Invoice(id=main.pk + 20, customer=self.store, warehouse=self.warehouse)])
+        self.assertEqual(self.make_invoice().pk, main.pk + 21)
+
+        # loaddata saves raw, without Invoice.save()
+        fixture = json.loads(serializers.serialize('json', [own]))
+        fixture[0]['pk'] = fixture[0]['fields']['composite_id'] = str(main.pk + 30)
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as file:
+            json.dump(fixture, file)
+            file.flush()
+            call_command('loaddata', file.name, verbosity=0)
+        self.assertEqual(self.make_invoice().pk, main.pk + 31)
+
+        # Ids below the counter leave it alone
+        Invoice.objects.create(id=main.pk + 5, customer=self.individual, warehouse=self.warehouse)
+        self.assertEqual(self.make_invoice().pk, main.pk + 32)
+
+
+class InvoiceBulkActionTests(SalesTestCase):
+    def make_invoices(self, count):
+        invoices = []
+        for n in range(count):
+            invoice = self.make_invoice()
+            self.add_item(invoice, quantity=2, paid='20.00')
+            self.add_item(invoice, quantity=1, paid='4.00')
+            Payment.objects.create(invoice=invoice, amount=Decimal('24.000'), payment_date=date(2024, 1, 1))
+            invoices.append(invoice)
+        return invoices
+
+    def count_queries(self, action, count):
+        invoices = self.make_invoices(count)
+        with CaptureQueriesContext(connection) as ctx:
+            action(Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices]))
+        return len(ctx.captured_queries)
+
+    def test_child_invoices_copy_paid_items_in_bulk(self):
+        parents = self.make_invoices(2)
+        children = Invoice.objects.filter(pk__in=[parent.pk for parent in parents]).generate_child_invoices()
+
+        self.assertEqual([child.main_invoice_id for child in children], [parent.pk for parent in parents])
+        for parent, child in zip(parents, children):
+            self.assertEqual(child.composite_id, f"{parent.pk}_{child.pk}")
+            self.assertEqual(child.notes, f"Generated from Invoice #{parent.pk}")
+            self.assertEqual(child.subtotal, Decimal('20.00'))
+            item = child.invoiceitem_set.get()
+            self.assertEqual((item.quantity, item.is_paid, item.item_remaining_amount), (2, True, Decimal('0')))
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+        self.assertEqual(SalesDailyRollup.find_drift(), [])
+
+        child = parents[0].generate_child_invoice(paid_items_only=False)
+        self.assertEqual(child.invoiceitem_set.count(), 2)
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+
+    def test_recalculate_payment_status_repairs_items_and_stats(self):
+        invoice = self.make_invoices(1)[0]
+        paid, unpaid = invoice.invoiceitem_set.order_by('pk')
+        InvoiceItem.objects.filter(pk=paid.pk).update(is_paid=False, remaining_amount=Decimal('5'))
+        InvoiceItem.objects.filter(pk=unpaid.pk).update(paid_amount=Decimal('10.00'))
+        Payment.objects.filter(invoice=invoice).update(notes='stale')
+        ProductSalesStats.calculate_for_product(self.product)
+
+        Invoice.objects.filter(pk=invoice.pk).recalculate_payment_status()
+
+        self.assertEqual(
+            list(invoice.invoiceitem_set.order_by('pk').values_list('is_paid', 'remaining_amount')),
+            [(True, Decimal('0')), (True, Decimal('0'))],
+        )
+        self.assertEqual(ProductSalesStats.find_drift(), [])
+        self.assertEqual(
+            Payment.objects.get(invoice=invoice).notes, "Payment of 24.000 OMR received on 2024-01-01",
+        )
+
+    def test_actions_use_constant_queries(self):
+        for action in (
+            lambda queryset: queryset.recalculate_payment_status(),
+            lambda queryset: queryset.generate_child_invoices(),
+        ):
+            self.assertEqual(self.count_queries(action, 1), self.count_queries(action, 4))
+
+    def test_admin_actions_cover_the_selection(self):
+        admin_user = User.objects.create_superuser(username='admin', password='secret')
+        self.client.force_login(admin_user)
+        parents = self.make_invoices(3)
+        response = self.client.post('/admin/sales/invoice/', {
+            'action': 'generate_child_invoice', '_selected_action': [parent.pk for parent in parents],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            sorted(Invoice.objects.filter(main_invoice__isnull=False).values_list('main_invoice_id', flat=True)),
+            [parent.pk for parent in parents],
+        )
@@ -12,6 +12,7 @@ urlpatterns = [
     path("invoices/", views.InvoiceListCreateView.as_view(), name="invoice-list-create"),
     path("invoices/<int:pk>/", views.InvoiceUpdateView.as_view(), name="invoice-update"),
     path("invoices/<int:pk>/delete/", views.InvoiceDeleteView.as_view(), name="invoice-delete"),
+    path("checkout/", views.CheckoutView.as_view(), name="checkout"),
 
     # Invoice Items
     path("invoice-items/", views.InvoiceItemListCreateView.as_view(), name="invoice-item-list-create"),
@@ -58,5 +59,6 @@ urlpatterns = [
     
     # Royalties Calculation
     path("calculate-royalties/", views.CalculateRoyaltiesView.as_view(), name="calculate-royalties"),
+    path("calculate-royalties/batch/", views.BatchCalculateRoyaltiesView.as_view(), name="calculate-royalties-batch"),
 
 ]
\ No newline at end of file
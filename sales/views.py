@@ -9,13 +9,20 @@ from rest_framework.views import APIView
 from django.db.models import Sum, Count, Avg, F, Q
 from django.db.models.functions import TruncMonth
 from inventory.models import Product, Author, Translator, RightsOwner, Reviewer, Project
+from inventory.pagination import KeysetOrPageNumberPagination
+from collections import defaultdict
 from datetime import datetime, timedelta
 from django.utils import timezone
 from decimal import Decimal
 
-from .models import Customer, Invoice, InvoiceItem, Payment, Return, ProductSalesStats
+from common.idempotency import IdempotentCreateMixin, idempotent
+
+from . import dashboard_cache
+from .checkout import Checkout
+from .royalties import RoyaltyEngine, active_contracts
+from .models import Customer, Invoice, InvoiceItem, Payment, Return, ProductSalesStats, SalesDailyRollup
 from .serializers import (
-    CustomerSerializer, InvoiceFilter, InvoiceSerializer, InvoiceItemSerializer, InvoiceSummarySerializer,
+    CheckoutSerializer, CustomerSerializer, InvoiceFilter, InvoiceSerializer, InvoiceItemSerializer, InvoiceSummarySerializer,
     PaymentSerializer, ReturnSerializer, ProductSalesStatsSerializer
 )
 
@@ -58,10 +65,14 @@ class CustomerDeleteView(BaseDeleteView):
 
 
 
-class InvoiceListCreateView(generics.ListCreateAPIView):
-    queryset = Invoice.objects.all().order_by('-created_at', 'id')
+INVOICE_LIST_RELATED = ('customer', 'warehouse', 'invoice_type', 'payment_method')
+
+
+class InvoiceListCreateView(IdempotentCreateMixin, generics.ListCreateAPIView):
+    queryset = Invoice.objects.with_totals().select_related(*INVOICE_LIST_RELATED).order_by('-created_at', 'id')
     serializer_class = InvoiceSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetOrPageNumberPagination
     filter_backends = [DjangoFilterBackend, drf_filters.SearchFilter]
     filterset_class = InvoiceFilter
     search_fields = ['id', 'customer__institution_name', 'customer__contact_person']
@@ -85,8 +96,8 @@ class MainInvoiceListView(generics.ListAPIView):
     search_fields = ['composite_id', 'customer__institution_name', 'customer__contact_person']
     
     def get_queryset(self):
-        return Invoice.objects.filter(main_invoice__isnull=True).select_related(
-            'customer', 'warehouse', 'invoice_type', 'payment_method'
+        return Invoice.objects.filter(main_invoice__isnull=True).with_totals().select_related(
+            *INVOICE_LIST_RELATED
         ).order_by('-created_at', 'id')
     
     def get_serializer_context(self):
@@ -104,8 +115,8 @@ class SubInvoiceListView(generics.ListAPIView):
     search_fields = ['composite_id', 'customer__institution_name', 'customer__contact_person']
     
     def get_queryset(self):
-        return Invoice.objects.filter(main_invoice__isnull=False).select_related(
-            'main_invoice', 'customer', 'warehouse', 'invoice_type', 'payment_method'
+        return Invoice.objects.filter(main_invoice__isnull=False).with_totals().select_related(
+            *INVOICE_LIST_RELATED
         ).order_by('-created_at', 'id')
     
     def get_serializer_context(self):
@@ -126,11 +137,44 @@ class InvoiceDeleteView(BaseDeleteView):
     queryset = Invoice.objects.all().order_by('id')
     serializer_class = InvoiceSerializer
 
+class CheckoutView(APIView):
+    """
+    Create a POS sale in one request (see sales.checkout).
+    POST /api/sales/checkout/
+    { "customer_id": 1, "warehouse_id": 2, ...invoice fields,
+      "items": [{ "product_id": 3, "quantity": 2, "unit_price": "4.50" }, ...],
+      "payment": { "amount": "9.00", "payment_type": 5 } }
+    Returns the invoice with its items and payment; 400 and nothing written
+    when any item is invalid or not in stock.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        invoice, items, payment = Checkout(serializer.validated_data, request.user).run()
+
+        # The payment's totals read the items and customer type of the invoice
+        invoice = (
+            Invoice.objects.with_totals()
+            .select_related(*INVOICE_LIST_RELATED, 'customer__customer_type')
+            .prefetch_related('invoiceitem_set')
+            .get(pk=invoice.pk)
+        )
+        data = InvoiceSerializer(invoice, context={'display_type': 'composite'}).data
+        data['items'] = InvoiceItemSerializer(items, many=True).data
+        if payment:
+            payment.invoice = invoice
+        data['payment'] = PaymentSerializer(payment).data if payment else None
+        return Response(data, status=status.HTTP_201_CREATED)
+
 # ======== Invoice Items ========
 class InvoiceItemListCreateView(generics.ListCreateAPIView):
     queryset = InvoiceItem.objects.all().order_by('-created_at', 'id')
     serializer_class = InvoiceItemSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetOrPageNumberPagination
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user, updated_by=self.request.user)
@@ -148,10 +192,11 @@ class InvoiceItemDeleteView(BaseDeleteView):
     serializer_class = InvoiceItemSerializer
 
 # ======== Payments ========
-class PaymentListCreateView(generics.ListCreateAPIView):
+class PaymentListCreateView(IdempotentCreateMixin, generics.ListCreateAPIView):
     queryset = Payment.objects.all().order_by('-payment_date', 'id')
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetOrPageNumberPagination
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user, updated_by=self.request.user)
@@ -300,22 +345,6 @@ def _parse_dashboard_filters(request):
     }, None
 
 
-def _apply_sales_filters(item_qs, invoice_qs, filters):
-    if filters["warehouse_id"]:
-        item_qs = item_qs.filter(invoice__warehouse_id=filters["warehouse_id"])
-        invoice_qs = invoice_qs.filter(warehouse_id=filters["warehouse_id"])
-    if filters["has_date_range"]:
-        item_qs = item_qs.filter(
-            invoice__created_at__gte=filters["start_dt"],
-            invoice__created_at__lte=filters["end_dt"],
-        )
-        invoice_qs = invoice_qs.filter(
-            created_at__gte=filters["start_dt"],
-            created_at__lte=filters["end_dt"],
-        )
-    return item_qs, invoice_qs
-
-
 class DashboardOverviewView(APIView):
     """
     Aggregated metrics for the main dashboard (projects, people, sales, chart series).
@@ -324,6 +353,9 @@ class DashboardOverviewView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
+        return dashboard_cache.cached_response(request, 'overview', lambda: self.build_response(request))
+
+    def build_response(self, request):
         filters, error_response = _parse_dashboard_filters(request)
         if error_response:
             return error_response
@@ -345,54 +377,30 @@ class DashboardOverviewView(APIView):
             "reviewers": Reviewer.objects.count(),
         }
 
-        base_item_qs = InvoiceItem.objects.filter(product__isnull=False)
-        base_invoice_qs = Invoice.objects.all()
-        item_qs, invoice_qs = _apply_sales_filters(base_item_qs, base_invoice_qs, filters)
+        # Sales figures come from the pre-aggregated daily rollup
+        rollup_qs = SalesDailyRollup.objects.all()
+        if filters["warehouse_id"]:
+            rollup_qs = rollup_qs.filter(warehouse_id=filters["warehouse_id"])
 
-        total_bills = invoice_qs.count()
-        total_revenue = item_qs.aggregate(total=Sum("total_price"))["total"] or Decimal("0")
-        books_sold = item_qs.aggregate(total=Sum("quantity"))["total"] or 0
+        start_date = filters["start_dt"].date() if filters["has_date_range"] else None
+        end_date = filters["end_dt"].date() if filters["has_date_range"] else None
+        current = rollup_qs.in_range(start_date, end_date).totals()
+        total_bills = current["bills"]
+        total_revenue = current["revenue"]
+        books_sold = current["books"]
 
         now = timezone.now()
         if filters["has_date_range"]:
-            period_revenue = total_revenue
-            period_days = (filters["end_dt"].date() - filters["start_dt"].date()).days + 1
-            previous_end = filters["start_dt"] - timedelta(seconds=1)
-            previous_start = timezone.make_aware(
-                datetime.combine(
-                    (filters["start_dt"].date() - timedelta(days=period_days)),
-                    datetime.min.time(),
-                )
-            )
-
-            previous_period_items = base_item_qs
-            if filters["warehouse_id"]:
-                previous_period_items = previous_period_items.filter(
-                    invoice__warehouse_id=filters["warehouse_id"]
-                )
-            previous_period_items = previous_period_items.filter(
-                invoice__created_at__gte=previous_start,
-                invoice__created_at__lte=previous_end,
-            )
-
-            previous_invoice_qs = base_invoice_qs
-            if filters["warehouse_id"]:
-                previous_invoice_qs = previous_invoice_qs.filter(warehouse_id=filters["warehouse_id"])
-            previous_invoice_qs = previous_invoice_qs.filter(
-                created_at__gte=previous_start,
-                created_at__lte=previous_end,
-            )
+            period_days = (end_date - start_date).days + 1
+            previous = rollup_qs.in_range(
+                start_date - timedelta(days=period_days), start_date - timedelta(days=1)
+            ).totals()
 
             current_month_bills = total_bills
-            previous_month_bills = previous_invoice_qs.count()
             current_month_books = books_sold
-            previous_month_books = previous_period_items.aggregate(total=Sum("quantity"))["total"] or 0
-            previous_month_revenue = (
-                previous_period_items.aggregate(total=Sum("total_price"))["total"] or Decimal("0")
-            )
-            monthly_revenue = period_revenue
+            monthly_revenue = total_revenue
 
-            month_keys = _months_between(filters["start_dt"].date(), filters["end_dt"].date())
+            month_keys = _months_between(start_date, end_date)
             if not month_keys:
                 month_keys = _last_n_months(1)
         else:
@@ -406,62 +414,37 @@ class DashboardOverviewView(APIView):
                     month=current_month_start.month - 1
                 )
 
-            scoped_item_qs = base_item_qs
-            scoped_invoice_qs = base_invoice_qs
-            if filters["warehouse_id"]:
-                scoped_item_qs = scoped_item_qs.filter(invoice__warehouse_id=filters["warehouse_id"])
-                scoped_invoice_qs = scoped_invoice_qs.filter(warehouse_id=filters["warehouse_id"])
+            this_month = rollup_qs.in_range(current_month_start.date()).totals()
+            previous = rollup_qs.in_range(
+                previous_month_start.date(), current_month_start.date() - timedelta(days=1)
+            ).totals()
 
-            current_month_items = scoped_item_qs.filter(invoice__created_at__gte=current_month_start)
-            previous_month_items = scoped_item_qs.filter(
-                invoice__created_at__gte=previous_month_start,
-                invoice__created_at__lt=current_month_start,
-            )
-
-            monthly_revenue = (
-                current_month_items.aggregate(total=Sum("total_price"))["total"] or Decimal("0")
-            )
-            current_month_bills = scoped_invoice_qs.filter(
-                created_at__gte=current_month_start
-            ).count()
-            previous_month_bills = scoped_invoice_qs.filter(
-                created_at__gte=previous_month_start,
-                created_at__lt=current_month_start,
-            ).count()
-            current_month_books = (
-                current_month_items.aggregate(total=Sum("quantity"))["total"] or 0
-            )
-            previous_month_books = (
-                previous_month_items.aggregate(total=Sum("quantity"))["total"] or 0
-            )
-            previous_month_revenue = (
-                previous_month_items.aggregate(total=Sum("total_price"))["total"] or Decimal("0")
-            )
+            current_month_bills = this_month["bills"]
+            current_month_books = this_month["books"]
+            monthly_revenue = this_month["revenue"]
 
             month_keys = _last_n_months(4)
 
+        previous_month_bills = previous["bills"]
+        previous_month_books = previous["books"]
+        previous_month_revenue = previous["revenue"]
+
         month_starts = {
             (y, m): timezone.make_aware(datetime(y, m, 1))
             for y, m in month_keys
         }
 
-        trend_item_qs = base_item_qs
-        if filters["warehouse_id"]:
-            trend_item_qs = trend_item_qs.filter(invoice__warehouse_id=filters["warehouse_id"])
-        if filters["has_date_range"]:
-            trend_item_qs = trend_item_qs.filter(
-                invoice__created_at__gte=filters["start_dt"],
-                invoice__created_at__lte=filters["end_dt"],
-            )
+        trend_rollup_qs = rollup_qs.filter(product__isnull=False).in_range(start_date, end_date)
 
         sales_by_month: dict[tuple[int, int], dict] = {
             key: {"sales": 0, "revenue": Decimal("0")} for key in month_keys
         }
         sales_rows = (
-            trend_item_qs.filter(invoice__created_at__gte=month_starts[month_keys[0]])
-            .annotate(month=TruncMonth("invoice__created_at"))
+            trend_rollup_qs.filter(date__gte=month_starts[month_keys[0]].date())
+            .annotate(month=TruncMonth("date"))
             .values("month")
-            .annotate(sales=Sum("quantity"), revenue=Sum("total_price"))
+            .annotate(sales=Sum("quantity"), revenue=Sum("revenue"))
+            .order_by()
         )
         for row in sales_rows:
             month_dt = row["month"]
@@ -510,15 +493,14 @@ class DashboardOverviewView(APIView):
             for y, m in month_keys
         ]
 
-        genre_item_qs = trend_item_qs
         sales_by_genre = [
             {
-                "category": row["product__genre__display_name_en"] or "Unknown",
+                "category": row["genre__display_name_en"] or "Unknown",
                 "sales": int(row["sales"] or 0),
             }
             for row in (
-                genre_item_qs.filter(product__genre__isnull=False)
-                .values("product__genre__display_name_en")
+                trend_rollup_qs.filter(genre__isnull=False)
+                .values("genre__display_name_en")
                 .annotate(sales=Sum("quantity"))
                 .order_by("-sales")[:10]
             )
@@ -564,12 +546,13 @@ class WarehouseDashboardView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        return dashboard_cache.cached_response(request, 'warehouse', lambda: self.build_response(request))
+
+    def build_response(self, request):
         warehouse_id = request.query_params.get('warehouse_id')
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date')
 
-        print("Received params:", warehouse_id, start_date, end_date)
-
         if not warehouse_id or not start_date or not end_date:
             return Response(
                 {"detail": "warehouse_id, start_date, and end_date are required."},
@@ -591,8 +574,7 @@ class WarehouseDashboardView(APIView):
             end_date_dt = timezone.make_aware(
                 datetime.combine(end_date_obj, datetime.max.time())
             )
-        except ValueError as e:
-            print("Date parsing error:", e)
+        except ValueError:
             return Response(
                 {"detail": "start_date and end_date must be in YYYY-MM-DD format."},
                 status=status.HTTP_400_BAD_REQUEST
@@ -604,80 +586,82 @@ class WarehouseDashboardView(APIView):
             created_at__lte=end_date_dt
         )
 
-        total_income = InvoiceItem.objects.filter(
-            invoice__in=invoices
-        ).aggregate(total=Sum('total_price'))['total'] or 0
-
-        # Calculate total income without discount
-        total_income_without_discount = InvoiceItem.objects.filter(
-            invoice__in=invoices
-        ).aggregate(
-            total=Sum(F('unit_price') * F('quantity'))
-        )['total'] or 0
-
-        total_books = InvoiceItem.objects.filter(
-            invoice__in=invoices
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-
-        bills_with_discount = invoices.filter(
-            invoiceitem__discount_percent__gt=0
-        ).distinct().count()
-        total_bills = invoices.count()
-        avg_discount = InvoiceItem.objects.filter(
-            invoice__in=invoices,
-            discount_percent__gt=0
-        ).aggregate(avg=Avg('discount_percent'))['avg'] or 0
-
-        popular_books = (
-            InvoiceItem.objects.filter(invoice__in=invoices)
-            .values('product__title_ar')
-            .annotate(total=Sum('quantity'))
-            .order_by('-total')[:4]
+        # Scalar figures: one pass over invoices LEFT JOIN items
+        discounted = Q(invoiceitem__discount_percent__gt=0)
+        totals = invoices.aggregate(
+            total_income=Sum('invoiceitem__total_price'),
+            total_income_without_discount=Sum(
+                F('invoiceitem__unit_price') * F('invoiceitem__quantity')
+            ),
+            total_books=Sum('invoiceitem__quantity'),
+            bills_with_discount=Count('id', filter=discounted, distinct=True),
+            total_bills=Count('id', distinct=True),
+            average_discount=Avg('invoiceitem__discount_percent', filter=discounted),
         )
 
-        # If you have a category field on Product, adjust accordingly
-        top_categories = (
+        # Breakdowns: one grouped pass, reshaped per product, genre and day
+        rows = (
             InvoiceItem.objects.filter(invoice__in=invoices)
-            .values('product__genre__display_name_en')
-            .annotate(total=Sum('quantity'))
-            .order_by('-total')[:4]
-        )
-
-        daily_sales = (
-            InvoiceItem.objects.filter(invoice__in=invoices)
-            .values(date=F('invoice__created_at__date'))
+            .values(
+                'product_id', 'product__title_ar', 'product__genre__display_name_en',
+                date=F('invoice__created_at__date'),
+            )
             .annotate(
-                sales=Sum('quantity'),
-                revenue=Sum('total_price')
+                books=Sum('quantity'),
+                revenue=Sum('total_price'),
+                paid_quantity=Sum('quantity', filter=Q(paid_amount__gt=0)),
+                total_paid=Sum('paid_amount', filter=Q(paid_amount__gt=0)),
             )
-            .order_by('date')
+            .order_by()
         )
 
-        paid_books = (
-            InvoiceItem.objects.filter(
-                invoice__in=invoices,
-                paid_amount__gt=0,
-                product__isnull=False,
-            )
-            .values('product__id', 'product__title_ar')
-            .annotate(
-                quantity=Sum('quantity'),
-                total_paid=Sum('paid_amount'),
-            )
-            .order_by('-total_paid', 'product__title_ar')
+        by_title = defaultdict(int)
+        by_genre = defaultdict(int)
+        by_day = {}
+        paid_by_product = {}
+        for row in rows:
+            by_title[row['product__title_ar']] += row['books']
+            by_genre[row['product__genre__display_name_en']] += row['books']
+
+            day = by_day.setdefault(row['date'], {'date': row['date'], 'sales': 0, 'revenue': 0})
+            day['sales'] += row['books']
+            day['revenue'] += row['revenue']
+
+            if row['product_id'] is not None and row['total_paid'] is not None:
+                paid = paid_by_product.setdefault(row['product_id'], {
+                    'product__id': row['product_id'],
+                    'product__title_ar': row['product__title_ar'],
+                    'quantity': 0,
+                    'total_paid': 0,
+                })
+                paid['quantity'] += row['paid_quantity']
+                paid['total_paid'] += row['total_paid']
+
+        popular_books = [
+            {'product__title_ar': title, 'total': total}
+            for title, total in sorted(by_title.items(), key=lambda kv: -kv[1])[:4]
+        ]
+        top_categories = [
+            {'product__genre__display_name_en': genre, 'total': total}
+            for genre, total in sorted(by_genre.items(), key=lambda kv: -kv[1])[:4]
+        ]
+        daily_sales = [by_day[day] for day in sorted(by_day)]
+        paid_books = sorted(
+            paid_by_product.values(),
+            key=lambda row: (-row['total_paid'], row['product__title_ar'] or ''),
         )
 
         return Response({
-            "total_income": total_income,
-            "total_income_without_discount": total_income_without_discount,
-            "total_books_sold": total_books,
-            "bills_with_discount": bills_with_discount,
-            "total_bills": total_bills,
-            "average_discount": avg_discount,
-            "popular_books": list(popular_books),
-            "top_categories": list(top_categories),
-            "daily_sales": list(daily_sales),
-            "paid_books": list(paid_books),
+            "total_income": totals['total_income'] or 0,
+            "total_income_without_discount": totals['total_income_without_discount'] or 0,
+            "total_books_sold": totals['total_books'] or 0,
+            "bills_with_discount": totals['bills_with_discount'],
+            "total_bills": totals['total_bills'],
+            "average_discount": totals['average_discount'] or 0,
+            "popular_books": popular_books,
+            "top_categories": top_categories,
+            "daily_sales": daily_sales,
+            "paid_books": paid_books,
         })
 
 class InvoiceChildrenView(generics.ListAPIView):
@@ -687,8 +671,8 @@ class InvoiceChildrenView(generics.ListAPIView):
     
     def get_queryset(self):
         main_invoice_id = self.kwargs.get('main_invoice_id')
-        return Invoice.objects.filter(main_invoice_id=main_invoice_id).select_related(
-            'customer', 'warehouse', 'invoice_type', 'payment_method'
+        return Invoice.objects.filter(main_invoice_id=main_invoice_id).with_totals().select_related(
+            *INVOICE_LIST_RELATED
         ).order_by('-created_at', 'id')
     
     def get_serializer_context(self):
@@ -717,21 +701,10 @@ class PartialPaymentInvoiceListView(generics.ListAPIView):
     search_fields = ['composite_id', 'customer__institution_name', 'customer__contact_person']
     
     def get_queryset(self):
-        # Get all invoices and filter in Python to use the model properties
-        all_invoices = Invoice.objects.select_related(
-            'customer', 'warehouse', 'invoice_type', 'payment_method'
-        ).prefetch_related('invoiceitem_set').order_by('-created_at', 'id')
-        
-        # Filter invoices that have partial payments
-        partial_payment_invoices = []
-        for invoice in all_invoices:
-            if invoice.has_partial_payments:
-                partial_payment_invoices.append(invoice.id)
-        
-        # Return filtered queryset
-        return Invoice.objects.filter(id__in=partial_payment_invoices).select_related(
-            'customer', 'warehouse', 'invoice_type', 'payment_method'
-        ).prefetch_related('invoiceitem_set').order_by('-created_at', 'id')
+        # Totals are aggregated in SQL, so filtering happens before pagination
+        return Invoice.objects.partially_paid().select_related(
+            *INVOICE_LIST_RELATED
+        ).order_by('-created_at', 'id')
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -748,21 +721,10 @@ class OutstandingPaymentInvoiceListView(generics.ListAPIView):
     search_fields = ['composite_id', 'customer__institution_name', 'customer__contact_person']
     
     def get_queryset(self):
-        # Get all invoices and filter in Python to use the model properties
-        all_invoices = Invoice.objects.select_related(
-            'customer', 'warehouse', 'invoice_type', 'payment_method'
-        ).prefetch_related('invoiceitem_set').order_by('-created_at', 'id')
-        
-        # Filter invoices that have outstanding payments (not fully paid)
-        outstanding_invoices = []
-        for invoice in all_invoices:
-            if not invoice.is_fully_paid:
-                outstanding_invoices.append(invoice.id)
-        
-        # Return filtered queryset
-        return Invoice.objects.filter(id__in=outstanding_invoices).select_related(
-            'customer', 'warehouse', 'invoice_type', 'payment_method'
-        ).prefetch_related('invoiceitem_set').order_by('-created_at', 'id')
+        # Totals are aggregated in SQL, so filtering happens before pagination
+        return Invoice.objects.outstanding().select_related(
+            *INVOICE_LIST_RELATED
+        ).order_by('-created_at', 'id')
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -823,7 +785,7 @@ class InvoicePaymentDebugView(APIView):
                 'id': invoice.id,
                 'composite_id': invoice.composite_id,
                 'customer': invoice.customer.institution_name if invoice.customer else 'No Customer',
-                'total_amount': float(invoice.total_amount),
+                'total_amount': float(invoice.calculated_total_amount),
                 'total_paid_amount': float(invoice.total_paid_amount),
                 'total_remaining_amount': float(invoice.total_remaining_amount),
                 'is_fully_paid': invoice.is_fully_paid,
@@ -958,7 +920,7 @@ class InvoiceDetailDebugView(APIView):
                     'name': invoice.payment_method.display_name_en if invoice.payment_method else None,
                     'value': invoice.payment_method.value if invoice.payment_method else None,
                 },
-                'total_amount': float(invoice.total_amount),
+                'total_amount': float(invoice.calculated_total_amount),
                 'total_paid_amount': float(invoice.total_paid_amount),
                 'total_remaining_amount': float(invoice.total_remaining_amount),
                 'payment_status_percentage': invoice.payment_status,
@@ -1050,15 +1012,30 @@ class ProductSalesStatsRecalculateView(APIView):
             )
 
 class ProductSalesStatsRecalculateAllView(APIView):
-    """Recalculate sales statistics for all products"""
+    """
+    Recalculate sales statistics for all products with the set-based engine.
+    Optional body: {"chunk_size": 5000} to process the catalog in chunks.
+    Large catalogs are better served by `manage.py sync_product_sales_stats --chunk-size N`.
+    """
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
+        chunk_size = request.data.get('chunk_size')
+        try:
+            chunk_size = int(chunk_size) if chunk_size not in (None, '') else None
+        except (TypeError, ValueError):
+            return Response({"error": "chunk_size must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if chunk_size is not None and chunk_size <= 0:
+            return Response({"error": "chunk_size must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            updated_count = ProductSalesStats.recalculate_all()
+            report = ProductSalesStats.rebuild(chunk_size=chunk_size)
             return Response({
-                "message": f"Statistics recalculated for {updated_count} products",
-                "updated_count": updated_count
+                "message": f"Statistics recalculated for {report['products']} products",
+                "updated_count": report['products'],
+                "reset_count": report['reset'],
+                "chunks": report['chunks'],
+                "duration_ms": report['duration_ms'],
             }, status=status.HTTP_200_OK)
         except Exception as e:
             return Response(
@@ -1106,308 +1083,31 @@ class CalculateRoyaltiesView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        from inventory.models import Contract, Project
+
         try:
-            from inventory.models import Contract, Product, Project
-            from django.db.models import Avg
-            
-            contract = None
-            project = None
-            product = None
-            
             # Priority: contract_id > project_id
             if contract_id:
-                # Get contract and derive project/product from it
-                contract = Contract.objects.select_related(
-                    'project', 'royalties_type'
-                ).get(id=contract_id)
-                project = contract.project
-                
-                # Get product from project
-                # Project can be converted to product, so check if product exists for this project
-                try:
-                    product = Product.objects.get(project=project)
-                except Product.DoesNotExist:
-                    return Response(
-                        {"error": f"No product found for project ID {project.id}. Project must be converted to product first."},
-                        status=status.HTTP_404_NOT_FOUND
-                    )
-                except Product.MultipleObjectsReturned:
-                    # If multiple products, get the first one (or you might want to return an error)
-                    product = Product.objects.filter(project=project).first()
-                    
-            elif project_id:
-                # Get project and derive product from it
+                contract = Contract.objects.select_related('project', 'royalties_type').get(id=contract_id)
+            else:
                 project = Project.objects.get(id=project_id)
-                
-                # Get product from project
-                try:
-                    product = Product.objects.get(project=project)
-                except Product.DoesNotExist:
-                    return Response(
-                        {"error": f"No product found for project ID {project_id}. Project must be converted to product first."},
-                        status=status.HTTP_404_NOT_FOUND
-                    )
-                except Product.MultipleObjectsReturned:
-                    product = Product.objects.filter(project=project).first()
-                
-                # Try to get contract for this project (optional, but needed for calculation)
-                contract = Contract.objects.filter(project=project).first()
+                contract = Contract.objects.select_related('project', 'royalties_type').filter(
+                    project=project
+                ).order_by('pk').first()
                 if not contract:
+                    if not Product.objects.filter(project=project).exists():
+                        return Response(
+                            {"error": f"No product found for project ID {project_id}. Project must be converted to product first."},
+                            status=status.HTTP_404_NOT_FOUND
+                        )
                     return Response(
                         {"error": f"No contract found for project ID {project_id}. Contract is required for calculation."},
                         status=status.HTTP_404_NOT_FOUND
                     )
-            
-            # Get ProductSalesStats for actual (paid books)
-            # If not found, automatically calculate it
-            try:
-                stats = ProductSalesStats.objects.get(product=product)
-                actual_paid = stats.actual
-            except ProductSalesStats.DoesNotExist:
-                # Auto-recalculate stats for this product if they don't exist
-                try:
-                    stats = ProductSalesStats.calculate_for_product(product)
-                    actual_paid = stats.actual
-                except Exception as e:
-                    return Response(
-                        {"error": f"Failed to calculate sales statistics for product ID {product.id}: {str(e)}"},
-                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                    )
-            
-            # Get PrintRun for this product to get the price
-            # A product can have multiple PrintRuns (different editions), so get the latest one
-            from inventory.models import PrintRun
-            print_run = PrintRun.objects.filter(product=product).order_by('-edition_number', '-published_at').first()
-            
-            if not print_run:
-                return Response(
-                    {"error": f"No PrintRun found for product ID {product.id}. PrintRun is required to get price."},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-            
-            # Validate required fields
-            if contract.fixed_amount is None:
-                return Response(
-                    {"error": "Contract fixed_amount (advance payment) is required"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            if contract.commission_percent is None or contract.commission_percent == 0:
-                return Response(
-                    {"error": "Contract commission_percent (royalty percentage) is required and must be > 0"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            if print_run.price is None or print_run.price == 0:
-                return Response(
-                    {"error": f"PrintRun price is required and must be > 0 for PrintRun ID {print_run.id}"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Check royalties_type first - retail_price has different calculation logic
-            if not contract.royalties_type:
-                return Response(
-                    {"error": "Contract royalties_type is required"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            royalties_type_id = contract.royalties_type.id
-            
-            # Handle retail_price (id=53) separately - different calculation path
-            if royalties_type_id == 53:  # retail_price
-                # Get sum of invoice_paid_amount from Payment table
-                # Get all invoices that have InvoiceItems for this product
-                invoices_with_product = Invoice.objects.filter(
-                    invoiceitem__product=product
-                ).distinct()
-                
-                # Get the latest payment for each invoice and sum their invoice_paid_amount
-                # This gives us the total paid amount for each invoice (not double counting)
-                sum_paid_amount = Decimal('0')
-                for invoice in invoices_with_product:
-                    latest_payment = Payment.objects.filter(
-                        invoice=invoice
-                    ).order_by('-created_at', '-id').first()
-                    if latest_payment and latest_payment.invoice_paid_amount:
-                        sum_paid_amount += Decimal(str(latest_payment.invoice_paid_amount))
-                
-                # Compare with advance payment (fixed_amount)
-                fixed_amount_value = Decimal(str(contract.fixed_amount))
-                
-                if sum_paid_amount < fixed_amount_value:
-                    return Response({
-                        "eligible": False,
-                        "RA": None,
-                        "reason": f"Sum of paid amount ({float(sum_paid_amount)}) is less than advance payment ({float(fixed_amount_value)})",
-                        "details": {
-                            "sum_paid_amount": float(sum_paid_amount),
-                            "fixed_amount": float(fixed_amount_value),
-                            "royalties_type_id": royalties_type_id,
-                            "royalties_type": contract.royalties_type.value
-                        }
-                    }, status=status.HTTP_200_OK)
-                
-                # Calculate Z = sum - advance payment
-                Z = sum_paid_amount - fixed_amount_value
-                Z_float = float(Z)
-                Z_int = int(Z_float) if Z_float.is_integer() else Z_float
-                
-                # Calculate RA = Z × (commission_percent/100)
-                commission_as_decimal = Decimal(str(contract.commission_percent)) / Decimal('100')
-                RA = Z * commission_as_decimal
-                
-                return Response({
-                    "eligible": True,
-                    "RA": float(RA.quantize(Decimal('0.01'))),
-                    "currency": "$",
-                    "details": {
-                        "sum_paid_amount": float(sum_paid_amount),
-                        "fixed_amount": float(fixed_amount_value),
-                        "Z": Z_int,
-                        "commission_percent": float(contract.commission_percent),
-                        "royalties_type_id": royalties_type_id,
-                        "royalties_type": contract.royalties_type.value
-                    }
-                }, status=status.HTTP_200_OK)
-            
-            # For list_price (id=52), continue with the existing X, Y calculation
-            # Step 1: Calculate X = fixed_amount / (commission_percent / price)
-            # This simplifies to: X = fixed_amount × (price / commission_percent)
-            # commission_percent is stored as percentage whole number (e.g., 5.00 for 5%)
-            commission_percent_value = Decimal(str(contract.commission_percent))
-            price_value = Decimal(str(print_run.price))
-            fixed_amount_value = Decimal(str(contract.fixed_amount))
-            
-            # X = fixed_amount / (commission_percent / price)
-            # X = fixed_amount × (price / commission_percent)
-            # Note: commission_percent is used as-is (e.g., 5.00), not divided by 100 here
-            X = fixed_amount_value * (price_value / commission_percent_value)
-            # Convert X to int if it's a whole number (it represents count of books)
-            # Remove decimal places for display if it's a whole number
-            X_float = float(X)
-            X_int = int(X_float) if X_float.is_integer() else X_float
-            
-            # Step 2: Compare X with actual (paid books)
-            if X > actual_paid:
-                return Response({
-                    "eligible": False,
-                    "RA": None,
-                    "reason": f"X ({X_int}) is greater than actual paid books ({actual_paid})",
-                    "details": {
-                        "X": X_int,
-                        "actual_paid": actual_paid,
-                        "fixed_amount": float(contract.fixed_amount),
-                        "commission_percent": float(contract.commission_percent),
-                        "price": float(print_run.price),
-                        "print_run_id": print_run.id,
-                        "edition_number": print_run.edition_number
-                    }
-                }, status=status.HTTP_200_OK)
-            
-            # Step 3: Calculate Y = actual - X - free_copies - (100% descount on the price copies)
-            # Sum free_copies from ALL contracts for this project/product
-            # A product can have multiple contracts, and we need to account for all free copies
-            all_contracts = Contract.objects.filter(project=project)
-            free_copies = sum(
-                (c.free_copies or 0 for c in all_contracts),
-                0
-            )
-            Y = actual_paid - X - free_copies
-            # Convert Y to int if it's a whole number (it represents count of books)
-            Y_float = float(Y)
-            Y_int = int(Y_float) if Y_float.is_integer() else Y_float
-            
-            # If Y is negative or zero, no royalties
-            if Y <= 0:
-                return Response({
-                    "eligible": False,
-                    "RA": None,
-                    "reason": f"Y ({Y_int}) is less than or equal to 0 after subtracting X and free copies",
-                    "details": {
-                        "X": X_int,
-                        "actual_paid": actual_paid,
-                        "free_copies": free_copies,
-                        "Y": Y_int
-                    }
-                }, status=status.HTTP_200_OK)
-            
-            # Step 4: Calculate RA for list_price (id=52)
-            # commission_percent is stored as percentage whole number (e.g., 5.00 for 5%)
-            # So we divide by 100 to get decimal form (0.05)
-            commission_as_decimal = Decimal(str(contract.commission_percent)) / Decimal('100')
-            
-            # Initialize variables for response
-            sum_price_transactions = None
-            
-            if royalties_type_id == 52:  # list_price
-                # RA = Y × sum(printrun.price × number_of_transactions) × (commission_percent/100)
-                # Get all PrintRuns for this product
-                print_runs = PrintRun.objects.filter(product=product).order_by('published_at', 'edition_number')
-                
-                if not print_runs.exists():
-                    return Response(
-                        {"error": "No PrintRuns found for this product. PrintRuns are required for list_price calculation."},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Calculate sum of (printrun.price × number_of_transactions) for each PrintRun
-                # For each PrintRun, count InvoiceItems created on or after its published_at date
-                # and before the next PrintRun's published_at (or current date if it's the latest)
-                from django.utils import timezone
-                from datetime import datetime, timedelta
-                
-                sum_price_transactions = Decimal('0')
-                
-                for i, print_run in enumerate(print_runs):
-                    # Get the start date (this PrintRun's published_at)
-                    start_date = timezone.make_aware(
-                        datetime.combine(print_run.published_at, datetime.min.time())
-                    )
-                    
-                    # Get the end date (next PrintRun's published_at, or current date if last)
-                    if i + 1 < len(print_runs):
-                        next_print_run = print_runs[i + 1]
-                        end_date = timezone.make_aware(
-                            datetime.combine(next_print_run.published_at, datetime.min.time())
-                        )
-                    else:
-                        # Last PrintRun - use current date
-                        end_date = timezone.now()
-                    
-                    # Count InvoiceItems for this product created in this date range
-                    transaction_count = InvoiceItem.objects.filter(
-                        product=product,
-                        created_at__gte=start_date,
-                        created_at__lt=end_date
-                    ).count()
-                    
-                    # Add: printrun.price × transaction_count
-                    sum_price_transactions += Decimal(str(print_run.price)) * Decimal(str(transaction_count))
-                
-                # RA = Y × sum(printrun.price × number_of_transactions) × (commission_percent/100)
-                RA = Y * sum_price_transactions * commission_as_decimal
-            else:
-                return Response(
-                    {"error": f"Invalid royalties_type ID {royalties_type_id}. Expected 52 (list_price) or 53 (retail_price)"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            return Response({
-                "eligible": True,
-                "RA": float(RA.quantize(Decimal('0.01'))),
-                "currency": "$",
-                "details": {
-                    "X": X_int,
-                    "Y": Y_int,
-                    "actual_paid": actual_paid,
-                    "free_copies": free_copies,
-                    "royalties_type_id": royalties_type_id,
-                    "royalties_type": contract.royalties_type.value if contract.royalties_type else None,
-                    "commission_percent": float(contract.commission_percent),
-                    "sum_price_transactions": float(sum_price_transactions) if royalties_type_id == 52 else None
-                }
-            }, status=status.HTTP_200_OK)
-            
+
+            status_code, payload = RoyaltyEngine([contract]).calculate(contract)
+            return Response(payload, status=status_code)
+
         except Contract.DoesNotExist:
             return Response(
                 {"error": f"Contract with ID {contract_id} not found"},
@@ -1422,4 +1122,59 @@ class CalculateRoyaltiesView(APIView):
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_400_BAD_REQUEST
-            )
\ No newline at end of file
+            )
+
+
+class BatchCalculateRoyaltiesView(APIView):
+    """
+    Calculate royalties for many contracts in one request (quarterly statements).
+
+    Input (all optional):
+    - contract_ids: list of contract ids; defaults to every active (not closed) contract
+    - include_closed: also include closed contracts when contract_ids is omitted
+
+    Each result carries the same payload as /calculate-royalties/ plus
+    contract_id, project_id and the HTTP status that endpoint would return.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        from inventory.models import Contract
+
+        contract_ids = request.data.get('contract_ids')
+        if contract_ids is not None:
+            if not isinstance(contract_ids, list):
+                return Response({"error": "contract_ids must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                contract_ids = [int(pk) for pk in contract_ids]
+            except (TypeError, ValueError):
+                return Response({"error": "contract_ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+            contracts = Contract.objects.select_related('project', 'royalties_type').filter(
+                id__in=contract_ids
+            ).order_by('id')
+        elif request.data.get('include_closed'):
+            contracts = Contract.objects.select_related('project', 'royalties_type').order_by('id')
+        else:
+            contracts = active_contracts()
+
+        results = []
+        total_ra = Decimal('0')
+        for contract, status_code, payload in RoyaltyEngine(contracts).calculate_all():
+            results.append({
+                "contract_id": contract.id,
+                "project_id": contract.project_id,
+                "status": status_code,
+                **payload,
+            })
+            if payload.get("eligible"):
+                total_ra += Decimal(str(payload["RA"]))
+
+        found = {row["contract_id"] for row in results}
+        missing = [pk for pk in (contract_ids or []) if pk not in found]
+        return Response({
+            "count": len(results),
+            "eligible_count": sum(1 for row in results if row.get("eligible")),
+            "total_RA": float(total_ra.quantize(Decimal('0.01'))),
+            "missing_contract_ids": missing,
+            "results": results,
+        }, status=status.HTTP_200_OK)